@@ -10,18 +10,25 @@ import os
 import sys
 import time
 import base64
+import signal
 import logging
 import argparse
 import configparser
-import urllib3
 import requests
 import json
+import arris_stats_html
+import arris_stats_records
+import arris_stats_auth
+import arris_stats_fanout
+import arris_stats_metrics
+import arris_stats_retry
+import arris_stats_scheduler
 
 # To add a new modem, add the model below
 # Create a new file src/arris_stats_themodel.py and a parse_html_themodel.py function
-# Use a debugger and set a break point just after the html = get_html(config, credential) line
+# Use a debugger and set a break point just after the html, session_rejected = get_status_page(config, token, session) line
 # Set another break point just after the  stats = parse_html_function(html) line
-# Save the raw html to tests/mockups/themodel.html
+# Save the raw html to tests/mockups/themodel.html (or poll with archive_dir set and take a page from the archive)
 # Save the stats dict as json to tests/mockups/themodel.json
 # The unittests will automatically pickup the new model, function, and mockups.  Ensure the tests pass with:
 # bash tests/run_tests.sh
@@ -31,6 +38,14 @@ modems_supported = [
     't25'
 ]
 
+destinations_supported = [
+    'influxdb',
+    'timestream',
+    'splunk',
+    'prometheus',
+    'stdout_json'
+]
+
 
 def main():
     """ MAIN """
@@ -41,73 +56,346 @@ def main():
 
     init_logger(args.log_level or config.get('log_level'))
 
-    sleep_interval = int(config['sleep_interval'])
-    destination = config['destination']
+    # Docker stops containers with SIGTERM, exit cleanly so the destinations get flushed
+    signal.signal(signal.SIGTERM, handle_sigterm)
 
     # Disable the SSL warnings if we're not verifying SSL
     if not config['modem_verify_ssl']:
+        import urllib3  # pylint: disable=import-outside-toplevel
         urllib3.disable_warnings()
 
-    # SB8200 requires authentication on Comcast now
-    token = None
-    session = requests.Session()
+    if args.once:
+        if config['fleet_inventory']:
+            error_exit('--once can\'t be used with fleet_inventory', sleep=False)
+
+        # Whatever runs us again will do the waiting, there's no point sleeping before exiting
+        config['sleep_before_exit'] = False
+
+    polled = True
+    try:
+        # Poll every modem in the inventory from this process instead of just the one in config
+        if config['fleet_inventory']:
+            import arris_stats_fleet  # pylint: disable=import-outside-toplevel
+            arris_stats_fleet.run_fleet(config)
+        elif args.once:
+            polled = poll_once(config)
+        else:
+            poll_forever(config)
+    finally:
+        close_destinations()
+
+    # Let cron / systemd know if anything went wrong
+    if args.once and (not polled or arris_stats_metrics.get_total('sink_errors')):
+        sys.exit(1)
+
+
+def poll_forever(config):
+    """ Fetch, parse and send the stats for the modem in config every sleep_interval """
+    scheduler = arris_stats_scheduler.Scheduler(config['sleep_interval'], config['poll_jitter'])
+
+    # SB8200 requires authentication on Comcast now.  The session is reused from the last run if it was saved
+    state = arris_stats_auth.load_session(config)
 
-    first = True
     while True:
-        if not first:
-            logging.info('Sleeping for %s seconds', sleep_interval)
-            sys.stdout.flush()
-            time.sleep(sleep_interval)
-        first = False
-
-        if config['modem_auth_required']:
-            while not token:
-                token_func = config['get_token_function'] or get_token
-                token = token_func(config, session)
-                if not token and config['exit_on_auth_error']:
-                    error_exit('Unable to authenticate with modem.  Exiting since exit_on_auth_error is True', config)
-                if not token:
-                    logging.info('Unable to obtain valid login session, sleeping for: %ss', sleep_interval)
-                    time.sleep(sleep_interval)
-
-        # Get the HTML from the modem
-        html = get_html(config, token, session)
+        sys.stdout.flush()
+        timestamp_ns = scheduler.wait()
+        poll(config, state, timestamp_ns)
+        if config['adaptive_polling']:
+            import arris_stats_adaptive  # pylint: disable=import-outside-toplevel
+            scheduler.set_interval(arris_stats_adaptive.get_interval(config))
+
+
+def poll_once(config):
+    """ Fetch, parse and send the stats once, for running from cron or a systemd timer.
+        Returns False if we didn't get any stats
+    """
+    state = arris_stats_auth.load_session(config)
+    polled = poll(config, state, time.time_ns())
+
+    # There's only the one poll, its window's summaries go out with it
+    flush_summaries()
+    # Wait for the sends, then try the spool's backlog since we won't be around for the replay thread to
+    arris_stats_fanout.close_sink_workers()
+    if 'arris_stats_spool' in sys.modules:
+        sys.modules['arris_stats_spool'].replay_spools()
+    return polled
+
+
+def poll(config, state, timestamp_ns):
+    """ Poll the modem while probing probe_targets, and send both.  Returns False if we didn't get any stats """
+    probing = start_probes(config)
+    polled = poll_stats(config, state, timestamp_ns, probing)
+    if not polled and probing:
+        send_probes(probing.wait(), timestamp_ns, config)
+    return polled
+
+
+def poll_stats(config, state, timestamp_ns, probing=None):
+    """ Log in if needed, then fetch, parse and queue the stats for the destinations, all within
+        poll_deadline.  Returns False if we didn't get any stats
+    """
+    breaker = arris_stats_retry.get_circuit_breaker(config)
+    if not breaker.allow():
+        logging.info('Circuit breaker is open after %s failed polls, skipping this one', breaker.consecutive_failures)
+        return False
+
+    with arris_stats_retry.deadline(config['poll_deadline'] or config['sleep_interval']):
+        try:
+            html, login_failed = fetch_html(config, state)
+        except requests.exceptions.RequestException as exception:
+            logging.error(exception)
+            html, login_failed = None, False
+
+        # Not being logged in is down to exit_on_auth_error and min_login_interval, not the modem's page
+        if login_failed:
+            logging.error('No login session, giving up until next interval')
+            return False
+        breaker.record(bool(html))
         if not html:
             if config['exit_on_html_error']:
                 error_exit('No HTML obtained from modem.  Exiting since exit_on_html_error is True', config)
             logging.error('No HTML to parse, giving up until next interval')
-            if config['clear_auth_token_on_html_error']:
-                logging.info('clear_auth_token_on_html_error is true, clearing credential token')
-                token = None
-                session = requests.Session()
-            continue
+            return False
+
+        archive_html(html, timestamp_ns, config)
+        if arris_stats_retry.deadline_passed():
+            logging.error('Poll deadline passed before parsing, giving up until next interval')
+            return False
 
         # Get the function reference from the config dict
         parse_html_function = config['parse_html_function']
-        stats = parse_html_function(html)
+        with arris_stats_metrics.timed('parse', config):
+            stats = parse_html_function(html, config['parser_backend'])
 
         if not stats or (not stats['upstream'] and not stats['downstream']):
             logging.error(
                 'Failed to get any stats, giving up until next interval')
-            continue
-
-        # Where should 6we send the results?
-        if destination == 'influxdb' and config['influx_major_version'] == 1:
-            import arris_stats_influx1  # pylint: disable=import-outside-toplevel
-            arris_stats_influx1.send_to_influx(stats, config)
-        elif destination == 'influxdb' and config['influx_major_version'] == 2:
-            import arris_stats_influx2  # pylint: disable=import-outside-toplevel
-            arris_stats_influx2.send_to_influx(stats, config)
-        elif destination == 'timestream':
-            import arris_stats_aws_timestream  # pylint: disable=import-outside-toplevel
-            arris_stats_aws_timestream.send_to_aws_time_stream(stats, config)
-        elif destination == 'splunk':
-            import arris_stats_splunk  # pylint: disable=import-outside-toplevel
-            arris_stats_splunk.send_to_splunk(stats, config)
-        elif destination == 'stdout_json':
-            print(json.dumps(stats))
-        else:
-            error_exit('Destination %s not supported!  Aborting.' % destination, sleep=False)
+            forget_modem_model(config)
+            return False
+
+        add_timestamp(stats, timestamp_ns, config)
+        adapt_interval(stats, config)
+        aggregate_stats(stats, config)
+        add_events(stats, fetch_events(config, state))
+        add_probes(stats, probing.wait() if probing else None)
+        # With aggregate_raw = False a poll that doesn't close a window has nothing left to send
+        if arris_stats_records.has_records(stats):
+            send_stats(stats, config)
+    return True
+
+
+def archive_html(html, timestamp_ns, config):
+    """ Save the page to archive_dir, if it's set.  A full disk shouldn't cost us the poll """
+    if not config['archive_dir']:
+        return
+    import arris_stats_archive  # pylint: disable=import-outside-toplevel
+    try:
+        arris_stats_archive.get_archive(config).add(html, timestamp_ns, config['modem_id'], config['modem_model'])
+    except OSError as exception:
+        logging.error('Failed to archive the page: %s', exception)
+
+
+def fetch_html(config, state):
+    """ Log in if we need to, then get the status page from the modem.  Returns (html, login_failed),
+        html is None if there was an error, login_failed is True if that's because we couldn't log in
+        or min_login_interval put the login off, rather than a problem getting the page
+    """
+    if config['modem_model'] == 'auto' and not detect_modem_model(config, state):
+        return None, False
+    if config['modem_auth_required'] and not state['token']:
+        delay = arris_stats_auth.get_login_delay(config, state)
+        if delay:
+            logging.info('Not logging in again for %.0fs, min_login_interval is %ss', delay, config['min_login_interval'])
+            return None, True
+        if not login(config, state):
+            if config['exit_on_auth_error']:
+                error_exit('Unable to authenticate with modem.  Exiting since exit_on_auth_error is True', config)
+            logging.error('Unable to obtain valid login session')
+            return None, True
+
+    with arris_stats_metrics.timed('fetch', config):
+        html, session_rejected = get_status_page(config, state['token'], state['session'])
+    if not html and session_rejected and config['clear_auth_token_on_html_error']:
+        logging.info('clear_auth_token_on_html_error is true, clearing credential token')
+        arris_stats_auth.clear_session(config, state)
+    return html, False
+
+
+def login(config, state):
+    """ Log in to the modem with its model's token function and save the new session in state.
+        Returns the token or None
+    """
+    token_func = config['get_token_function'] or get_token
+    state['last_login'] = time.time()
+    try:
+        with arris_stats_metrics.timed('login', config):
+            state['token'] = token_func(config, state['session'])
+    except requests.exceptions.RequestException as exception:
+        logging.error('Error logging in to the modem: %s', exception)
+        state['token'] = None
+    finally:
+        if not state['token']:
+            arris_stats_metrics.increment('failed_logins', config)
+        arris_stats_auth.save_session(config, state)
+    return state['token']
+
+
+def add_timestamp(stats, timestamp_ns, config):
+    """ Stamp freshly parsed stats with their poll time, work out the counter deltas and
+        add the collector statistics if they're enabled
+    """
+    stats['timestamp_ns'] = timestamp_ns
+    if config['counter_deltas']:
+        import arris_stats_counters  # pylint: disable=import-outside-toplevel
+        arris_stats_counters.add_deltas(stats, config)
+    if config['collector_statistics']:
+        stats['collector'] = arris_stats_metrics.get_collector_statistics(config)
+
+
+def fetch_events(config, state):
+    """ With event_log, get the modem's event log page and return the entries we haven't sent yet, or None """
+    if not config['event_log']:
+        return None
+    import arris_stats_events  # pylint: disable=import-outside-toplevel
+
+    # The event log is fetched just like the status page, with the same token and session
+    html, _ = get_status_page(dict(config, modem_url=arris_stats_events.get_event_log_url(config)), state['token'], state['session'])
+    if not html:
+        logging.error('Failed to get the event log, trying again next poll')
+        return None
+    return arris_stats_events.get_new_events(html, config)
+
+
+def add_events(stats, events):
+    """ Send any new event log entries along with the stats """
+    if events:
+        stats['events'] = events
+
+
+def aggregate_stats(stats, config):
+    """ With aggregate_window, add the channel summaries of any window the poll closed, and drop
+        the raw channels unless aggregate_raw
+    """
+    if config['aggregate_window']:
+        import arris_stats_aggregate  # pylint: disable=import-outside-toplevel
+        arris_stats_aggregate.aggregate(stats, config)
+
+
+def start_probes(config):
+    """ Start probing probe_targets in the background if there are any, returns the ProbeRun or None """
+    if not config['probe_target_list']:
+        return None
+    import arris_stats_probe  # pylint: disable=import-outside-toplevel
+    return arris_stats_probe.ProbeRun(config)
+
+
+def add_probes(stats, probes):
+    """ Send the probe results along with the stats """
+    if probes:
+        stats['probes'] = probes
+
+
+def send_probes(probes, timestamp_ns, config):
+    """ Send the probe results on their own when there are no stats, they matter most when the modem is down """
+    if probes:
+        send_stats({'downstream': [], 'upstream': [], 'timestamp_ns': timestamp_ns, 'probes': probes}, config)
+
+
+def adapt_interval(stats, config):
+    """ With adaptive_polling, speed up or slow down polling depending on how the channels look """
+    if config['adaptive_polling']:
+        import arris_stats_adaptive  # pylint: disable=import-outside-toplevel
+        arris_stats_adaptive.observe(stats, config)
+
+
+def send_stats(stats, config):
+    """ Queue the stats for every configured destination.  The sends happen on each destination's
+        own thread, so this only waits if a destination's queue is full and its policy is block, and
+        then no longer than the poll's deadline
+    """
+    # A blocking queue waits no longer than what's left of the poll's deadline
+    timeout = arris_stats_retry.get_remaining()
+    for destination in config['destinations']:
+        arris_stats_fanout.get_sink_worker(destination, config, send_to_destination).put(stats, config, timeout if timeout is None else max(0, timeout))
+
+
+def send_to_destination(stats_list, config):
+    """ Send the stats from one or more polls to config['destination'], through the spool if there is one.
+        Returns True if the destination took them
+    """
+    sent = False
+    try:
+        with arris_stats_metrics.timed('send', config, config['destination']):
+            if config['spool_dir']:
+                import arris_stats_spool  # pylint: disable=import-outside-toplevel
+                spool = arris_stats_spool.get_spool(config, send_stats_batch)
+                sent = spool.send_all(stats_list)
+            else:
+                sent = send_stats_batch(stats_list, config)
+    finally:
+        if not sent:
+            arris_stats_metrics.increment('sink_errors', config, config['destination'])
+    return sent
+
+
+def send_stats_batch(stats_list, config):
+    """ Send the stats from one or more polls to config['destination'] in as few writes as it allows.
+        Returns True if the destination took them
+    """
+    destination = config['destination']
+
+    # Where should we send the results?
+    if destination == 'influxdb' and config['influx_major_version'] == 1:
+        import arris_stats_influx1  # pylint: disable=import-outside-toplevel
+        return arris_stats_influx1.send_batch_to_influx(stats_list, config)
+    if destination == 'influxdb' and config['influx_major_version'] == 2:
+        import arris_stats_influx2  # pylint: disable=import-outside-toplevel
+        return arris_stats_influx2.send_batch_to_influx(stats_list, config)
+    if destination == 'timestream':
+        import arris_stats_aws_timestream  # pylint: disable=import-outside-toplevel
+        return arris_stats_aws_timestream.send_batch_to_aws_time_stream(stats_list, config)
+    if destination == 'splunk':
+        import arris_stats_splunk  # pylint: disable=import-outside-toplevel
+        return arris_stats_splunk.send_batch_to_splunk(stats_list, config)
+    if destination == 'prometheus':
+        import arris_stats_prometheus  # pylint: disable=import-outside-toplevel
+        return arris_stats_prometheus.send_batch_to_prometheus(stats_list, config)
+    if destination == 'stdout_json':
+        for stats in stats_list:
+            stats_dict = arris_stats_records.stats_to_dict(stats)
+            if config['modem_id']:
+                stats_dict['modem_id'] = config['modem_id']
+            print(json.dumps(stats_dict))
+        return True
+
+    error_exit('Destination %s not supported!  Aborting.' % destination, sleep=False)
+    return False
+
+
+def flush_summaries():
+    """ With aggregate_window, send the summaries of the windows that haven't closed yet, so the last one isn't lost """
+    if 'arris_stats_aggregate' in sys.modules:
+        for stats, config in sys.modules['arris_stats_aggregate'].flush_aggregators():
+            send_stats(stats, config)
+
+
+def close_destinations():
+    """ Send the open aggregation windows, then flush and close the long lived clients of any destination
+        we've sent to, the spools and the page archive
+    """
+    flush_summaries()
+    close_functions = [
+        ('arris_stats_fanout', 'close_sink_workers'),
+        ('arris_stats_influx1', 'close_influx_writers'),
+        ('arris_stats_influx2', 'close_influx_writers'),
+        ('arris_stats_splunk', 'close_splunk_sessions'),
+        ('arris_stats_prometheus', 'close_exporters'),
+        ('arris_stats_archive', 'close_archives'),
+        ('arris_stats_spool', 'close_spools'),
+    ]
+    for module_name, close_function in close_functions:
+        if module_name in sys.modules:
+            getattr(sys.modules[module_name], close_function)()
 
 
 def get_args():
@@ -115,6 +403,7 @@ def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('--config', metavar='config_file_path', help='Path to config file', required=False)
     parser.add_argument('--debug', help='Enable debug logging', action='store_true', required=False, default=False)
+    parser.add_argument('--once', help='Poll the modem once and exit, for running from cron or a systemd timer', action='store_true', required=False, default=False)
     parser.add_argument('--log-level', help='Set log_level', action='store', type=str.lower, required=False, choices=["debug", "info", "warning", "error"])
     args = parser.parse_args()
     if args.debug:
@@ -128,17 +417,71 @@ def get_default_config():
         # Main
         'log_level': "info",
         'destination': 'influxdb',
+        'destination_queue_size': 100,
+        'destination_queue_policy': 'drop_oldest',
         'sleep_interval': 300,
+        'poll_jitter': 0,
+        'adaptive_polling': False,
+        'adaptive_min_interval': 10,
+        'adaptive_backoff': 2,
+        'adaptive_uncorrectables': 1,
+        'adaptive_snr_drop': 3,
+        'adaptive_power_change': 3,
         'modem_url': 'https://192.168.100.1/cmconnectionstatus.html',
         'modem_verify_ssl': False,
         'modem_auth_required': False,
         'modem_username': 'admin',
         'modem_password': None,
         'modem_model': 'sb8200',
+        'modem_id': None,
+        'parser_backend': 'beautifulsoup',
         'exit_on_auth_error': True,
         'exit_on_html_error': True,
         'clear_auth_token_on_html_error': True,
+        'min_login_interval': 60,
+        'modem_connect_timeout': 5,
+        'modem_read_timeout': 30,
+        'modem_retries': 2,
+        'modem_retry_backoff': 1,
+        'poll_deadline': 0,
+        'circuit_breaker_failures': 5,
+        'circuit_breaker_cooldown': 300,
+        'auth_state_dir': None,
         'sleep_before_exit': True,
+        'collector_statistics': False,
+
+        # Fleet
+        'fleet_inventory': None,
+        'fleet_max_fetches': 16,
+
+        # Event log
+        'event_log': False,
+        'event_log_state_dir': None,
+
+        # Aggregation
+        'aggregate_window': 0,
+        'aggregate_raw': True,
+        'aggregate_samples': 60,
+        'aggregate_zscore': 3,
+
+        # Probes
+        'probe_targets': None,
+        'probe_timeout': 2,
+
+        # Spool
+        'spool_dir': None,
+        'spool_max_bytes': 104857600,
+        'spool_replay_batch': 1000,
+        'spool_replay_interval': 30,
+
+        # Counters
+        'counter_deltas': False,
+        'counter_state_dir': None,
+
+        # Archive
+        'archive_dir': None,
+        'archive_max_bytes': 1073741824,
+        'archive_compression': 'gzip',
 
         # Influx
         'influx_major_version': 1,
@@ -149,10 +492,15 @@ def get_default_config():
         'influx_password': None,
         'influx_use_ssl': False,
         'influx_verify_ssl': True,
+        'influx_gzip': True,
+        'influx_batch_cycles': 1,
         'influx_org': None,
         'influx_url': 'http://localhost:8086',
         'influx_bucket': 'cable_modem_stats',
         'influx_token': None,
+        'influx_write_mode': 'synchronous',
+        'influx_batch_size': 1000,
+        'influx_flush_interval': 10000,
 
         # AWS Timestream
         'timestream_aws_access_key_id': None,
@@ -167,7 +515,12 @@ def get_default_config():
         'splunk_port': 8088,
         'splunk_ssl': False,
         'splunk_verify_ssl': True,
-        'splunk_source': 'arris_cable_modem_stats'
+        'splunk_source': 'arris_cable_modem_stats',
+
+        # Prometheus
+        'prometheus_host': '0.0.0.0',
+        'prometheus_port': 9393,
+        'prometheus_max_age': 900
     }
 
 
@@ -198,34 +551,130 @@ def get_config(config_path=None):
             if os.environ.get(param):
                 config[param] = os.environ.get(param)
 
+    return normalize_config(config)
+
+
+def normalize_config(config):
+    """ Convert string values to the type of their default, then look up
+        the parse and token functions for the modem model
+    """
+    default_config = get_default_config()
+
     # Special handling depending ontype
-    for param in config:
+    for param in default_config:
 
         # If the default value is a boolean, but we have a string, convert it
         if isinstance(default_config[param], bool) and isinstance(config[param], str):
             config[param] = str_to_bool(string=config[param], name=param)
 
         # If the default value is an int, but we have a string, convert it
+        # A decimal point gets a float instead, for things like sub-second intervals
         if isinstance(default_config[param], int) and isinstance(config[param], str):
-            config[param] = int(config[param])
+            if '.' in config[param]:
+                config[param] = float(config[param])
+            else:
+                config[param] = int(config[param])
 
         # Finally any 'None' string should just be None
         if default_config[param] is None and config[param] == 'None':
             config[param] = None
 
-        # Ensure model model is supported
-        if config['modem_model'] not in modems_supported:
-            raise RuntimeError('Model model %s not supported!' % config['modem_model'])
+    # Ensure model model is supported
+    if config['modem_model'] not in modems_supported + ['auto']:
+        raise RuntimeError('Model model %s not supported!' % config['modem_model'])
+
+    if config['parser_backend'] not in arris_stats_html.parser_backends_supported:
+        raise RuntimeError('Parser backend %s not supported!' % config['parser_backend'])
+
+    # destination can be a comma separated list, every destination gets every poll
+    config['destinations'] = [destination.strip() for destination in config['destination'].split(',') if destination.strip()]
+    for destination in config['destinations']:
+        if destination not in destinations_supported:
+            raise RuntimeError('Destination %s not supported!' % destination)
+
+    # destination_queue_policy is one policy for every destination, and / or destination:policy pairs
+    config['destination_queue_policies'] = {}
+    default_policy = 'drop_oldest'
+    for entry in config['destination_queue_policy'].split(','):
+        destination, _, policy = entry.strip().rpartition(':')
+        if policy not in arris_stats_fanout.queue_policies_supported:
+            raise RuntimeError('Destination queue policy %s not supported!' % policy)
+        if destination:
+            config['destination_queue_policies'][destination] = policy
+        else:
+            default_policy = policy
+    for destination in config['destinations']:
+        config['destination_queue_policies'].setdefault(destination, default_policy)
+
+    # The spool acknowledges a poll once the destination says it has it, buffered lines haven't been written yet
+    if config['spool_dir'] and 'influxdb' in config['destinations']:
+        if config['influx_batch_cycles'] > 1 or (config['influx_major_version'] == 2 and config['influx_write_mode'] == 'batching'):
+            raise RuntimeError('spool_dir can\'t be used with influx_batch_cycles above 1 or influx_write_mode = batching, the spool already batches its replays')
+
+    # Summaries need numpy, which isn't in requirements.txt since the alpine image has no wheel for it
+    if config['aggregate_window']:
+        try:
+            import arris_stats_aggregate  # pylint: disable=import-outside-toplevel,unused-import
+        except ImportError as exception:
+            raise RuntimeError('aggregate_window needs numpy, install it with pip install numpy') from exception
+
+    # Checked now rather than on the first poll, where it would stop polling for good
+    if config['archive_dir']:
+        import arris_stats_archive  # pylint: disable=import-outside-toplevel
+        arris_stats_archive.check_compression(config['archive_compression'])
+
+    # probe_targets is a comma separated list of tcp:host:port, dns:name and http(s):// urls
+    config['probe_target_list'] = []
+    if config['probe_targets']:
+        import arris_stats_probe  # pylint: disable=import-outside-toplevel
+        config['probe_target_list'] = arris_stats_probe.get_targets(config['probe_targets'])
+
+    # An auto model is worked out from the modem's page on the first poll, see detect_modem_model()
+    config['modem_model_detected'] = False
+    if config['modem_model'] == 'auto':
+        config['parse_html_function'] = None
+        config['get_token_function'] = None
+    else:
+        set_modem_model(config, config['modem_model'])
+    return config
+
+
+def set_modem_model(config, model):
+    """ Set the model and look up its parse and token functions """
+    config['modem_model'] = model
 
     # This gets the correct function to use to parse the modem's html based on model
     # If you're adding new modems and get an error about no module, create src/arris_stats_yourmodel.py
-    module = __import__('arris_stats_' + config['modem_model'])
-    config['parse_html_function'] = getattr(module, 'parse_html_' + config['modem_model'])
+    module = __import__('arris_stats_' + model)
+    config['parse_html_function'] = getattr(module, 'parse_html_' + model)
     try:
-        config['get_token_function'] = getattr(module, 'get_token_' + config['modem_model'])
+        config['get_token_function'] = getattr(module, 'get_token_' + model)
     except AttributeError:
         config['get_token_function'] = None
-    return config
+
+
+def detect_modem_model(config, state):
+    """ For modem_model = auto, work out the model from the modem's page and set it in config,
+        so later polls skip this.  Returns False if we can't tell what the modem is
+    """
+    import arris_stats_detect  # pylint: disable=import-outside-toplevel
+    model = arris_stats_detect.detect_model(config, state['session'])
+    if not model:
+        return False
+    set_modem_model(config, model)
+    config['modem_model_detected'] = True
+    return True
+
+
+def forget_modem_model(config):
+    """ If the model was detected and its parser got nothing from the page, detect it again next poll """
+    if not config['modem_model_detected']:
+        return
+    import arris_stats_detect  # pylint: disable=import-outside-toplevel
+    logging.warning('No stats from the %s parser, working out the modem model again next poll', config['modem_model'])
+    arris_stats_detect.forget_model(config)
+    config['modem_model'] = 'auto'
+    config['modem_model_detected'] = False
 
 
 def get_token(config, session):
@@ -252,7 +701,8 @@ def get_token(config, session):
     # have to send as a get parameter with subsequent requests
     # Requests will automatically handle the session cookies
     try:
-        resp = session.get(auth_url, headers={'Authorization': 'Basic ' + auth_hash}, verify=verify_ssl)
+        # Never retried, too many logins lock the SB8200 up
+        resp = arris_stats_retry.modem_request(config, session, 'GET', auth_url, retries=0, headers={'Authorization': 'Basic ' + auth_hash}, verify=verify_ssl)
         if resp.status_code != 200:
             logging.error('Error authenticating with %s', url)
             logging.error('Status code: %s', resp.status_code)
@@ -265,6 +715,7 @@ def get_token(config, session):
         return None
 
     if 'Password:' in resp.text:
+        arris_stats_metrics.increment('login_pages', config)
         logging.error('Authentication error, received login page.  Check username / password.  SB8200 has some kind of bug that can cause this after too many authentications, the only known fix is to reboot the modem.')
         return None
 
@@ -276,6 +727,14 @@ def get_html(config, token, session):
     """ Get the status page from the modem
         return the raw html
     """
+    return get_status_page(config, token, session)[0]
+
+
+def get_status_page(config, token, session):
+    """ Get the status page from the modem, returns (html, session_rejected).
+        html is None if there was an error, session_rejected is True if that's because
+        the modem wants us to log in again rather than a network or server problem
+    """
 
     if config['modem_auth_required']:
         url = config['modem_url'] + '?ct_' + token
@@ -289,26 +748,33 @@ def get_html(config, token, session):
     logging.debug('Full url: %s', url)
 
     try:
-        resp = session.get(url, verify=verify_ssl)
+        resp = arris_stats_retry.modem_request(config, session, 'GET', url, verify=verify_ssl)
         if resp.status_code != 200:
             logging.error('Error retreiving html from %s', url)
             logging.error('Status code: %s', resp.status_code)
             logging.error('Reason: %s', resp.reason)
-            return None
+            return None, resp.status_code in [401, 403]
         status_html = resp.content.decode("utf-8")
         resp.close()
     except Exception as exception:
         logging.error(exception)
         logging.error('Error retreiving html from %s', url)
-        return None
+        return None, False
 
     if 'Password:' in status_html:
+        arris_stats_metrics.increment('login_pages', config)
         logging.error('Authentication error, received login page.  This can happen once when a new session is established and you should let it retry, but if it persists then check username / password.')
         if not config['modem_auth_required']:
             logging.warning('You have modem_auth_required to False, but a login page was detected!')
-        return None
+        return None, True
+
+    return status_html, False
+
 
-    return status_html
+def handle_sigterm(signum, frame):  # pylint: disable=unused-argument
+    """ Turn SIGTERM into a normal exit so main() gets to close the destinations """
+    logging.info('Received SIGTERM, exiting')
+    sys.exit(0)
 
 
 def error_exit(message, config=None, sleep=True):
@@ -0,0 +1,94 @@
+"""
+    Poll faster while the line is misbehaving, for adaptive_polling = True
+
+    https://github.com/andrewfraley/arris_cable_modem_stats
+
+    Every poll's stats are compared with the previous poll's.  New uncorrectables, a
+    downstream SNR drop or an upstream power swing past their thresholds drop the modem's
+    interval straight to adaptive_min_interval, to catch the rest of the event.  Each poll
+    after that with nothing to report multiplies the interval by adaptive_backoff until
+    it's back to sleep_interval.
+"""
+# pylint: disable=line-too-long
+
+import logging
+import threading
+
+# modem_id -> ModemState
+modem_states = {}
+modem_states_lock = threading.Lock()
+
+
+class ModemState:
+    """ The last poll's channel readings and the interval we're polling the modem at """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.downstream = {}
+        self.upstream = {}
+
+
+def observe(stats, config):
+    """ Look for trouble in a poll's stats and work out the modem's next interval """
+    modem = config['modem_id'] or 'default'
+    with modem_states_lock:
+        if modem not in modem_states:
+            modem_states[modem] = ModemState(config['sleep_interval'])
+        state = modem_states[modem]
+
+    reasons = get_reasons(stats, state, config)
+    state.downstream = {channel.channel_id: channel for channel in stats['downstream']}
+    state.upstream = {channel.channel_id: channel for channel in stats['upstream']}
+
+    if reasons:
+        if state.interval > config['adaptive_min_interval']:
+            logging.warning('%s, polling every %ss until it settles down', ', '.join(reasons), config['adaptive_min_interval'])
+        state.interval = config['adaptive_min_interval']
+    elif state.interval < config['sleep_interval']:
+        state.interval = min(config['sleep_interval'], state.interval * config['adaptive_backoff'])
+        if state.interval == config['sleep_interval']:
+            logging.info('Channels are stable again, back to polling every %ss', config['sleep_interval'])
+
+
+def get_interval(config):
+    """ Return the interval to poll the modem at next """
+    with modem_states_lock:
+        state = modem_states.get(config['modem_id'] or 'default')
+    return state.interval if state else config['sleep_interval']
+
+
+def get_reasons(stats, state, config):
+    """ Return a description of everything that crossed a threshold since the last poll """
+    reasons = []
+    for channel in stats['downstream']:
+        last = state.downstream.get(channel.channel_id)
+        # A channel that's new or moved to another frequency has nothing to compare with
+        if not last or last.frequency != channel.frequency:
+            continue
+
+        # Fields the model doesn't report are None
+        uncorrectables = get_change(last.uncorrectables, channel.uncorrectables)
+        if config['adaptive_uncorrectables'] and uncorrectables >= config['adaptive_uncorrectables']:
+            reasons.append('%s uncorrectables on downstream channel %s' % (uncorrectables, channel.channel_id))
+
+        snr_drop = -get_change(last.snr, channel.snr)
+        if config['adaptive_snr_drop'] and snr_drop >= config['adaptive_snr_drop']:
+            reasons.append('Downstream channel %s SNR dropped %.1f dB' % (channel.channel_id, snr_drop))
+
+    for channel in stats['upstream']:
+        last = state.upstream.get(channel.channel_id)
+        if not last:
+            continue
+
+        power_change = get_change(last.power, channel.power)
+        if config['adaptive_power_change'] and abs(power_change) >= config['adaptive_power_change']:
+            reasons.append('Upstream channel %s power changed %+.1f dBmV' % (channel.channel_id, power_change))
+
+    return reasons
+
+
+def get_change(last, current):
+    """ Return how much a reading went up since the last poll, 0 if either poll didn't have it """
+    if last is None or current is None:
+        return 0
+    return current - last
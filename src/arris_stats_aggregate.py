@@ -0,0 +1,232 @@
+"""
+    Per channel summaries over an aggregation window, for aggregate_window
+
+    https://github.com/andrewfraley/arris_cable_modem_stats
+
+    Instead of (or as well as, with aggregate_raw = True) every poll's channels, each
+    modem sends one summary per channel every aggregate_window seconds, with the min, max,
+    mean and 95th percentile of its power and SNR and how many polls in the window looked
+    anomalous.  A poll is anomalous for a field when its z-score against the channel's
+    exponentially weighted mean and variance, which follow roughly the last
+    aggregate_samples polls, is past aggregate_zscore.
+
+    Each modem and direction keeps preallocated NumPy arrays with a row per channel: a ring
+    buffer of the window's samples, for the percentile, and running totals for everything
+    else.  So a poll costs the same however long the modem has been polled, memory never
+    grows past aggregate_samples polls, and the work is done a whole array at a time.
+
+    The windows still open at exit are summarised and sent by arris_stats.close_destinations(),
+    so the last window isn't lost, nor the only one with --once.
+
+    Needs numpy, pip install numpy.  It isn't in requirements.txt because there's no wheel of it
+    for the alpine image
+"""
+# pylint: disable=line-too-long
+
+import logging
+import warnings
+import threading
+import numpy
+from arris_stats_records import DownstreamSummary, UpstreamSummary
+
+# The z-score of a channel means nothing until it has seen a few polls
+MIN_ZSCORE_SAMPLES = 10
+
+# Smallest standard deviation a z-score is taken against.  Power and SNR come in tenths of a dB, so a
+# channel that hasn't moved has no variance at all and its first tenth would be an infinite z-score
+MIN_STD = 0.5
+
+# (modem_id, direction) -> Aggregator
+aggregators = {}
+# modem_id -> the config its windows are sent with when they're flushed at exit
+aggregator_configs = {}
+aggregators_lock = threading.Lock()
+
+
+def aggregate(stats, config):
+    """ Add the poll to the modem's windows, and add the summaries of any window it closed to stats
+        as downstream_summary / upstream_summary.  The raw channels are left out unless aggregate_raw
+    """
+    window_ns = int(config['aggregate_window'] * 1000000000)
+    for direction, summary_class in [('downstream', DownstreamSummary), ('upstream', UpstreamSummary)]:
+        key = (config['modem_id'], direction)
+        with aggregators_lock:
+            if key not in aggregators:
+                aggregators[key] = Aggregator(summary_class, window_ns, config['aggregate_samples'], config['aggregate_zscore'])
+            aggregator = aggregators[key]
+            aggregator_configs[config['modem_id']] = config
+
+        summaries = aggregator.add(stats[direction], stats['timestamp_ns'])
+        if summaries:
+            stats[summary_class.measurement] = summaries
+        if not config['aggregate_raw']:
+            stats[direction] = []
+
+
+def flush_aggregators():
+    """ Summarise every window that's still open, returns a (stats, config) per modem with
+        downstream_summary / upstream_summary, and no raw channels, for arris_stats to send
+    """
+    with aggregators_lock:
+        all_aggregators = list(aggregators.items())
+        configs = dict(aggregator_configs)
+
+    flushed = {}
+    for (modem_id, _), aggregator in all_aggregators:
+        summaries = aggregator.flush()
+        if not summaries:
+            continue
+        if modem_id not in flushed:
+            flushed[modem_id] = ({'downstream': [], 'upstream': [], 'timestamp_ns': aggregator.timestamp_ns}, configs[modem_id])
+        flushed[modem_id][0][aggregator.summary_class.measurement] = summaries
+    return list(flushed.values())
+
+
+class Aggregator:
+    """ The windows of one modem's downstream or upstream channels """
+
+    def __init__(self, summary_class, window_ns, samples, zscore):
+        self.summary_class = summary_class
+        self.fields = summary_class.summarised
+        # Fields that are reported as their last value in the window rather than summarised
+        self.last_fields = tuple(field for field in ('corrected', 'uncorrectables') if field in summary_class.fields)
+        self.window_ns = window_ns
+        self.samples = samples
+        self.zscore = zscore
+        self.alpha = 2 / (samples + 1)
+
+        # channel_id -> row in every array
+        self.rows = {}
+        self.window = None
+        # Timestamp of the newest poll
+        self.timestamp_ns = None
+        self.position = 0
+        self.allocate(0)
+
+    def allocate(self, channels):
+        """ (Re)allocate every array for channels rows, keeping what's in the existing rows """
+        shapes = {
+            'ring': ((self.samples, channels, len(self.fields)), numpy.nan),
+            'mins': ((channels, len(self.fields)), numpy.inf),
+            'maxs': ((channels, len(self.fields)), -numpy.inf),
+            'sums': ((channels, len(self.fields)), 0.0),
+            'counts': ((channels, len(self.fields)), 0),
+            'anomalies': ((channels, len(self.fields)), 0),
+            'ewma_means': ((channels, len(self.fields)), numpy.nan),
+            'ewma_variances': ((channels, len(self.fields)), 0.0),
+            'seen': ((channels, len(self.fields)), 0),
+            'lasts': ((channels, len(self.last_fields)), numpy.nan),
+            'polls': ((channels,), 0),
+        }
+        for name, (shape, fill) in shapes.items():
+            array = numpy.full(shape, fill, dtype=numpy.int64 if isinstance(fill, int) else numpy.float64)
+            old = getattr(self, name, None)
+            if old is not None and name == 'ring':
+                array[:, :old.shape[1]] = old
+            elif old is not None:
+                array[:old.shape[0]] = old
+            setattr(self, name, array)
+
+    def add(self, channels, timestamp_ns):
+        """ Add one poll, return the summaries of the previous window if this poll is in a new one """
+        summaries = []
+        window = timestamp_ns // self.window_ns
+        if self.window is not None and window != self.window:
+            summaries = self.summarise()
+            self.reset()
+        self.window = window
+        self.timestamp_ns = timestamp_ns
+
+        for channel in channels:
+            if channel.channel_id not in self.rows:
+                self.rows[channel.channel_id] = len(self.rows)
+        if len(self.rows) > self.polls.shape[0]:
+            # New channels are rare, grow to twice the size so it doesn't happen every poll
+            self.allocate(max(len(self.rows), 2 * self.polls.shape[0]))
+
+        values = numpy.full((self.polls.shape[0], len(self.fields)), numpy.nan)
+        lasts = numpy.full((self.polls.shape[0], len(self.last_fields)), numpy.nan)
+        for channel in channels:
+            row = self.rows[channel.channel_id]
+            values[row] = [numpy.nan if getattr(channel, field) is None else getattr(channel, field) for field in self.fields]
+            lasts[row] = [numpy.nan if getattr(channel, field) is None else getattr(channel, field) for field in self.last_fields]
+            self.polls[row] += 1
+
+        present = ~numpy.isnan(values)
+        self.ring[self.position % self.samples] = values
+        self.position += 1
+        self.mins = numpy.fmin(self.mins, values)
+        self.maxs = numpy.fmax(self.maxs, values)
+        self.sums += numpy.where(present, values, 0)
+        self.counts += present
+        self.lasts = numpy.where(numpy.isnan(lasts), self.lasts, lasts)
+        self.update_anomalies(values, present)
+        return summaries
+
+    def update_anomalies(self, values, present):
+        """ Count the polls whose z-score is past the threshold, then move the weighted mean and variance on """
+        with numpy.errstate(invalid='ignore'):
+            zscores = numpy.abs(values - self.ewma_means) / numpy.sqrt(numpy.maximum(self.ewma_variances, MIN_STD ** 2))
+        if self.zscore:
+            self.anomalies += present & (self.seen >= MIN_ZSCORE_SAMPLES) & (zscores >= self.zscore)
+
+        # The first value a channel reports starts its mean
+        first = present & (self.seen == 0)
+        self.ewma_means = numpy.where(first, values, self.ewma_means)
+        differences = numpy.where(present, values - self.ewma_means, 0)
+        self.ewma_means += self.alpha * differences
+        self.ewma_variances = numpy.where(present, (1 - self.alpha) * (self.ewma_variances + self.alpha * differences ** 2), self.ewma_variances)
+        self.seen += present
+
+    def summarise(self):
+        """ Return a summary for every channel that was in the window """
+        # Only the newest samples polls are still in the ring if the window had more than that
+        ring = self.ring[:min(self.position, self.samples)]
+        with warnings.catch_warnings(), numpy.errstate(invalid='ignore'):
+            # Fields a channel never reported are all NaN, and stay that way
+            warnings.simplefilter('ignore', RuntimeWarning)
+            p95s = numpy.nanpercentile(ring, 95, axis=0) if len(ring) else numpy.full(self.sums.shape, numpy.nan)
+            means = self.sums / self.counts
+
+        timestamp_ns = self.window * self.window_ns
+        summaries = []
+        for channel_id, row in self.rows.items():
+            if not self.polls[row]:
+                continue
+            values = {'samples': int(self.polls[row])}
+            for column, field in enumerate(self.fields):
+                if not self.counts[row, column]:
+                    continue
+                values[field + '_min'] = float(self.mins[row, column])
+                values[field + '_max'] = float(self.maxs[row, column])
+                values[field + '_mean'] = float(means[row, column])
+                values[field + '_p95'] = float(p95s[row, column])
+                values[field + '_anomalies'] = int(self.anomalies[row, column])
+            for column, field in enumerate(self.last_fields):
+                if not numpy.isnan(self.lasts[row, column]):
+                    values[field] = int(self.lasts[row, column])
+            summaries.append(self.summary_class(channel_id, timestamp_ns, **values))
+
+        logging.debug('Summarised %s %s channels for the window starting at %s', len(summaries), self.summary_class.measurement, timestamp_ns)
+        return summaries
+
+    def flush(self):
+        """ Return the summaries of the open window, if there is one, and close it """
+        if self.window is None:
+            return []
+        summaries = self.summarise()
+        self.reset()
+        self.window = None
+        return summaries
+
+    def reset(self):
+        """ Start a new window, the weighted mean and variance carry on """
+        self.ring.fill(numpy.nan)
+        self.position = 0
+        self.mins.fill(numpy.inf)
+        self.maxs.fill(-numpy.inf)
+        self.sums.fill(0)
+        self.counts.fill(0)
+        self.anomalies.fill(0)
+        self.lasts.fill(numpy.nan)
+        self.polls.fill(0)
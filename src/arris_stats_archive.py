@@ -0,0 +1,193 @@
+"""
+    Compressed archive of every page fetched from the modems
+
+    https://github.com/andrewfraley/arris_cable_modem_stats
+
+    With archive_dir set, every status page is saved with its poll timestamp, modem_id and
+    modem_model before it's parsed, so pages can be parsed again after a parser fix, or used
+    as mockups for a new model.  Pages go into compressed segment files of JSON lines, and
+    a page that's already in the current segment is only stored as its sha256.  Once the
+    archive is bigger than archive_max_bytes the oldest segments are deleted.
+
+    Records are flushed as they're written, so a segment cut short by a crash can still be
+    read up to its last complete record.
+"""
+# pylint: disable=line-too-long
+
+import io
+import os
+import gzip
+import json
+import time
+import hashlib
+import logging
+import threading
+
+SUFFIXES = {
+    'gzip': '.jsonl.gz',
+    'zstd': '.jsonl.zst'
+}
+
+# Largest segment before rolling over to a new one.  Smaller archives get smaller segments
+# so eviction doesn't throw away too much at once
+MAX_SEGMENT_BYTES = 67108864
+
+# One archive per archive_dir, shared by every modem in fleet mode
+archives = {}
+archives_lock = threading.Lock()
+
+
+def check_compression(compression):
+    """ Raise RuntimeError if compression isn't supported, or needs a module that isn't installed """
+    if compression not in SUFFIXES:
+        raise RuntimeError('Archive compression %s not supported!' % compression)
+    if compression == 'zstd':
+        try:
+            import zstandard  # pylint: disable=import-outside-toplevel,unused-import
+        except ImportError as exception:
+            raise RuntimeError('archive_compression = zstd needs zstandard, install it with pip install zstandard') from exception
+
+
+def get_archive(config):
+    """ Return the archive for config's archive_dir, creating it on first use """
+    with archives_lock:
+        if config['archive_dir'] not in archives:
+            archives[config['archive_dir']] = Archive(config['archive_dir'], config['archive_max_bytes'], config['archive_compression'])
+        return archives[config['archive_dir']]
+
+
+def close_archives():
+    """ Finish every archive's current segment, called from arris_stats.close_destinations() at exit """
+    with archives_lock:
+        for archive in archives.values():
+            archive.close()
+        archives.clear()
+
+
+class Archive:
+    """ A directory of compressed segments, the newest one open for writing """
+
+    def __init__(self, directory, max_bytes, compression):
+        check_compression(compression)
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self.segment_bytes = max(1, min(MAX_SEGMENT_BYTES, max_bytes // 16))
+        self.lock = threading.Lock()
+
+        self.segment = None
+        self.segment_file = None
+        self.writer = None
+
+        # sha256 of every page stored in full in the current segment
+        self.hashes = set()
+
+        os.makedirs(directory, exist_ok=True)
+
+        # Finished segments and their sizes, oldest first
+        self.segments = {path: os.path.getsize(path) for path in list_segments(directory)}
+
+    def add(self, html, timestamp_ns, modem_id, modem_model):
+        """ Save a page fetched from a modem """
+        digest = hashlib.sha256(html.encode()).hexdigest()
+        record = {'timestamp_ns': timestamp_ns, 'modem_id': modem_id, 'modem_model': modem_model, 'sha256': digest}
+
+        with self.lock:
+            if not self.writer or self.segment_file.tell() >= self.segment_bytes:
+                self._roll_segment()
+
+            if digest not in self.hashes:
+                record['html'] = html
+                self.hashes.add(digest)
+
+            self.writer.write((json.dumps(record) + '\n').encode())
+            self._flush()
+            self._evict()
+
+    def close(self):
+        """ Finish the current segment """
+        with self.lock:
+            self._close_segment()
+
+    def _roll_segment(self):
+        """ Finish the current segment and start a new one named after the time it was started """
+        self._close_segment()
+
+        self.segment = os.path.join(self.directory, '%020d%s' % (time.time_ns(), SUFFIXES[self.compression]))
+        self.segment_file = open(self.segment, 'xb')  # pylint: disable=consider-using-with
+        if self.compression == 'zstd':
+            import zstandard  # pylint: disable=import-outside-toplevel
+            self.writer = zstandard.ZstdCompressor().stream_writer(self.segment_file)
+        else:
+            self.writer = gzip.GzipFile(fileobj=self.segment_file, mode='wb')
+        self.hashes = set()
+
+    def _flush(self):
+        """ Push everything written so far out to the segment file, without ending the compressed stream """
+        if self.compression == 'zstd':
+            import zstandard  # pylint: disable=import-outside-toplevel
+            self.writer.flush(zstandard.FLUSH_BLOCK)
+        else:
+            self.writer.flush()
+        self.segment_file.flush()
+
+    def _close_segment(self):
+        if not self.writer:
+            return
+        self.writer.close()
+        if not self.segment_file.closed:
+            self.segment_file.close()
+        self.segments[self.segment] = os.path.getsize(self.segment)
+        self.writer = None
+        self.segment_file = None
+
+    def _evict(self):
+        """ Delete the oldest segments until we're back under max_bytes """
+        total = sum(self.segments.values()) + self.segment_file.tell()
+        for segment in list(self.segments):
+            if total <= self.max_bytes:
+                break
+            logging.info('Archive %s is over archive_max_bytes, deleting %s', self.directory, segment)
+            total -= self.segments.pop(segment)
+            os.remove(segment)
+
+
+def list_segments(directory):
+    """ Return the paths of every segment in directory, oldest first """
+    names = [name for name in os.listdir(directory) if name.endswith(tuple(SUFFIXES.values()))]
+    return [os.path.join(directory, name) for name in sorted(names)]
+
+
+def read_archive(directory):
+    """ Yield every page in the archive, oldest segment first, as a dict of
+        timestamp_ns, modem_id, modem_model, sha256 and html
+    """
+    for segment in list_segments(directory):
+        pages = {}
+        for record in read_segment(segment):
+            if 'html' in record:
+                pages[record['sha256']] = record['html']
+            else:
+                record['html'] = pages[record['sha256']]
+            yield record
+
+
+def read_segment(segment):
+    """ Yield every complete record in a segment """
+    with open(segment, 'rb') as segment_file:
+        if segment.endswith(SUFFIXES['zstd']):
+            import zstandard  # pylint: disable=import-outside-toplevel
+            reader = zstandard.ZstdDecompressor().stream_reader(segment_file, read_across_frames=True)
+        else:
+            reader = gzip.GzipFile(fileobj=segment_file, mode='rb')
+
+        try:
+            for line in io.TextIOWrapper(reader, encoding='utf-8'):
+                # The last line is incomplete if we were killed mid-write
+                if not line.endswith('\n'):
+                    break
+                yield json.loads(line)
+        except (EOFError, OSError) as exception:
+            # A segment still being written, or cut short by a crash, has no end of stream
+            logging.debug('Stopped reading %s at its last complete record: %s', segment, exception)
@@ -0,0 +1,89 @@
+"""
+    Modem login sessions that outlive a poll, and a restart
+
+    https://github.com/andrewfraley/arris_cable_modem_stats
+
+    Some modems (the SB8200 especially) stop accepting logins after too many of them and
+    need a reboot to recover, so logins are kept to a minimum.  The token and cookies of
+    each modem's session are saved to auth_state_dir and reused after a restart, the first
+    fetch with them tells us whether they're still good, and a modem is never logged in to
+    more than once every min_login_interval seconds, across restarts too.
+"""
+# pylint: disable=line-too-long
+
+import os
+import json
+import time
+import logging
+import requests
+
+
+def load_session(config):
+    """ Return the modem's session state, {'token', 'session', 'last_login'}, restored from
+        auth_state_dir if there's a saved one
+    """
+    state = {'token': None, 'session': requests.Session(), 'last_login': 0}
+    path = get_state_path(config)
+    if not path:
+        return state
+
+    try:
+        with open(path) as state_file:
+            saved = json.load(state_file)
+    except FileNotFoundError:
+        return state
+    except ValueError:
+        logging.warning('Ignoring damaged auth state file %s', path)
+        return state
+
+    state['token'] = saved.get('token')
+    state['last_login'] = saved.get('last_login', 0)
+    for cookie in saved.get('cookies', []):
+        state['session'].cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'], path=cookie['path'], secure=cookie['secure'], expires=cookie['expires'])
+    if state['token']:
+        logging.info('Reusing the login session saved in %s', path)
+    return state
+
+
+def save_session(config, state):
+    """ Save the token, cookies and time of the last login so the next run can pick them up """
+    path = get_state_path(config)
+    if not path:
+        return
+
+    cookies = [{
+        'name': cookie.name,
+        'value': cookie.value,
+        'domain': cookie.domain,
+        'path': cookie.path,
+        'secure': cookie.secure,
+        'expires': cookie.expires
+    } for cookie in state['session'].cookies]
+
+    # The token and cookies are as good as the password, keep them private.  Write then
+    # rename so a crash never leaves half a file behind
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor = os.open(path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, 'w') as state_file:
+        json.dump({'token': state['token'], 'cookies': cookies, 'last_login': state['last_login']}, state_file)
+    os.replace(path + '.tmp', path)
+
+
+def clear_session(config, state):
+    """ Forget the token and cookies, the next poll logs in again """
+    state['token'] = None
+    state['session'].close()
+    state['session'] = requests.Session()
+    save_session(config, state)
+
+
+def get_login_delay(config, state):
+    """ Return how many seconds until we're allowed to log in to the modem again """
+    return max(0, state['last_login'] + config['min_login_interval'] - time.time())
+
+
+def get_state_path(config):
+    """ Return the modem's auth state file, or None if sessions aren't saved """
+    if not config['auth_state_dir']:
+        return None
+    return os.path.join(config['auth_state_dir'], (config['modem_id'] or 'default') + '.json')
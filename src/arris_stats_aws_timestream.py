@@ -4,109 +4,163 @@
     https://github.com/andrewfraley/arris_cable_modem_stats
 """
 # pylint: disable=line-too-long
+import time
 import logging
+import threading
 import boto3
 from botocore.config import Config
 
+# Timestream accepts at most this many records per write_records call
+MAX_RECORDS_PER_WRITE = 100
 
-def send_to_aws_time_stream(stats, config):
-    """ Send the stats to AWS Timestream """
-    logging.info('Sending stats to Timestream (database=%s)', config['timestream_database'])
+# Clients live for the whole process, keyed by credentials and region for fleet mode
+timestream_clients = {}
+timestream_clients_lock = threading.Lock()
+
+# (database, table) pairs that describe_database / describe_table have already succeeded for
+validated_tables = set()
+validated_tables_lock = threading.Lock()
+
+
+def get_timestream_client(config):
+    """ Return the long lived timestream-write client for this config, creating it on first use """
+    key = (config['timestream_aws_access_key_id'], config['timestream_aws_secret_access_key'], config['timestream_aws_region'])
+    with timestream_clients_lock:
+        if key not in timestream_clients:
+            timestream_clients[key] = boto3.client(
+                'timestream-write',
+                aws_access_key_id=config['timestream_aws_access_key_id'],
+                aws_secret_access_key=config['timestream_aws_secret_access_key'],
+                config=Config(region_name=config['timestream_aws_region'])
+            )
+        return timestream_clients[key]
 
-    region_config = Config(
-        region_name=config['timestream_aws_region']
-    )
 
-    ts_client = boto3.client(
-        'timestream-write',
-        aws_access_key_id=config['timestream_aws_access_key_id'],
-        aws_secret_access_key=config['timestream_aws_secret_access_key'],
-        config=region_config
-    )
+def validate_table(ts_client, config):
+    """ Make sure we can access the database and table, only checked once per process """
+    database = config['timestream_database']
+    table = config['timestream_table']
+    with validated_tables_lock:
+        if (database, table) in validated_tables:
+            return True
 
     try:
         # Attempt to validate connection to database and table
         # Error out and return if not able to access / connection isn't valid
-        database = ts_client.describe_database(
-            DatabaseName=config['timestream_database']
-        )
-        logging.debug("Database details = %s" % database)
-
-        table = ts_client.describe_table(
-            DatabaseName=config['timestream_database'],
-            TableName=config['timestream_table']
-        )
-        logging.debug("Table details = %s" % table)
+        details = ts_client.describe_database(DatabaseName=database)
+        logging.debug("Database details = %s" % details)
+
+        details = ts_client.describe_table(DatabaseName=database, TableName=table)
+        logging.debug("Table details = %s" % details)
     except Exception as err:
         logging.error(err)
-        return
+        return False
 
-    current_time = time.time_ns()
-    logging.debug("Converting to timestream - %s" % stats)
+    with validated_tables_lock:
+        validated_tables.add((database, table))
+    return True
 
-    downstream_common_attributes = {
-        'Dimensions': [{'Name': 'measurement', 'Value': 'downstream_statistics'}],
-        'Time': str(current_time),
-        'TimeUnit': 'NANOSECONDS'
-    }
-    downstream_records = []
-    for stats_down in stats['downstream']:
-        for key in stats_down:
-            if key == 'channel_id':
-                continue
-
-            downstream_records.append({
-                'Dimensions': [
-                    {'Name': 'channel_id', 'Value': str(stats_down['channel_id'])},
-                    {'Name': 'group', 'Value': 'downstream_statistics'}
-                ],
-                'MeasureName': key,
-                'MeasureValue': str(stats_down[key]),
-                'MeasureValueType': 'DOUBLE' if isinstance(stats_down[key], float) else 'BIGINT'
-            })
 
-    try:
-        logging.debug("Writing common attributes: %s" % downstream_common_attributes)
-        logging.debug("Writing records: %s" % downstream_records)
-        result = ts_client.write_records(DatabaseName=config['timestream_database'],
-                                         TableName=config['timestream_table'], Records=downstream_records,
-                                         CommonAttributes=downstream_common_attributes)
-        logging.info("Timestream response = %s" % result)
-        logging.info("Wrote %s records to TimeStream" % len(downstream_records))
-    except (ts_client.exceptions.RejectedRecordsException, Exception) as err:
-        logging.error(err)
+def send_to_aws_time_stream(stats, config, ts_client=None):
+    """ Send the stats to AWS Timestream.  ts_client can be passed in to use
+        something other than a real boto3 client, such as a stand-in for tests
+    """
+    return send_batch_to_aws_time_stream([stats], config, ts_client)
+
+
+def send_batch_to_aws_time_stream(stats_list, config, ts_client=None):
+    """ Send the stats from several polls to AWS Timestream, each with its own timestamp.
+        Returns True if every record was written
+    """
+    logging.info('Sending stats to Timestream (database=%s)', config['timestream_database'])
+
+    if not ts_client:
+        ts_client = get_timestream_client(config)
+
+    if not validate_table(ts_client, config):
+        return False
 
-    upstream_common_attributes = {
-        'Dimensions': [{'Name': 'measurement', 'Value': 'upstream_statistics'}],
-        'Time': str(current_time),
+    logging.debug("Converting to timestream - %s" % stats_list)
+    common_attributes = {
+        'Dimensions': [],
         'TimeUnit': 'NANOSECONDS'
     }
-    upstream_records = []
-    for stats_up in stats['upstream']:
-        for key in stats_up:
-            if key == 'channel_id':
-                continue
-
-            upstream_records.append({
-                'Dimensions': [
-                    {'Name': 'channel_id', 'Value': str(stats_up['channel_id'])},
-                    {'Name': 'group', 'Value': 'upstream_statistics'}
-                ],
-                'MeasureName': key,
-                'MeasureValue': str(stats_up[key]),
-                'MeasureValueType': 'DOUBLE' if isinstance(stats_up[key], float) else 'BIGINT'
-            })
+    if config['modem_id']:
+        common_attributes['Dimensions'].append({'Name': 'modem_id', 'Value': config['modem_id']})
 
-    try:
-        logging.debug("Writing common attributes: %s" % upstream_common_attributes)
-        logging.debug("Writing records: %s" % upstream_records)
-        result = ts_client.write_records(DatabaseName=config['timestream_database'],
-                                         TableName=config['timestream_table'], Records=upstream_records,
-                                         CommonAttributes=upstream_common_attributes)
-        logging.info("Timestream response = %s" % result)
-        logging.info("Wrote %s records to TimeStream" % len(upstream_records))
-    except (ts_client.exceptions.RejectedRecordsException, Exception) as err:
-        logging.error(err)
-        return
+    records = []
+    for stats in stats_list:
+        records.extend(get_records(stats, stats.get('timestamp_ns') or time.time_ns()))
+
+    for start in range(0, len(records), MAX_RECORDS_PER_WRITE):
+        batch = records[start:start + MAX_RECORDS_PER_WRITE]
+        try:
+            logging.debug("Writing common attributes: %s" % common_attributes)
+            logging.debug("Writing records: %s" % batch)
+            result = ts_client.write_records(DatabaseName=config['timestream_database'],
+                                             TableName=config['timestream_table'], Records=batch,
+                                             CommonAttributes=common_attributes)
+            logging.info("Timestream response = %s" % result)
+            logging.info("Wrote %s records to TimeStream" % len(batch))
+        except (ts_client.exceptions.RejectedRecordsException, Exception) as err:
+            logging.error(err)
+            return False
 
     logging.info('Successfully wrote data to Timestream')
+    return True
+
+
+def get_records(stats, timestamp_ns):
+    """ Build one multi-measure record per downstream and upstream channel, and one for each channel summary, the collector statistics, each event and each probe if there are any """
+    records = []
+    for direction in ['downstream', 'upstream']:
+        for channel in stats[direction]:
+            records.append(get_record(channel, timestamp_ns, [
+                {'Name': 'channel_id', 'Value': str(channel.channel_id)},
+                {'Name': 'group', 'Value': channel.measurement}
+            ]))
+
+    for key in ['downstream_summary', 'upstream_summary']:
+        for summary in stats.get(key) or []:
+            records.append(get_record(summary, summary.timestamp_ns, [
+                {'Name': 'channel_id', 'Value': str(summary.channel_id)},
+                {'Name': 'group', 'Value': summary.measurement}
+            ]))
+
+    if stats.get('collector'):
+        records.append(get_record(stats['collector'], timestamp_ns, [{'Name': 'group', 'Value': stats['collector'].measurement}]))
+
+    # A nanosecond apart, records with the same dimensions and time would be rejected as duplicates
+    for index, event in enumerate(stats.get('events') or []):
+        records.append(get_record(event, timestamp_ns + index, [{'Name': 'group', 'Value': event.measurement}]))
+
+    for probe in stats.get('probes') or []:
+        records.append(get_record(probe, timestamp_ns, [
+            {'Name': 'target', 'Value': probe.target},
+            {'Name': 'kind', 'Value': probe.kind},
+            {'Name': 'group', 'Value': probe.measurement}
+        ]))
+    return records
+
+
+def get_record(record, timestamp_ns, dimensions):
+    """ Build a multi-measure record from a channel, collector statistics, event or probe """
+    measures = []
+    for field in record.fields:
+        value = getattr(record, field)
+        if value is None:
+            continue
+        measures.append({
+            'Name': field,
+            'Value': str(value),
+            'Type': 'DOUBLE' if isinstance(value, float) else 'VARCHAR' if isinstance(value, str) else 'BIGINT'
+        })
+
+    return {
+        # measurement was a dimension of the single-measure records, queries filtering on it keep working
+        'Dimensions': dimensions + [{'Name': 'measurement', 'Value': record.measurement}],
+        'MeasureName': record.measurement,
+        'MeasureValueType': 'MULTI',
+        'MeasureValues': measures,
+        'Time': str(timestamp_ns)
+    }
@@ -0,0 +1,156 @@
+"""
+    Parse saved modem pages again and send the stats to the destinations
+
+    https://github.com/andrewfraley/arris_cable_modem_stats
+
+    Reads an archive_dir (see arris_stats_archive), or a directory of .html pages like
+    tests/mockups, parses every page with its model's parse_html function across a pool
+    of worker processes, and writes the stats to every configured destination in large
+    batches, oldest first, with the time each page was fetched.  Handy for filling in
+    history after a parser fix.
+
+    Uses the same config.ini / ENV settings as arris_stats.py.  Run from the src directory with:
+    python3 arris_stats_backfill.py --config config.ini /path/to/archive_dir
+"""
+# pylint: disable=line-too-long
+
+import os
+import sys
+import logging
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import arris_stats
+import arris_stats_archive
+
+
+def main():
+    """ MAIN """
+    args = get_args()
+    config = arris_stats.get_config(args.config)
+    arris_stats.init_logger(args.log_level or config.get('log_level'))
+
+    try:
+        sent, failed = backfill(get_pages(args.path, args.model or config['modem_model'], args.modem_id), config, args.workers, args.batch_size)
+    finally:
+        arris_stats.close_destinations()
+
+    logging.info('Sent %s polls, %s failed', sent, failed)
+    if failed:
+        sys.exit(1)
+
+
+def get_args():
+    """ Get argparser args """
+    parser = argparse.ArgumentParser(description='Parse saved modem pages again and send the stats to the destinations')
+    parser.add_argument('path', help='An archive_dir, or a directory of .html pages')
+    parser.add_argument('--config', metavar='config_file_path', help='Path to config file', required=False)
+    parser.add_argument('--model', help='Model of the .html pages, defaults to modem_model, or the file name if it\'s a model (like the mockups).  auto works it out from each page.  Archived pages know their model', choices=arris_stats.modems_supported + ['auto'], required=False)
+    parser.add_argument('--modem-id', help='modem_id to tag the stats from .html pages with', required=False)
+    parser.add_argument('--workers', help='Parser processes, defaults to one per CPU', type=int, required=False, default=None)
+    parser.add_argument('--batch-size', help='Max polls sent per write', type=int, required=False, default=1000)
+    parser.add_argument('--debug', help='Enable debug logging', action='store_true', required=False, default=False)
+    parser.add_argument('--log-level', help='Set log_level', action='store', type=str.lower, required=False, choices=["debug", "info", "warning", "error"])
+    args = parser.parse_args()
+    if args.debug:
+        args.log_level = "debug"
+    return args
+
+
+def get_pages(path, model, modem_id):
+    """ Yield a page dict (timestamp_ns, modem_id, modem_model, html) for every page under path, oldest first """
+    if arris_stats_archive.list_segments(path):
+        logging.info('Reading archived pages from %s', path)
+        yield from arris_stats_archive.read_archive(path)
+        return
+
+    # Loose pages were saved when they were fetched, so their mtime is the poll time
+    logging.info('Reading .html pages from %s', path)
+    paths = [os.path.join(path, name) for name in os.listdir(path) if name.endswith('.html')]
+    for page_path in sorted(paths, key=os.path.getmtime):
+        name = os.path.basename(page_path)[:-len('.html')]
+        with open(page_path) as page_file:
+            yield {
+                'timestamp_ns': os.stat(page_path).st_mtime_ns,
+                'modem_id': modem_id,
+                'modem_model': name if name in arris_stats.modems_supported else model,
+                'html': page_file.read()
+            }
+
+
+def backfill(pages, config, workers, batch_size):
+    """ Parse the pages in worker processes and send the stats in batches of up to batch_size polls.
+        The next batch is parsed while the last one is being sent.  Returns (polls sent, polls that failed)
+    """
+    sent = failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        parsing = None
+        while True:
+            batch = [(page, config['parser_backend']) for page in itertools.islice(pages, batch_size)]
+            next_parsing = executor.map(parse_page, batch, chunksize=max(1, len(batch) // (4 * (workers or os.cpu_count() or 1)))) if batch else None
+            if parsing:
+                batch_sent, batch_failed = send_batch(list(parsing), config)
+                sent += batch_sent
+                failed += batch_failed
+            if not next_parsing:
+                return sent, failed
+            parsing = next_parsing
+
+
+def parse_page(job):
+    """ Runs in a worker process, parse one page.  Returns (page without its html, stats or None) """
+    page, backend = job
+    page = dict(page)
+    html = page.pop('html')
+    if page['modem_model'] == 'auto':
+        import arris_stats_detect  # pylint: disable=import-outside-toplevel
+        page['modem_model'] = arris_stats_detect.fingerprint(html, backend)
+    if page['modem_model'] not in arris_stats.modems_supported:
+        return page, None
+
+    module = __import__('arris_stats_' + page['modem_model'])
+    try:
+        stats = getattr(module, 'parse_html_' + page['modem_model'])(html, backend)
+    except Exception as exception:  # pylint: disable=broad-except
+        logging.debug('Failed to parse page from %s: %s', page['timestamp_ns'], exception)
+        return page, None
+    if not stats or (not stats['upstream'] and not stats['downstream']):
+        return page, None
+    return page, stats
+
+
+def send_batch(results, config):
+    """ Timestamp the parsed stats and send them, one write per modem and destination.
+        Returns (polls every destination took, polls that couldn't be parsed or a destination didn't take)
+    """
+    by_modem = {}
+    failed = 0
+    for page, stats in sorted(results, key=lambda result: result[0]['timestamp_ns']):
+        if not stats:
+            logging.warning('No stats in the %s page from %s, skipping it', page['modem_model'], page['timestamp_ns'])
+            failed += 1
+            continue
+
+        stats['timestamp_ns'] = page['timestamp_ns']
+        if config['counter_deltas']:
+            # Keep the live collector's saved counters out of it
+            import arris_stats_counters  # pylint: disable=import-outside-toplevel
+            arris_stats_counters.add_deltas(stats, dict(config, modem_id=page['modem_id'], counter_state_dir=None))
+        by_modem.setdefault(page['modem_id'], []).append(stats)
+
+    sent = 0
+    for modem_id, stats_list in by_modem.items():
+        results = []
+        for destination in config['destinations']:
+            results.append(arris_stats.send_stats_batch(stats_list, dict(config, modem_id=modem_id, destination=destination)))
+            if not results[-1]:
+                logging.error('%s didn\'t take %s polls from %s', destination, len(stats_list), modem_id or 'the modem')
+        if all(results):
+            sent += len(stats_list)
+        else:
+            failed += len(stats_list)
+    return sent, failed
+
+
+if __name__ == '__main__':
+    main()
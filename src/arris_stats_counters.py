@@ -0,0 +1,91 @@
+"""
+    Per poll deltas and rates for the cumulative downstream counters
+
+    https://github.com/andrewfraley/arris_cable_modem_stats
+
+    corrected and uncorrectables only ever count up until the modem reboots or the
+    channel re-locks, so graphing them means a derivative over every raw point.  This
+    keeps the previous sample of each channel and fills in corrected_delta,
+    uncorrectables_delta, corrected_rate and uncorrectables_rate so the work is done once.
+"""
+# pylint: disable=line-too-long
+
+import os
+import json
+import logging
+import threading
+
+COUNTERS = ('corrected', 'uncorrectables')
+
+# modem_id -> {channel_id: previous sample}, loaded from counter_state_dir on first use
+previous_samples = {}
+previous_samples_lock = threading.Lock()
+
+
+def add_deltas(stats, config):
+    """ Fill in the delta and rate fields of every downstream channel in stats """
+    modem = config['modem_id'] or 'default'
+    with previous_samples_lock:
+        if modem not in previous_samples:
+            previous_samples[modem] = load_state(config, modem)
+        previous = previous_samples[modem]
+
+    timestamp_ns = stats['timestamp_ns']
+    current = {}
+    for channel in stats['downstream']:
+        sample = {'timestamp_ns': timestamp_ns, 'frequency': channel.frequency}
+        for counter in COUNTERS:
+            sample[counter] = getattr(channel, counter)
+        current[str(channel.channel_id)] = sample
+
+        last = previous.get(str(channel.channel_id))
+        if not last or timestamp_ns <= last['timestamp_ns']:
+            continue
+
+        # Locked to a different frequency, it's really a new channel so start over
+        if channel.frequency != last['frequency']:
+            logging.info('Downstream channel %s moved from %s to %s Hz, restarting its counters', channel.channel_id, last['frequency'], channel.frequency)
+            continue
+
+        seconds = (timestamp_ns - last['timestamp_ns']) / 1000000000
+        reset = any(sample[counter] < last[counter] for counter in COUNTERS)
+        if reset:
+            logging.info('Downstream channel %s counters went backwards, the modem has probably rebooted', channel.channel_id)
+
+        for counter in COUNTERS:
+            # After a reset the counter started again from zero, so everything it has now is new
+            delta = sample[counter] if reset else sample[counter] - last[counter]
+            setattr(channel, counter + '_delta', delta)
+            setattr(channel, counter + '_rate', delta / seconds)
+
+    with previous_samples_lock:
+        previous_samples[modem] = current
+    save_state(config, modem, current)
+
+
+def load_state(config, modem):
+    """ Read the previous samples saved by the last run, if there is one """
+    if not config['counter_state_dir']:
+        return {}
+    path = os.path.join(config['counter_state_dir'], modem + '.json')
+    try:
+        with open(path) as state_file:
+            return json.load(state_file)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        logging.warning('Ignoring damaged counter state file %s', path)
+        return {}
+
+
+def save_state(config, modem, samples):
+    """ Save the latest samples so deltas carry on across restarts """
+    if not config['counter_state_dir']:
+        return
+    os.makedirs(config['counter_state_dir'], exist_ok=True)
+    path = os.path.join(config['counter_state_dir'], modem + '.json')
+
+    # Write then rename so a crash never leaves half a file behind
+    with open(path + '.tmp', 'w') as state_file:
+        json.dump(samples, state_file)
+    os.replace(path + '.tmp', path)
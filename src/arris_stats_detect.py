@@ -0,0 +1,79 @@
+"""
+    Work out a modem's model from its web pages, for modem_model = auto
+
+    https://github.com/andrewfraley/arris_cable_modem_stats
+
+    The first poll of a modem with modem_model = auto fetches its page without logging in
+    and fingerprints it: the T25 answers with a meta refresh towards its login page and
+    calls itself Touchstone, the SB models put their model number in the page, and failing
+    that the layout of the downstream table gives it away.  The model is cached per
+    modem_url, so after that the modem is polled exactly as if its model had been set.
+"""
+# pylint: disable=line-too-long
+
+import re
+import logging
+import threading
+import arris_stats_html
+import arris_stats_retry
+
+# modem_url -> model
+detected_models = {}
+detected_models_lock = threading.Lock()
+
+# The only supported model whose stats are behind a Password: login page
+LOGIN_PAGE_MODEL = 'sb8200'
+
+META_REFRESH = re.compile(r'<meta[^>]+http-equiv\s*=\s*["\']?refresh', re.IGNORECASE)
+
+
+def detect_model(config, session):
+    """ Return the model of the modem at modem_url, fetching its page the first time, or None if we can't tell """
+    with detected_models_lock:
+        model = detected_models.get(config['modem_url'])
+    if model:
+        return model
+
+    logging.info('Working out the model of the modem at %s', config['modem_url'])
+    resp = arris_stats_retry.modem_request(config, session, 'GET', config['modem_url'], verify=config['modem_verify_ssl'])
+    html = resp.text
+    resp.close()
+
+    model = fingerprint(html, config['parser_backend'])
+    if not model and 'Password:' in html:
+        logging.info('The modem answered with a login page, assuming it\'s an %s', LOGIN_PAGE_MODEL)
+        model = LOGIN_PAGE_MODEL
+    if not model:
+        logging.error('Unable to work out the model of the modem at %s (status code %s), set modem_model', config['modem_url'], resp.status_code)
+        return None
+
+    logging.info('The modem at %s is an %s', config['modem_url'], model)
+    with detected_models_lock:
+        detected_models[config['modem_url']] = model
+    return model
+
+
+def forget_model(config):
+    """ The detected model's parser couldn't make sense of the page, work it out again next time """
+    with detected_models_lock:
+        detected_models.pop(config['modem_url'], None)
+
+
+def fingerprint(html, backend='beautifulsoup'):
+    """ Return the model a page came from, or None """
+    if META_REFRESH.search(html) or 'Touchstone' in html:
+        return 't25'
+
+    page = html.lower()
+    for model in ['sb8200', 'sb6183']:
+        if model in page:
+            return model
+
+    # No model number, go by the downstream table
+    for table in arris_stats_html.get_tables(html, backend):
+        for _, cells in table:
+            if cells[:4] == ['Channel', 'Lock Status', 'Modulation', 'Channel ID']:
+                return 'sb6183'
+            if len(cells) == 8 and cells[1] == 'Locked' and cells[3].endswith('Hz'):
+                return 'sb8200'
+    return None
@@ -0,0 +1,172 @@
+"""
+    New entries from the modem's event log, for event_log = True
+
+    https://github.com/andrewfraley/arris_cable_modem_stats
+
+    The event log (T3 / T4 timeouts, ranging failures, reboots) sits on a page next to the
+    status page.  Each poll fetches it, and only the entries newer than the high-water mark
+    are turned into events.  The mark is a fingerprint of the newest entry sent so far, how
+    many identical entries it ended a run of and the entry before that run, so an entry the
+    modem logs again (the same T3 time-out in the same minute) isn't mistaken for the one
+    already sent.  The table is read a row at a time from its newest entry, the bottom one,
+    and reading stops at the mark, so the older entries are never parsed.  A page that hasn't
+    changed at all since the last poll isn't read.  The mark is saved to event_log_state_dir
+    so a restart doesn't send the whole log again.
+"""
+# pylint: disable=line-too-long
+
+import os
+import re
+import json
+import html as html_module
+import hashlib
+import logging
+import itertools
+import threading
+import urllib.parse
+from arris_stats_records import ModemEvent
+
+# model -> the event log page, relative to modem_url
+EVENT_LOG_PAGES = {
+    'sb8200': 'cmeventlog.html',
+    'sb6183': 'RgEventLog.asp',
+    't25': 'event_cgi'
+}
+
+# Every model's event log table has these columns, oldest entry at the top
+COLUMNS = ('date_time', 'event_id', 'level', 'description')
+
+# The end of the event log table's header row, the last column is Description
+HEADER = re.compile(r'>\s*description\s*(</strong>\s*)?</t[dh]>\s*</tr>', re.IGNORECASE)
+CELL = re.compile(r'<td[^>]*>(.*?)</td>', re.IGNORECASE | re.DOTALL)
+TAG = re.compile(r'<[^>]+>')
+
+# modem_id -> {'newest': fingerprint of the newest entry sent, 'repeats': how many entries in a row
+# at the end of the log had that fingerprint, 'previous': fingerprint of the entry before them, None
+# if they were the whole log, 'page': sha256 of the last page}
+high_water_marks = {}
+high_water_marks_lock = threading.Lock()
+
+
+def get_event_log_url(config):
+    """ Return the url of the modem's event log page """
+    return urllib.parse.urljoin(config['modem_url'], EVENT_LOG_PAGES[config['modem_model']])
+
+
+def get_new_events(html, config):
+    """ Return the events on the page that are newer than the high-water mark, oldest first, and move the mark up """
+    modem = config['modem_id'] or 'default'
+    with high_water_marks_lock:
+        if modem not in high_water_marks:
+            high_water_marks[modem] = load_state(config, modem)
+        mark = high_water_marks[modem]
+
+    page = hashlib.sha256(html.encode()).hexdigest()
+    if page == mark.get('page'):
+        return []
+
+    # State saved before repeats and previous were kept counts as a single entry, after anything
+    repeats = mark.get('repeats', 1)
+    new = []     # Cells of the entries past the mark, newest first
+    run = []     # Cells of the entries in the current run of ones that look like the mark
+    walked = []  # Fingerprint of every entry read, newest first, and None for the top of the log
+    for cells in itertools.chain(get_rows(html), [None]):
+        fingerprint = None if cells is None else get_fingerprint(cells)
+        walked.append(fingerprint)
+        if cells is not None and fingerprint == mark.get('newest'):
+            run.append(cells)
+            continue
+        # The run that ended the log last time, with anything logged again since on top
+        if run and len(run) >= repeats and fingerprint == mark.get('previous', fingerprint):
+            new.extend(run[:len(run) - repeats])
+            break
+        new.extend(run)
+        run = []
+        if cells is not None:
+            new.append(cells)
+
+    if new:
+        newest = count_repeats(walked)
+        mark = {'newest': walked[0], 'repeats': newest, 'previous': walked[newest], 'page': page}
+    else:
+        mark = dict(mark, page=page)
+    with high_water_marks_lock:
+        high_water_marks[modem] = mark
+    save_state(config, modem, mark)
+
+    events = [get_event(cells) for cells in reversed(new)]
+    if events:
+        logging.info('%s new entries in the modem\'s event log', len(events))
+    return events
+
+
+def count_repeats(fingerprints):
+    """ Return how many fingerprints in a row at the start are the same as the first """
+    run = 1
+    while run < len(fingerprints) and fingerprints[run] == fingerprints[0]:
+        run += 1
+    return run
+
+
+def get_fingerprint(cells):
+    """ Return a fingerprint of a row of the table """
+    return hashlib.sha256('\x1f'.join(cells).encode()).hexdigest()
+
+
+def get_rows(html):
+    """ Yield the cells of every entry in the event log table, newest first.  Rows are found from the
+        bottom of the table up with plain string searches and each is only parsed when it's asked for
+    """
+    header = HEADER.search(html)
+    if not header:
+        logging.warning('No event log table found on the page')
+        return
+    lower = html.lower()
+    end = lower.find('</table>', header.end())
+    end = len(html) if end == -1 else end
+    while True:
+        start = lower.rfind('<tr', header.end(), end)
+        if start == -1:
+            return
+        cells = get_cells(html[start:end])
+        if len(cells) == len(COLUMNS):
+            yield cells
+        end = start
+
+
+def get_cells(row):
+    """ Return the text of every cell in a row of the table, like the parser backends would """
+    return [html_module.unescape(TAG.sub('', cell)).strip() for cell in CELL.findall(row)]
+
+
+def get_event(cells):
+    """ Convert a row of the table into an event """
+    values = dict(zip(COLUMNS, cells))
+    values['event_id'] = int(values['event_id']) if values['event_id'].isdigit() else None
+    return ModemEvent(**values)
+
+
+def load_state(config, modem):
+    """ Read the high-water mark saved by the last run, if there is one """
+    if not config['event_log_state_dir']:
+        return {}
+    path = os.path.join(config['event_log_state_dir'], modem + '.json')
+    try:
+        with open(path) as state_file:
+            return json.load(state_file)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        logging.warning('Ignoring damaged event log state file %s', path)
+        return {}
+
+
+def save_state(config, modem, mark):
+    """ Save the high-water mark for the next run, writing then renaming so a crash never leaves half a file behind """
+    if not config['event_log_state_dir']:
+        return
+    os.makedirs(config['event_log_state_dir'], exist_ok=True)
+    path = os.path.join(config['event_log_state_dir'], modem + '.json')
+    with open(path + '.tmp', 'w') as state_file:
+        json.dump(mark, state_file)
+    os.replace(path + '.tmp', path)
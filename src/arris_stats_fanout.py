@@ -0,0 +1,138 @@
+"""
+    Send stats to every destination from its own worker thread
+
+    https://github.com/andrewfraley/arris_cable_modem_stats
+
+    The polling loop only puts the stats on each destination's queue, so a slow or
+    unreachable destination never holds up the next poll or the other destinations.
+    Each queue holds destination_queue_size polls, what happens when it's full is up
+    to the destination's policy:
+
+    - drop_oldest: throw away the oldest queued poll to make room (the default)
+    - drop_newest: throw away the poll being queued
+    - block: wait for room, holding up polling until the destination catches up
+"""
+# pylint: disable=line-too-long
+
+import queue
+import logging
+import threading
+
+queue_policies_supported = ['drop_oldest', 'drop_newest', 'block']
+
+# One worker per destination, shared by every modem sending to it
+sink_workers = {}
+sink_workers_lock = threading.Lock()
+
+
+def get_sink_worker(destination, config, send_function):
+    """ Return the worker for destination, starting it on first use.
+        send_function(stats_list, config) is called from the worker thread with config['destination'] set to destination
+    """
+    with sink_workers_lock:
+        if destination not in sink_workers:
+            sink_workers[destination] = SinkWorker(destination, send_function, config['destination_queue_size'], config['destination_queue_policies'][destination])
+        return sink_workers[destination]
+
+
+def close_sink_workers(timeout=30):
+    """ Give every worker up to timeout seconds to send what's still queued, then stop them """
+    with sink_workers_lock:
+        workers = list(sink_workers.values())
+        sink_workers.clear()
+    for worker in workers:
+        worker.close(timeout)
+
+
+class SinkWorker:
+    """ A bounded queue of (stats, config) and the thread that sends them on """
+
+    def __init__(self, destination, send_function, queue_size, policy):
+        self.destination = destination
+        self.send_function = send_function
+        self.policy = policy
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, name='sink-' + destination, daemon=True)
+        self.thread.start()
+
+    def put(self, stats, config, timeout=None):
+        """ Queue the stats, applying the queue policy if it's full.  With the block policy, wait
+            at most timeout seconds for room.  Returns False if a poll was dropped
+        """
+        item = (stats, config)
+        if self.policy == 'block':
+            try:
+                self.queue.put(item, timeout=timeout)
+                return True
+            except queue.Full:
+                self._dropped()
+                return False
+
+        dropped = False
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return not dropped
+            except queue.Full:
+                pass
+
+            if self.policy == 'drop_newest':
+                self._dropped()
+                return False
+
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+                self._dropped()
+                dropped = True
+            except queue.Empty:
+                pass  # The worker emptied it in the meantime, try again
+
+    def run(self):
+        """ Send queued stats until we get None.  Everything queued while the last send ran goes in one batch """
+        while True:
+            items = [self.queue.get()]
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in items
+            items = [item for item in items if item is not None]
+            try:
+                self.send(items)
+            finally:
+                for _ in range(len(items) + stop):
+                    self.queue.task_done()
+            if stop:
+                return
+
+    def send(self, items):
+        """ Send the items, batching runs of them that share a config (i.e. come from the same modem) """
+        while items:
+            config = items[0][1]
+            batch = []
+            while items and items[0][1] is config:
+                batch.append(items.pop(0)[0])
+
+            try:
+                self.send_function(batch, dict(config, destination=self.destination))
+            except Exception as exception:  # pylint: disable=broad-except
+                logging.error('Error sending to %s', self.destination)
+                logging.error(exception)
+
+    def close(self, timeout):
+        """ Stop the worker once it's sent everything queued before now """
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            logging.warning('Gave up waiting for %s to send %s queued polls', self.destination, self.queue.qsize())
+
+    def _dropped(self):
+        self.dropped += 1
+        logging.warning('%s queue is full, dropped a poll (%s dropped so far, queue policy %s)', self.destination, self.dropped, self.policy)
@@ -0,0 +1,161 @@
+"""
+    Poll a fleet of modems concurrently from a single process
+
+    https://github.com/andrewfraley/arris_cable_modem_stats
+"""
+# pylint: disable=line-too-long
+
+import time
+import asyncio
+import logging
+import configparser
+from concurrent.futures import ThreadPoolExecutor
+import arris_stats
+import arris_stats_auth
+import arris_stats_metrics
+import arris_stats_probe
+import arris_stats_retry
+import arris_stats_scheduler
+
+
+def run_fleet(config):
+    """ Poll every modem in config['fleet_inventory'] until we're killed """
+    modems = get_inventory(config['fleet_inventory'], config)
+    if not modems:
+        arris_stats.error_exit('No modems found in fleet inventory %s' % config['fleet_inventory'], config)
+
+    logging.info('Polling %s modems with at most %s fetches in flight', len(modems), config['fleet_max_fetches'])
+    asyncio.run(poll_fleet(modems, config['fleet_max_fetches']))
+
+
+def get_inventory(inventory_path, config):
+    """ Build a config dict for each modem in the inventory file.
+        Every [section] is one modem, the section name is used as the modem_id and
+        any setting in the section overrides the same setting from the main config
+    """
+    logging.info('Getting fleet inventory from: %s', inventory_path)
+    parser = configparser.RawConfigParser()
+    with open(inventory_path) as fileh:
+        parser.read_file(fileh)
+
+    default_config = arris_stats.get_default_config()
+    modems = []
+    for section in parser.sections():
+        modem_config = {param: config[param] for param in default_config}
+        modem_config['modem_id'] = section
+        modem_config['fleet_inventory'] = None
+        for param, value in parser[section].items():
+            if param not in default_config:
+                raise RuntimeError('Unknown setting %s for modem %s in %s' % (param, section, inventory_path))
+            modem_config[param] = value
+        # One modem's login failing should never take down the rest of the fleet
+        modem_config['exit_on_auth_error'] = False
+        modems.append(arris_stats.normalize_config(modem_config))
+
+    return modems
+
+
+async def poll_fleet(modems, max_fetches):
+    """ Run one polling task per modem, fetches all share a pool
+        of max_fetches threads so that's the most we'll have in flight
+    """
+    with ThreadPoolExecutor(max_workers=max_fetches, thread_name_prefix='fetch') as fetch_executor:
+        await asyncio.gather(*[poll_modem(modem_config, fetch_executor) for modem_config in modems])
+
+
+async def poll_modem(config, fetch_executor):
+    """ Fetch, parse and send the stats for one modem every sleep_interval """
+    loop = asyncio.get_event_loop()
+
+    # Each modem keeps its own token and session, just like main() does for a single modem
+    state = arris_stats_auth.load_session(config)
+
+    scheduler = arris_stats_scheduler.Scheduler(config['sleep_interval'], config['poll_jitter'])
+    while True:
+        timestamp_ns = await scheduler.wait_async()
+        # The status page, event log and parsing share one deadline, however long each waits for a thread
+        until = arris_stats_retry.get_deadline(config)
+
+        # The probes run on the event loop while the page is fetched
+        probing = asyncio.ensure_future(arris_stats_probe.probe_all(config['probe_target_list'], config['probe_timeout'])) if config['probe_target_list'] else None
+        html = await loop.run_in_executor(fetch_executor, fetch_html, config, state, until)
+        probes = await probing if probing else None
+
+        # Parsing and sending go to the default executor so they don't hold up other modems' fetches
+        if html:
+            events = await loop.run_in_executor(fetch_executor, fetch_events, config, state, until)
+            await loop.run_in_executor(None, process_html, html, timestamp_ns, config, events, probes, until)
+        else:
+            arris_stats.send_probes(probes, timestamp_ns, config)
+        if config['adaptive_polling']:
+            import arris_stats_adaptive  # pylint: disable=import-outside-toplevel
+            scheduler.set_interval(arris_stats_adaptive.get_interval(config))
+
+
+def fetch_html(config, state, until):
+    """ Get one modem's status page with arris_stats.fetch_html(), behind its circuit breaker and
+        by the time.monotonic() until, return the html or None
+    """
+    breaker = arris_stats_retry.get_circuit_breaker(config)
+    if not breaker.allow():
+        logging.info('[%s] Circuit breaker is open after %s failed polls, skipping this one', config['modem_id'], breaker.consecutive_failures)
+        return None
+
+    html = None
+    login_failed = False
+    try:
+        # A stuck modem gives up its fetch thread by the deadline rather than holding it forever
+        with arris_stats_retry.deadline_until(until):
+            html, login_failed = arris_stats.fetch_html(config, state)
+    except Exception as exception:  # pylint: disable=broad-except
+        # One broken modem should never take down the rest of the fleet
+        logging.error('[%s] %s', config['modem_id'], exception)
+
+    # Waiting out min_login_interval or a failed login isn't the modem failing to answer
+    if not login_failed:
+        breaker.record(bool(html))
+    if not html:
+        logging.error('[%s] No HTML to parse, giving up until next interval', config['modem_id'])
+    return html
+
+
+def fetch_events(config, state, until):
+    """ Get the new entries in one modem's event log if event_log is on, by the time.monotonic() until
+        the status page had to be fetched by too, return them or None
+    """
+    if not config['event_log']:
+        return None
+    try:
+        with arris_stats_retry.deadline_until(until):
+            return arris_stats.fetch_events(config, state)
+    except Exception as exception:  # pylint: disable=broad-except
+        logging.error('[%s] %s', config['modem_id'], exception)
+        return None
+
+
+def process_html(html, timestamp_ns, config, events=None, probes=None, until=None):  # pylint: disable=too-many-arguments
+    """ Parse the html and send the stats, any new events and the probe results on to the modem's destination.
+        Nothing is parsed once the time.monotonic() until has passed
+    """
+    try:
+        arris_stats.archive_html(html, timestamp_ns, config)
+        if until is not None and time.monotonic() >= until:
+            logging.error('[%s] Poll deadline passed before parsing, giving up until next interval', config['modem_id'])
+            arris_stats.send_probes(probes, timestamp_ns, config)
+            return
+        with arris_stats_metrics.timed('parse', config):
+            stats = config['parse_html_function'](html, config['parser_backend'])
+        if not stats or (not stats['upstream'] and not stats['downstream']):
+            logging.error('[%s] Failed to get any stats, giving up until next interval', config['modem_id'])
+            arris_stats.forget_modem_model(config)
+            arris_stats.send_probes(probes, timestamp_ns, config)
+            return
+
+        arris_stats.add_timestamp(stats, timestamp_ns, config)
+        arris_stats.adapt_interval(stats, config)
+        arris_stats.aggregate_stats(stats, config)
+        arris_stats.add_events(stats, events)
+        arris_stats.add_probes(stats, probes)
+        arris_stats.send_stats(stats, config)
+    except Exception as exception:  # pylint: disable=broad-except
+        logging.error('[%s] %s', config['modem_id'], exception)
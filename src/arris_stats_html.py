@@ -0,0 +1,59 @@
+"""
+    HTML table extraction shared by the parse_html_* functions
+
+    https://github.com/andrewfraley/arris_cable_modem_stats
+"""
+# pylint: disable=line-too-long
+# pylint: disable=import-outside-toplevel
+
+parser_backends_supported = [
+    'beautifulsoup',
+    'lxml'
+]
+
+
+def get_tables(html, backend='beautifulsoup'):
+    """ Return every <table> in the html, in document order, as a list of rows.
+        Each row is a tuple of (has_th, cells) where has_th is True if the row
+        contains a <th> and cells is the stripped text of each <td> in the row.
+        Every backend must return exactly the same thing for the same html.
+    """
+    if backend == 'beautifulsoup':
+        return _get_tables_beautifulsoup(html)
+    if backend == 'lxml':
+        return _get_tables_lxml(html)
+    raise RuntimeError('Parser backend %s not supported!' % backend)
+
+
+def _get_tables_beautifulsoup(html):
+    """ The original parser, slow but has no dependencies outside bs4 """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    tables = []
+    for table in soup.find_all('table'):
+        rows = []
+        for table_row in table.find_all('tr'):
+            rows.append((
+                table_row.th is not None,
+                [cell.text.strip() for cell in table_row.find_all('td')]
+            ))
+        tables.append(rows)
+    return tables
+
+
+def _get_tables_lxml(html):
+    """ Build the tree with libxml2 and walk it with xpath, several times faster than bs4 """
+    from lxml import html as lxml_html
+
+    root = lxml_html.document_fromstring(html)
+    tables = []
+    for table in root.iter('table'):
+        rows = []
+        for table_row in table.iter('tr'):
+            rows.append((
+                bool(table_row.xpath('boolean(.//th)')),
+                [cell.text_content().strip() for cell in table_row.iter('td')]
+            ))
+        tables.append(rows)
+    return tables
@@ -5,17 +5,26 @@
 """
 # pylint: disable=line-too-long
 
+import time
 import logging
-from datetime import datetime
+import threading
+import requests
 from influxdb import InfluxDBClient
 from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
+import arris_stats_line_protocol
 
+# Writers live for the whole process so their connection pool is reused between polls instead of
+# doing a new TCP (and TLS) handshake every time.  Keyed by connection settings for fleet mode, which
+# also means every modem sending to the same database shares one buffer of lines.
+influx_writers = {}
+influx_writers_lock = threading.Lock()
 
-def send_to_influx(stats, config):
-    """ Send the stats to InfluxDB """
-    logging.info('Sending stats to InfluxDB (%s:%s)', config['influx_host'], config['influx_port'])
 
-    influx_client = InfluxDBClient(
+def get_influx_writer(config):
+    """ Return the long lived writer for this config, creating it on first use.
+        A writer is a dict of the client, the line buffer and the database.
+    """
+    key = (
         config['influx_host'],
         config['influx_port'],
         config['influx_username'],
@@ -23,62 +32,91 @@ def send_to_influx(stats, config):
         config['influx_database'],
         config['influx_use_ssl'],
         config['influx_verify_ssl'],
+        config['influx_gzip'],
+        config['influx_batch_cycles'],
     )
+    with influx_writers_lock:
+        if key not in influx_writers:
+            logging.debug('Creating InfluxDB client for %s:%s', config['influx_host'], config['influx_port'])
+            influx_writers[key] = {
+                'client': InfluxDBClient(*key[:7], gzip=config['influx_gzip']),
+                'buffer': arris_stats_line_protocol.LineBuffer(config['influx_batch_cycles']),
+                'database': config['influx_database']
+            }
+        return influx_writers[key]
 
-    series = []
-    current_time = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
 
-    for stats_down in stats['downstream']:
-        record = {
-            'measurement': 'downstream_statistics',
-            'time': current_time,
-            'fields': {},
-            'tags': {
-                'channel_id': int(stats_down['channel_id'])
-            }
-        }
-        for field in stats_down:
-            if field == 'channel_id':
-                continue
-            if '.' in stats_down[field]:
-                record['fields'][field] = float(stats_down[field])
-            else:
-                record['fields'][field] = int(stats_down[field])
-        series.append(record)
-
-    for stats_up in stats['upstream']:
-        record = {
-            'measurement': 'upstream_statistics',
-            'time': current_time,
-            'fields': {},
-            'tags': {
-                'channel_id': int(stats_up['channel_id'])
-            }
-        }
-        for field in stats_up:
-            if field == 'channel_id':
-                continue
-            if '.' in stats_up[field]:
-                record['fields'][field] = float(stats_up[field])
-            else:
-                record['fields'][field] = int(stats_up[field])
-        series.append(record)
+def close_influx_writers():
+    """ Write anything still buffered and close every client, called from arris_stats.close_destinations() at exit """
+    with influx_writers_lock:
+        for writer in influx_writers.values():
+            # One writer failing mustn't stop the others, or the rest of close_destinations()
+            try:
+                lines = writer['buffer'].drain()
+                if lines:
+                    write_lines(writer, lines)
+            except Exception as exception:  # pylint: disable=broad-except
+                logging.error('Error flushing InfluxDB writer for %s', writer['database'])
+                logging.error(exception)
+            finally:
+                writer['client'].close()
+        influx_writers.clear()
+
+
+def send_to_influx(stats, config):
+    """ Send the stats to InfluxDB, returns True if they were written or buffered """
+    return send_batch_to_influx([stats], config)
 
-    try:
-        influx_client.write_points(series)
-    except (InfluxDBClientError, ConnectionError, InfluxDBServerError, ConnectionRefusedError) as exception:
 
-        # If DB doesn't exist, try to create it
-        if hasattr(exception, 'code') and exception.code == 404:
+def send_batch_to_influx(stats_list, config):
+    """ Send the stats from several polls to InfluxDB, each with its own timestamp.
+        Returns True if they were written or buffered
+    """
+    logging.info('Sending stats to InfluxDB (%s:%s)', config['influx_host'], config['influx_port'])
+
+    writer = get_influx_writer(config)
+
+    tags = {}
+    if config['modem_id']:
+        tags['modem_id'] = config['modem_id']
+    lines = []
+    for stats in stats_list:
+        lines.extend(arris_stats_line_protocol.encode_stats(stats, stats.get('timestamp_ns') or time.time_ns(), tags))
+
+    # Hold on to the lines until influx_batch_cycles sends have been buffered
+    lines = writer['buffer'].add(lines)
+    if lines is None:
+        logging.info('Buffered data for InfluxDB')
+        return True
+
+    if not write_lines(writer, lines):
+        # Try the buffered polls again with the next write
+        writer['buffer'].restore(lines)
+        return False
+    return True
+
+
+def write_lines(writer, lines):
+    """ Write a list of line protocol lines in one request """
+    influx_client = writer['client']
+    try:
+        try:
+            influx_client.write_points(lines, protocol='line')
+        except InfluxDBClientError as exception:
+            # If DB doesn't exist, try to create it
+            if exception.code != 404:
+                raise
             logging.warning('Database %s Does Not Exist.  Attempting to create database',
-                            config['influx_database'])
-            influx_client.create_database(config['influx_database'])
-            influx_client.write_points(series)
-        else:
-            logging.error(exception)
-            logging.error('Failed To Write To InfluxDB')
-            return
-
-    logging.info('Successfully wrote data to InfluxDB')
-    logging.debug('Influx series sent to db:')
-    logging.debug(series)
+                            writer['database'])
+            influx_client.create_database(writer['database'])
+            influx_client.write_points(lines, protocol='line')
+    # The client raises requests' own ConnectionError when the server is down, which isn't the builtin one
+    except (InfluxDBClientError, InfluxDBServerError, requests.exceptions.RequestException, ConnectionError) as exception:
+        logging.error(exception)
+        logging.error('Failed To Write To InfluxDB')
+        return False
+
+    logging.info('Successfully wrote %s lines to InfluxDB', len(lines))
+    logging.debug('Influx lines sent to db:')
+    logging.debug(lines)
+    return True
@@ -8,74 +8,141 @@
 """
 # pylint: disable=line-too-long
 
+import time
 import logging
-from datetime import datetime
-from influxdb_client import InfluxDBClient
+import threading
+import urllib3
+from influxdb_client import InfluxDBClient, WriteOptions
 from influxdb_client.client.exceptions import InfluxDBError
 from influxdb_client.client.write_api import SYNCHRONOUS
+import arris_stats_line_protocol
 
+# Writers live for the whole process so their connection pool is reused between polls instead of
+# doing a new TCP (and TLS) handshake every time.  Keyed by connection settings for fleet mode, which
+# also means every modem sending to the same bucket shares one buffer of lines.
+influx_writers = {}
+influx_writers_lock = threading.Lock()
 
-def send_to_influx(stats, config):
-    """ Send the stats to InfluxDB """
-    logging.info('Sending stats to InfluxDB (%s:%s)', config['influx_host'], config['influx_port'])
-
-    influx_client = InfluxDBClient(
-        url=config['influx_url'],
-        token=config['influx_token'],
-        org=config['influx_org'],
-        bucket=config['influx_bucket'],
-        verify_ssl=config['influx_verify_ssl'],
-    )
-
-    series = []
-    current_time = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
 
-    for stats_down in stats['downstream']:
-        record = {
-            'measurement': 'downstream_statistics',
-            'time': current_time,
-            'fields': {},
-            'tags': {
-                'channel_id': int(stats_down['channel_id'])
-            }
-        }
-        for field in stats_down:
-            if field == 'channel_id':
-                continue
-            if '.' in stats_down[field]:
-                record['fields'][field] = float(stats_down[field])
+def get_influx_writer(config):
+    """ Return the long lived writer for this config, creating it on first use.
+        A writer is a dict of the client, its write_api, the line buffer and the bucket.
+    """
+    key = (
+        config['influx_url'],
+        config['influx_token'],
+        config['influx_org'],
+        config['influx_verify_ssl'],
+        config['influx_write_mode'],
+        config['influx_batch_size'],
+        config['influx_flush_interval'],
+        config['influx_gzip'],
+        config['influx_batch_cycles'],
+        config['influx_bucket'],
+    )
+    with influx_writers_lock:
+        if key not in influx_writers:
+            logging.debug('Creating InfluxDB %s writer for %s', config['influx_write_mode'], config['influx_url'])
+            influx_client = InfluxDBClient(
+                url=config['influx_url'],
+                token=config['influx_token'],
+                org=config['influx_org'],
+                verify_ssl=config['influx_verify_ssl'],
+                enable_gzip=config['influx_gzip'],
+            )
+            if config['influx_write_mode'] == 'batching':
+                # Points are queued and written from a background thread, so the poll loop never waits on Influx
+                write_api = influx_client.write_api(
+                    write_options=WriteOptions(batch_size=config['influx_batch_size'], flush_interval=config['influx_flush_interval']),
+                    success_callback=batch_written,
+                    error_callback=batch_failed
+                )
+            elif config['influx_write_mode'] == 'synchronous':
+                write_api = influx_client.write_api(write_options=SYNCHRONOUS)
             else:
-                record['fields'][field] = int(stats_down[field])
-        series.append(record)
-
-    for stats_up in stats['upstream']:
-        record = {
-            'measurement': 'upstream_statistics',
-            'time': current_time,
-            'fields': {},
-            'tags': {
-                'channel_id': int(stats_up['channel_id'])
+                raise RuntimeError('Influx write mode %s not supported!' % config['influx_write_mode'])
+            influx_writers[key] = {
+                'client': influx_client,
+                'write_api': write_api,
+                'buffer': arris_stats_line_protocol.LineBuffer(config['influx_batch_cycles']),
+                'bucket': config['influx_bucket']
             }
-        }
-        for field in stats_up:
-            if field == 'channel_id':
-                continue
-            if '.' in stats_up[field]:
-                record['fields'][field] = float(stats_up[field])
-            else:
-                record['fields'][field] = int(stats_up[field])
-        series.append(record)
+        return influx_writers[key]
+
+
+def close_influx_writers():
+    """ Flush anything still buffered or batched and close every writer, called from arris_stats.close_destinations() at exit """
+    with influx_writers_lock:
+        for writer in influx_writers.values():
+            # One writer failing mustn't stop the others, or the rest of close_destinations()
+            try:
+                lines = writer['buffer'].drain()
+                if lines:
+                    write_lines(writer, lines)
+                writer['write_api'].close()
+            except Exception as exception:  # pylint: disable=broad-except
+                logging.error('Error flushing InfluxDB writer for bucket %s', writer['bucket'])
+                logging.error(exception)
+            finally:
+                writer['client'].close()
+        influx_writers.clear()
+
+
+def batch_written(conf, data):  # pylint: disable=unused-argument
+    """ Background batch write callback """
+    logging.debug('Successfully wrote batch to InfluxDB bucket %s', conf[0])
+
+
+def batch_failed(conf, data, exception):  # pylint: disable=unused-argument
+    """ Background batch write callback """
+    logging.error('Failed To Write To InfluxDB bucket %s', conf[0])
+    logging.error(exception)
 
+
+def send_to_influx(stats, config):
+    """ Send the stats to InfluxDB, returns True if they were written or buffered """
+    return send_batch_to_influx([stats], config)
+
+
+def send_batch_to_influx(stats_list, config):
+    """ Send the stats from several polls to InfluxDB, each with its own timestamp.
+        Returns True if they were written or buffered
+    """
+    logging.info('Sending stats to InfluxDB (%s)', config['influx_url'])
+
+    writer = get_influx_writer(config)
+
+    tags = {}
+    if config['modem_id']:
+        tags['modem_id'] = config['modem_id']
+    lines = []
+    for stats in stats_list:
+        lines.extend(arris_stats_line_protocol.encode_stats(stats, stats.get('timestamp_ns') or time.time_ns(), tags))
+
+    # Hold on to the lines until influx_batch_cycles sends have been buffered
+    lines = writer['buffer'].add(lines)
+    if lines is None:
+        logging.info('Buffered data for InfluxDB')
+        return True
+
+    if not write_lines(writer, lines):
+        # Try the buffered polls again with the next write
+        writer['buffer'].restore(lines)
+        return False
+    return True
+
+
+def write_lines(writer, lines):
+    """ Write a list of line protocol lines in one request, or queue them in batching mode """
     try:
-        write_api = influx_client.write_api(write_options=SYNCHRONOUS)
-        write_api.write(record=series, bucket=config['influx_bucket'])
-    except (InfluxDBError, ConnectionError, ConnectionRefusedError) as exception:
+        writer['write_api'].write(record='\n'.join(lines), bucket=writer['bucket'])
+    # A server that's down raises urllib3's NewConnectionError / MaxRetryError, not the builtin ConnectionError
+    except (InfluxDBError, urllib3.exceptions.HTTPError, ConnectionError) as exception:
         logging.error('Failed To Write To InfluxDB')
         logging.error(exception)
-        return
-
-    logging.info('Successfully wrote data to InfluxDB')
-    logging.debug('Influx series sent to db:')
-    logging.debug(series)
+        return False
 
-    influx_client.close()
+    logging.info('Successfully sent %s lines to InfluxDB', len(lines))
+    logging.debug('Influx lines sent to db:')
+    logging.debug(lines)
+    return True
@@ -0,0 +1,116 @@
+"""
+    InfluxDB line protocol encoding
+
+    https://github.com/andrewfraley/arris_cable_modem_stats
+
+    Channels are encoded straight to line protocol instead of building a dict per channel
+    for the client library to serialise again.  https://docs.influxdata.com/influxdb/v1.8/write_protocols/line_protocol_reference/
+"""
+# pylint: disable=line-too-long
+
+import math
+import threading
+
+# Most lines a LineBuffer holds on to after failed writes, a few thousand polls, the oldest go first
+MAX_RESTORED_LINES = 100000
+
+
+def encode_stats(stats, timestamp_ns, tags=None):
+    """ Return a list of line protocol lines, one per downstream and upstream channel plus one
+        for each channel summary, the collector statistics, each event and each probe if there are any.  tags is a dict of extra tags added to every line, such as modem_id
+    """
+    extra_tags = ''
+    if tags:
+        extra_tags = ''.join(',%s=%s' % (escape_tag(key), escape_tag(str(value))) for key, value in sorted(tags.items()))
+
+    lines = []
+
+    def add_line(series, record, line_timestamp_ns):
+        # A record with nothing but NaN / inf fields has no line at all
+        fields = encode_fields(record)
+        if fields:
+            lines.append('%s %s %d' % (series, fields, line_timestamp_ns))
+
+    for direction in ['downstream', 'upstream']:
+        for channel in stats[direction]:
+            add_line('%s,channel_id=%d%s' % (channel.measurement, channel.channel_id, extra_tags), channel, timestamp_ns)
+
+    # Summaries have the timestamp of their window
+    for key in ['downstream_summary', 'upstream_summary']:
+        for summary in stats.get(key) or []:
+            add_line('%s,channel_id=%d%s' % (summary.measurement, summary.channel_id, extra_tags), summary, summary.timestamp_ns)
+
+    if stats.get('collector'):
+        add_line(stats['collector'].measurement + extra_tags, stats['collector'], timestamp_ns)
+
+    # Events from one poll share its timestamp, a nanosecond apart so they don't overwrite each other
+    for index, event in enumerate(stats.get('events') or []):
+        add_line(event.measurement + extra_tags, event, timestamp_ns + index)
+
+    for probe in stats.get('probes') or []:
+        add_line('%s,kind=%s,target=%s%s' % (probe.measurement, probe.kind, escape_tag(probe.target), extra_tags), probe, timestamp_ns)
+    return lines
+
+
+def encode_fields(record):
+    """ Return the field set of a channel, collector statistics, event or probe, ints get the i suffix so they stay ints.
+        None, NaN and inf are left out, Influx rejects the whole write if it gets a NaN or inf
+    """
+    fields = []
+    for field in record.fields:
+        value = getattr(record, field)
+        if value is None or (isinstance(value, float) and not math.isfinite(value)):
+            continue
+        if isinstance(value, int):
+            fields.append('%s=%di' % (field, value))
+        elif isinstance(value, str):
+            fields.append('%s="%s"' % (field, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')))
+        else:
+            fields.append('%s=%r' % (field, value))
+    return ','.join(fields)
+
+
+def escape_tag(value):
+    """ Escape commas, equals signs and spaces in a tag key or value """
+    return value.replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+
+class LineBuffer:
+    """ Holds the lines of several polls (from one or many modems) so they can go out in one write """
+
+    def __init__(self, max_cycles):
+        self.max_cycles = max_cycles
+        self.lines = []
+        self.cycles = 0
+        self.lock = threading.Lock()
+
+    def add(self, lines):
+        """ Add the lines from one poll.  Returns every buffered line once max_cycles
+            polls have been added, otherwise None
+        """
+        with self.lock:
+            self.lines.extend(lines)
+            self.cycles += 1
+            if self.cycles < self.max_cycles:
+                return None
+            return self._drain()
+
+    def restore(self, lines):
+        """ Put back lines from add() whose write failed, so they go out with the next write.
+            With one poll per write nothing is ever held, retrying is up to the caller or the spool
+        """
+        if self.max_cycles <= 1:
+            return
+        with self.lock:
+            self.lines = (lines + self.lines)[-MAX_RESTORED_LINES:]
+
+    def drain(self):
+        """ Return and forget every buffered line """
+        with self.lock:
+            return self._drain()
+
+    def _drain(self):
+        lines = self.lines
+        self.lines = []
+        self.cycles = 0
+        return lines
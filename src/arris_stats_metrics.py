@@ -0,0 +1,145 @@
+"""
+    Timings and error counts for the collector itself
+
+    https://github.com/andrewfraley/arris_cable_modem_stats
+
+    Every stage of a poll (login, fetch, parse and the send to each destination) is timed
+    into a histogram, and failed logins, login pages and destination errors are counted,
+    all per modem.  The prometheus destination serves them on /metrics alongside the modem
+    stats, and with collector_statistics = True each poll also sends the latest of them to
+    the destinations as a collector_statistics measurement.
+"""
+# pylint: disable=line-too-long
+
+import time
+import threading
+import contextlib
+import arris_stats_records
+
+STAGES = ('login', 'fetch', 'parse', 'send')
+COUNTERS = {
+    'failed_logins': 'Logins to the modem that failed',
+    'login_pages': 'Times the modem answered with its login page instead of the stats',
+    'sink_errors': 'Sends to a destination that failed',
+}
+
+# Upper bounds in seconds, from a fast LAN page fetch up to a Timestream write that's timing out
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# (stage, modem_id, destination) -> Histogram
+histograms = {}
+
+# (counter, modem_id, destination) -> count
+counters = {}
+
+# (stage, modem_id) -> seconds the stage took last time, the send is the slowest destination's
+last_seconds = {}
+
+metrics_lock = threading.Lock()
+
+
+class Histogram:
+    """ Cumulative counts of observations in each of BUCKETS, the Prometheus way """
+    __slots__ = ('bucket_counts', 'count', 'sum')
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+
+
+def observe(stage, seconds, config, destination=None):
+    """ Record how long a stage took """
+    key = (stage, config['modem_id'], destination)
+    with metrics_lock:
+        if key not in histograms:
+            histograms[key] = Histogram()
+        histograms[key].observe(seconds)
+        if destination and last_seconds.get((stage, config['modem_id']), 0) > seconds:
+            return
+        last_seconds[(stage, config['modem_id'])] = seconds
+
+
+@contextlib.contextmanager
+def timed(stage, config, destination=None):
+    """ Time the body of a with statement as stage, whether it succeeds or not """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start, config, destination)
+
+
+def increment(counter, config, destination=None):
+    """ Add one to counter """
+    key = (counter, config['modem_id'], destination)
+    with metrics_lock:
+        counters[key] = counters.get(key, 0) + 1
+
+
+def get_total(counter):
+    """ Return counter added up over every modem and destination """
+    with metrics_lock:
+        return sum(count for (name, _, _), count in counters.items() if name == counter)
+
+
+def get_collector_statistics(config):
+    """ Return the latest timings and the error counts so far for config's modem, to send along with its stats """
+    modem_id = config['modem_id']
+    with metrics_lock:
+        values = {stage + '_seconds': last_seconds.get((stage, modem_id)) for stage in STAGES}
+        for counter in COUNTERS:
+            values[counter] = sum(count for (name, modem, _), count in counters.items() if name == counter and modem == modem_id)
+        # The send time is per poll, start again for the next one
+        last_seconds.pop(('send', modem_id), None)
+    return arris_stats_records.CollectorStatistics(**values)
+
+
+def render():
+    """ Return every histogram and counter in the Prometheus text format """
+    with metrics_lock:
+        histogram_items = sorted(histograms.items(), key=lambda item: tuple(str(part) for part in item[0]))
+        histogram_data = [(key, list(histogram.bucket_counts), histogram.count, histogram.sum) for key, histogram in histogram_items]
+        counter_items = sorted(counters.items(), key=lambda item: tuple(str(part) for part in item[0]))
+
+    lines = []
+    if histogram_data:
+        name = 'arris_collector_stage_seconds'
+        lines.append('# HELP %s Time taken by each stage of a poll' % name)
+        lines.append('# TYPE %s histogram' % name)
+        for (stage, modem_id, destination), bucket_counts, count, total in histogram_data:
+            labels = get_labels(modem_id, destination, stage=stage)
+            for bound, bucket_count in zip(BUCKETS, bucket_counts):
+                lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, bucket_count))
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, count))
+            lines.append('%s_sum{%s} %r' % (name, labels, total))
+            lines.append('%s_count{%s} %d' % (name, labels, count))
+
+    for counter, help_text in COUNTERS.items():
+        samples = [(key, count) for key, count in counter_items if key[0] == counter]
+        if not samples:
+            continue
+        name = 'arris_collector_%s_total' % counter
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s counter' % name)
+        for (_, modem_id, destination), count in samples:
+            labels = get_labels(modem_id, destination)
+            lines.append('%s%s %d' % (name, '{%s}' % labels if labels else '', count))
+
+    return ''.join(line + '\n' for line in lines)
+
+
+def get_labels(modem_id, destination, **labels):
+    """ Return the label pairs for a sample, leaving out the ones that aren't set """
+    if modem_id:
+        labels['modem_id'] = modem_id
+    if destination:
+        labels['destination'] = destination
+    return ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in labels.items())
@@ -0,0 +1,101 @@
+"""
+    Internet latency probes, run alongside each modem poll
+
+    https://github.com/andrewfraley/arris_cable_modem_stats
+
+    Every target in probe_targets is probed at the same time with asyncio while the modem
+    is polled, and the results go to the destinations with the poll's stats and timestamp,
+    so a latency spike lines up with the channel stats from the same moment.  Targets are:
+
+        tcp:host:port       time to open a TCP connection
+        dns:name            time to resolve the name with the system resolver
+        http://host/path    time from connecting to the first line of the response to a HEAD
+        https://host/path   the same, including the TLS handshake
+
+    A probe that fails or takes longer than probe_timeout gets success = 0 and no latency.
+    Only the standard library is used, so there's nothing extra to install.
+"""
+# pylint: disable=line-too-long
+
+import ssl
+import time
+import asyncio
+import logging
+import threading
+import urllib.parse
+from arris_stats_records import ProbeResult
+
+
+def get_targets(probe_targets):
+    """ Split probe_targets into (kind, target) pairs, raises RuntimeError on one we don't understand """
+    targets = []
+    for target in [target.strip() for target in probe_targets.split(',') if target.strip()]:
+        if target.startswith(('http://', 'https://')):
+            targets.append(('http', target))
+        elif target.startswith('dns:') and target[len('dns:'):]:
+            targets.append(('dns', target[len('dns:'):]))
+        elif target.startswith('tcp:') and target.rpartition(':')[2].isdigit():
+            targets.append(('tcp', target[len('tcp:'):]))
+        else:
+            raise RuntimeError('Probe target %s not supported!  Use tcp:host:port, dns:name or an http(s):// url' % target)
+    return targets
+
+
+class ProbeRun:
+    """ Probes every target from a thread of its own while the poll runs """
+
+    def __init__(self, config):
+        self.results = []
+        self.thread = threading.Thread(target=self.run, args=(config['probe_target_list'], config['probe_timeout']), name='probe', daemon=True)
+        self.thread.start()
+
+    def run(self, targets, timeout):
+        self.results = asyncio.run(probe_all(targets, timeout))
+
+    def wait(self):
+        """ Return the results once every probe has finished, they all give up after probe_timeout """
+        self.thread.join()
+        return self.results
+
+
+async def probe_all(targets, timeout):
+    """ Probe every target at once, return a ProbeResult for each """
+    return await asyncio.gather(*[probe(kind, target, timeout) for kind, target in targets])
+
+
+async def probe(kind, target, timeout):
+    """ Probe one target, return a ProbeResult """
+    probe_function = {'tcp': probe_tcp, 'dns': probe_dns, 'http': probe_http}[kind]
+    start = time.perf_counter()
+    try:
+        status_code = await asyncio.wait_for(probe_function(target), timeout)
+    except (OSError, asyncio.TimeoutError, ValueError, IndexError) as exception:
+        logging.info('Probe of %s failed: %s', target, str(exception) or type(exception).__name__)
+        return ProbeResult(target, kind, None, 0)
+    return ProbeResult(target, kind, (time.perf_counter() - start) * 1000, 1, status_code)
+
+
+async def probe_tcp(target):
+    host, _, port = target.rpartition(':')
+    _, writer = await asyncio.open_connection(host.strip('[]'), int(port))
+    writer.close()
+
+
+async def probe_dns(target):
+    await asyncio.get_running_loop().getaddrinfo(target, None)
+
+
+async def probe_http(target):
+    """ Send a HEAD and wait for the status line, returns the status code """
+    url = urllib.parse.urlsplit(target)
+    path = (url.path or '/') + ('?' + url.query if url.query else '')
+    https = url.scheme == 'https'
+    reader, writer = await asyncio.open_connection(url.hostname, url.port or (443 if https else 80), ssl=ssl.create_default_context() if https else None)
+    try:
+        writer.write(('HEAD %s HTTP/1.1\r\nHost: %s\r\nUser-Agent: arris_cable_modem_stats\r\nConnection: close\r\n\r\n' % (path, url.netloc)).encode())
+        await writer.drain()
+        status_line = await reader.readline()
+    finally:
+        writer.close()
+    # HTTP/1.1 200 OK
+    return int(status_line.split()[1])
@@ -0,0 +1,182 @@
+"""
+    Prometheus exporter functions
+
+    https://github.com/andrewfraley/arris_cable_modem_stats
+
+    Unlike the other destinations nothing is sent anywhere, the latest stats of each modem
+    are kept here and served on /metrics for Prometheus to scrape.  Scrapes never touch the
+    modem, they get the text rendered from the last poll, which is only rendered again once
+    a new poll comes in.  The collector's own timings and error counts from arris_stats_metrics
+    are served after them.  https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+# pylint: disable=line-too-long
+
+import time
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import arris_stats_metrics
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Channel field -> (metric name, type, help)
+CHANNEL_METRICS = {
+    'frequency': ('arris_channel_frequency_hertz', 'gauge', 'Channel frequency in Hz'),
+    'power': ('arris_channel_power_dbmv', 'gauge', 'Channel power in dBmV'),
+    'snr': ('arris_channel_snr_db', 'gauge', 'Downstream channel signal to noise ratio in dB'),
+    'corrected': ('arris_channel_corrected_total', 'counter', 'Downstream codewords corrected since the modem booted'),
+    'uncorrectables': ('arris_channel_uncorrectables_total', 'counter', 'Downstream codewords that could not be corrected since the modem booted'),
+    'symbol_rate': ('arris_channel_symbol_rate_ksps', 'gauge', 'Upstream channel symbol rate in Ksym/s'),
+}
+POLL_METRIC = ('arris_poll_timestamp_seconds', 'gauge', 'Time of the poll the stats come from')
+
+# Probe field -> (metric name, type, help, scale)
+PROBE_METRICS = {
+    'latency_ms': ('arris_probe_latency_seconds', 'gauge', 'Latency of the last probe of the target', 0.001),
+    'success': ('arris_probe_success', 'gauge', '1 if the last probe of the target worked, 0 if it failed', 1),
+}
+
+# One exporter per listen address, shared by every modem in fleet mode
+exporters = {}
+exporters_lock = threading.Lock()
+
+
+def get_exporter(config):
+    """ Return the exporter for this config's listen address, starting its http server on first use """
+    key = (config['prometheus_host'], config['prometheus_port'])
+    with exporters_lock:
+        if key not in exporters:
+            exporters[key] = Exporter(key[0], key[1], config['prometheus_max_age'])
+        return exporters[key]
+
+
+def close_exporters():
+    """ Stop every http server, called from arris_stats.close_destinations() at exit """
+    with exporters_lock:
+        for exporter in exporters.values():
+            exporter.close()
+        exporters.clear()
+
+
+def send_to_prometheus(stats, config):
+    """ Make the stats the ones served on /metrics """
+    return send_batch_to_prometheus([stats], config)
+
+
+def send_batch_to_prometheus(stats_list, config):
+    """ Only the newest poll in stats_list matters, a scrape just wants the current values """
+    stats = max(stats_list, key=lambda stats: stats.get('timestamp_ns') or 0)
+    get_exporter(config).update(config['modem_id'], stats)
+    logging.info('Updated the stats served at http://%s:%s/metrics', config['prometheus_host'], config['prometheus_port'])
+    return True
+
+
+class Exporter:
+    """ The latest samples of every modem, and the http server that serves them """
+
+    def __init__(self, host, port, max_age):
+        self.max_age = max_age
+        self.lock = threading.Lock()
+
+        # modem_id -> (poll time in seconds, {metric name: [sample lines]})
+        self.samples = {}
+        self.text = None
+
+        handler = type('MetricsHandler', (MetricsHandler,), {'exporter': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='prometheus-exporter', daemon=True)
+        self.thread.start()
+        logging.info('Serving Prometheus metrics on http://%s:%s/metrics', host, port)
+
+    def update(self, modem_id, stats):
+        """ Replace the modem's samples with the ones from stats """
+        timestamp = (stats.get('timestamp_ns') or time.time_ns()) / 1000000000
+        samples = get_samples(stats, modem_id, timestamp)
+        with self.lock:
+            self.samples[modem_id] = (timestamp, samples)
+            self.text = None
+
+    def render(self):
+        """ Return the exposition text, only rendering it again if a poll came in or went stale since last time """
+        with self.lock:
+            if self.max_age:
+                oldest = time.time() - self.max_age
+                for modem_id, (timestamp, _) in list(self.samples.items()):
+                    if timestamp < oldest:
+                        logging.warning('No stats from %s for over %ss, no longer serving them', modem_id or 'the modem', self.max_age)
+                        del self.samples[modem_id]
+                        self.text = None
+
+            if self.text is None:
+                self.text = render_samples([samples for _, samples in self.samples.values()]).encode()
+            return self.text
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """ Serves GET /metrics, subclassed by Exporter with its exporter attribute set """
+    exporter = None
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = self.exporter.render() + arris_stats_metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logging.debug('Prometheus scrape from %s: ' + format, self.client_address[0], *args)
+
+
+def get_samples(stats, modem_id, timestamp):
+    """ Return {metric name: [sample lines]} for every channel and probe in stats """
+    modem_label = ''
+    poll_labels = ''
+    if modem_id:
+        modem_label = ',modem_id="%s"' % escape_label(modem_id)
+        poll_labels = '{%s}' % modem_label[1:]
+
+    samples = {POLL_METRIC[0]: ['%s%s %r' % (POLL_METRIC[0], poll_labels, timestamp)]}
+    for direction in ['downstream', 'upstream']:
+        for channel in stats[direction]:
+            labels = '{direction="%s",channel_id="%d"%s}' % (direction, channel.channel_id, modem_label)
+            for field in channel.fields:
+                value = getattr(channel, field)
+                if value is None or field not in CHANNEL_METRICS:
+                    continue
+                name = CHANNEL_METRICS[field][0]
+                samples.setdefault(name, []).append('%s%s %r' % (name, labels, value))
+
+    for probe in stats.get('probes') or []:
+        labels = '{kind="%s",target="%s"%s}' % (probe.kind, escape_label(probe.target), modem_label)
+        for field, (name, _, _, scale) in PROBE_METRICS.items():
+            value = getattr(probe, field)
+            if value is not None:
+                samples.setdefault(name, []).append('%s%s %r' % (name, labels, value * scale))
+    return samples
+
+
+def render_samples(samples_list):
+    """ Merge the samples of every modem into one exposition, each metric's samples have to be together """
+    lines = []
+    for name, metric_type, help_text in [POLL_METRIC] + list(CHANNEL_METRICS.values()) + [metric[:3] for metric in PROBE_METRICS.values()]:
+        metric_lines = [line for samples in samples_list for line in samples.get(name, [])]
+        if metric_lines:
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+            lines.extend(metric_lines)
+    return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    """ Escape backslashes, double quotes and newlines in a label value """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,224 @@
+"""
+    Typed records in the stats dict, and its conversion to and from plain dicts for json
+
+    https://github.com/andrewfraley/arris_cable_modem_stats
+
+    The parse_html_* functions return DownstreamChannel / UpstreamChannel records, and the
+    optional features add their own alongside them: channel summaries, collector statistics,
+    event log entries and probe results.
+
+    Parsers convert every value exactly once, so destinations can use them as is:
+    channel_id, frequency (Hz), corrected, uncorrectables and symbol_rate (Ksym/s) are
+    ints, power (dBmV) and snr (dB) are floats.  A field a model doesn't report is None.
+    The exception is the T25's frequency, kept the float it has always been written as, and
+    in MHz rather than Hz for upstream.
+"""
+# pylint: disable=line-too-long
+
+
+class Record:
+    """ Base class for every record, compared and printed as its plain dict """
+    __slots__ = ()
+
+    # Name used for the measurement / event type by the destinations
+    measurement = None
+
+    # What the record is about, the destinations' tags / dimensions / labels
+    keys = ()
+
+    # Every value, in output order
+    fields = ()
+
+    def to_dict(self):
+        """ Return the record as a plain dict, leaving out anything that wasn't reported """
+        return {name: getattr(self, name) for name in self.keys + self.fields if getattr(self, name) is not None}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, self.to_dict())
+
+
+class ChannelStats(Record):
+    """ Base class for the stats of one channel """
+    __slots__ = ('channel_id',)
+    keys = ('channel_id',)
+
+
+class DownstreamChannel(ChannelStats):
+    """ Stats for one downstream channel.  The *_delta (count since the last poll) and
+        *_rate (per second since the last poll) fields are only filled in by arris_stats_counters
+    """
+    __slots__ = ('frequency', 'power', 'snr', 'corrected', 'uncorrectables',
+                 'corrected_delta', 'uncorrectables_delta', 'corrected_rate', 'uncorrectables_rate')
+    measurement = 'downstream_statistics'
+    fields = ('frequency', 'power', 'snr', 'corrected', 'uncorrectables',
+              'corrected_delta', 'uncorrectables_delta', 'corrected_rate', 'uncorrectables_rate')
+
+    def __init__(self, channel_id, frequency, power, snr, corrected, uncorrectables,  # pylint: disable=too-many-arguments
+                 corrected_delta=None, uncorrectables_delta=None, corrected_rate=None, uncorrectables_rate=None):
+        self.channel_id = channel_id
+        self.frequency = frequency
+        self.power = power
+        self.snr = snr
+        self.corrected = corrected
+        self.uncorrectables = uncorrectables
+        self.corrected_delta = corrected_delta
+        self.uncorrectables_delta = uncorrectables_delta
+        self.corrected_rate = corrected_rate
+        self.uncorrectables_rate = uncorrectables_rate
+
+
+class UpstreamChannel(ChannelStats):
+    """ Stats for one upstream channel """
+    __slots__ = ('symbol_rate', 'frequency', 'power')
+    measurement = 'upstream_statistics'
+    fields = ('symbol_rate', 'frequency', 'power')
+
+    def __init__(self, channel_id, frequency, power, symbol_rate=None):
+        self.channel_id = channel_id
+        self.symbol_rate = symbol_rate
+        self.frequency = frequency
+        self.power = power
+
+
+# Statistics of each summarised field in a ChannelSummary
+SUMMARY_STATISTICS = ('min', 'max', 'mean', 'p95')
+
+
+class ChannelSummary(ChannelStats):
+    """ Base class for the summary of one channel over an aggregation window, see arris_stats_aggregate.
+        timestamp_ns is the start of the window, samples the number of polls in it and *_anomalies
+        the number of those whose z-score was past aggregate_zscore.  Sent as stats['downstream_summary']
+        and stats['upstream_summary'] when aggregate_window is set
+    """
+    __slots__ = ('timestamp_ns',)
+
+    # Fields with min / max / mean / p95 and anomalies
+    summarised = ()
+
+    def __init__(self, channel_id, timestamp_ns, **values):
+        self.channel_id = channel_id
+        self.timestamp_ns = timestamp_ns
+        for field in self.fields:
+            setattr(self, field, values.get(field))
+
+    def to_dict(self):
+        """ Return the summary as a plain dict, with its window's timestamp """
+        return dict(super().to_dict(), timestamp_ns=self.timestamp_ns)
+
+
+class DownstreamSummary(ChannelSummary):
+    """ Summary of a downstream channel, corrected and uncorrectables are their last values in the window """
+    summarised = ('power', 'snr')
+    fields = ('samples',) + tuple('%s_%s' % (field, statistic) for field in summarised for statistic in SUMMARY_STATISTICS) + \
+        tuple(field + '_anomalies' for field in summarised) + ('corrected', 'uncorrectables')
+    __slots__ = fields
+    measurement = 'downstream_summary'
+
+
+class UpstreamSummary(ChannelSummary):
+    """ Summary of an upstream channel """
+    summarised = ('power',)
+    fields = ('samples',) + tuple('%s_%s' % (field, statistic) for field in summarised for statistic in SUMMARY_STATISTICS) + \
+        tuple(field + '_anomalies' for field in summarised)
+    __slots__ = fields
+    measurement = 'upstream_summary'
+
+
+class CollectorStatistics(Record):
+    """ Timings and error counts of the collector itself, see arris_stats_metrics.  Sent as
+        stats['collector'] alongside the channels when collector_statistics is enabled
+    """
+    __slots__ = ('login_seconds', 'fetch_seconds', 'parse_seconds', 'send_seconds', 'failed_logins', 'login_pages', 'sink_errors')
+    measurement = 'collector_statistics'
+    fields = __slots__
+
+    def __init__(self, login_seconds=None, fetch_seconds=None, parse_seconds=None, send_seconds=None, failed_logins=0, login_pages=0, sink_errors=0):  # pylint: disable=too-many-arguments
+        self.login_seconds = login_seconds
+        self.fetch_seconds = fetch_seconds
+        self.parse_seconds = parse_seconds
+        self.send_seconds = send_seconds
+        self.failed_logins = failed_logins
+        self.login_pages = login_pages
+        self.sink_errors = sink_errors
+
+
+class ModemEvent(Record):
+    """ One entry from the modem's event log, see arris_stats_events.  Sent as stats['events'],
+        oldest first, alongside the channels when event_log is enabled.  date_time is the modem's
+        own text for it, which is 'Time Not Established' until the modem has the time
+    """
+    __slots__ = ('date_time', 'event_id', 'level', 'description')
+    measurement = 'modem_events'
+    fields = __slots__
+
+    def __init__(self, date_time, event_id, level, description):
+        self.date_time = date_time
+        self.event_id = event_id
+        self.level = level
+        self.description = description
+
+
+class ProbeResult(Record):
+    """ The result of one latency probe, see arris_stats_probe.  Sent as stats['probes'] alongside
+        the channels when probe_targets is set.  latency_ms is None if the probe failed
+    """
+    __slots__ = ('target', 'kind', 'latency_ms', 'success', 'status_code')
+    measurement = 'probe_statistics'
+    keys = ('target', 'kind')
+    fields = ('latency_ms', 'success', 'status_code')
+
+    def __init__(self, target, kind, latency_ms, success, status_code=None):  # pylint: disable=too-many-arguments
+        self.target = target
+        self.kind = kind
+        self.latency_ms = latency_ms
+        self.success = success
+        self.status_code = status_code
+
+
+# stats key -> summary class
+SUMMARY_CLASSES = {
+    'downstream_summary': DownstreamSummary,
+    'upstream_summary': UpstreamSummary
+}
+
+
+def has_records(stats):
+    """ Return True if the stats dict holds anything for the destinations """
+    return any(stats.get(key) for key in ['downstream', 'upstream', 'collector', 'events', 'probes'] + list(SUMMARY_CLASSES))
+
+
+def stats_to_dict(stats):
+    """ Return a copy of the stats dict with the channels converted to plain dicts, ready for json """
+    stats_dict = dict(stats)
+    for direction in ['downstream', 'upstream']:
+        stats_dict[direction] = [channel.to_dict() for channel in stats[direction]]
+    for key in SUMMARY_CLASSES:
+        if stats.get(key):
+            stats_dict[key] = [summary.to_dict() for summary in stats[key]]
+    if stats.get('collector'):
+        stats_dict['collector'] = stats['collector'].to_dict()
+    if stats.get('events'):
+        stats_dict['events'] = [event.to_dict() for event in stats['events']]
+    if stats.get('probes'):
+        stats_dict['probes'] = [probe.to_dict() for probe in stats['probes']]
+    return stats_dict
+
+
+def stats_from_dict(stats_dict):
+    """ The reverse of stats_to_dict() """
+    stats = dict(stats_dict)
+    stats['downstream'] = [DownstreamChannel(**channel) for channel in stats_dict['downstream']]
+    stats['upstream'] = [UpstreamChannel(**channel) for channel in stats_dict['upstream']]
+    for key, summary_class in SUMMARY_CLASSES.items():
+        if stats_dict.get(key):
+            stats[key] = [summary_class(**summary) for summary in stats_dict[key]]
+    if stats_dict.get('collector'):
+        stats['collector'] = CollectorStatistics(**stats_dict['collector'])
+    if stats_dict.get('events'):
+        stats['events'] = [ModemEvent(**dict({field: None for field in ModemEvent.fields}, **event)) for event in stats_dict['events']]
+    if stats_dict.get('probes'):
+        stats['probes'] = [ProbeResult(**dict({'latency_ms': None}, **probe)) for probe in stats_dict['probes']]
+    return stats
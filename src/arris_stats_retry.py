@@ -0,0 +1,150 @@
+"""
+    Timeouts, retries and a circuit breaker for talking to modems
+
+    https://github.com/andrewfraley/arris_cable_modem_stats
+
+    A modem's web server can wedge under load and never answer.  Every request to a modem
+    goes through modem_request(), which gives it connect / read timeouts, retries
+    connection errors, timeouts and 5xx responses with exponential backoff, and never runs
+    past the deadline of the poll it's part of, both timeouts are cut down to what's left of it.
+    The status page, the event log and the parsing in between all share the one deadline.  Logins pass retries=0, every retry of one
+    would be another login.  A modem that keeps failing trips its
+    circuit breaker and isn't polled at all until circuit_breaker_cooldown has passed, so
+    a dead modem costs nothing.
+"""
+# pylint: disable=line-too-long
+
+import time
+import logging
+import threading
+import contextlib
+import requests
+
+# Deadline (time.monotonic()) of the poll running in this thread, set by deadline()
+poll_deadline = threading.local()
+
+# One breaker per modem, keyed by modem_id
+circuit_breakers = {}
+circuit_breakers_lock = threading.Lock()
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """ The poll ran out of time before the request could be made """
+
+
+def get_deadline(config):
+    """ Return the time.monotonic() a poll starting now has to be done by """
+    return time.monotonic() + (config['poll_deadline'] or config['sleep_interval'])
+
+
+def deadline(seconds):
+    """ Every modem_request() in the body of the with statement, in this thread, has to finish within seconds """
+    return deadline_until(time.monotonic() + seconds)
+
+
+@contextlib.contextmanager
+def deadline_until(value):
+    """ Every modem_request() in the body of the with statement, in this thread, has to finish by
+        time.monotonic() value, so steps of a poll run on different threads can share its deadline
+    """
+    poll_deadline.value = value
+    try:
+        yield
+    finally:
+        poll_deadline.value = None
+
+
+def deadline_passed():
+    """ Return True if this thread's deadline has passed, there's no point parsing a page we've no time to send """
+    remaining = get_remaining()
+    return remaining is not None and remaining <= 0
+
+
+def get_remaining():
+    """ Return the seconds left before this thread's deadline, or None if there isn't one """
+    value = getattr(poll_deadline, 'value', None)
+    if value is None:
+        return None
+    return value - time.monotonic()
+
+
+def modem_request(config, session, method, url, retries=None, **kwargs):
+    """ session.request() with the modem timeouts, retries (modem_retries unless given) and the poll's
+        deadline, returns the response.  Raises the last error if every attempt failed, or DeadlineExceeded
+    """
+    if retries is None:
+        retries = config['modem_retries']
+    attempt = 0
+    while True:
+        connect_timeout = config['modem_connect_timeout']
+        read_timeout = config['modem_read_timeout']
+        remaining = get_remaining()
+        if remaining is not None:
+            if remaining <= 0:
+                raise DeadlineExceeded('Poll deadline passed before %s %s' % (method, url))
+            connect_timeout = min(connect_timeout, remaining)
+            read_timeout = min(read_timeout, remaining)
+
+        try:
+            resp = session.request(method, url, timeout=(connect_timeout, read_timeout), **kwargs)
+            if resp.status_code < 500 or attempt >= retries:
+                return resp
+            reason = 'status code %s' % resp.status_code
+            resp.close()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as exception:
+            if attempt >= retries:
+                raise
+            reason = exception
+
+        delay = config['modem_retry_backoff'] * 2 ** attempt
+        remaining = get_remaining()
+        if remaining is not None and remaining <= delay:
+            raise DeadlineExceeded('Poll deadline would pass before retrying %s %s (%s)' % (method, url, reason))
+        attempt += 1
+        logging.warning('Retrying %s in %ss (attempt %s of %s): %s', url, delay, attempt, retries, reason)
+        time.sleep(delay)
+
+
+def get_circuit_breaker(config):
+    """ Return the modem's circuit breaker, creating it on first use """
+    with circuit_breakers_lock:
+        if config['modem_id'] not in circuit_breakers:
+            circuit_breakers[config['modem_id']] = CircuitBreaker(config['modem_id'] or 'the modem', config['circuit_breaker_failures'], config['circuit_breaker_cooldown'])
+        return circuit_breakers[config['modem_id']]
+
+
+class CircuitBreaker:
+    """ Opens after failures polls in a row fail, then lets one poll through every cooldown seconds
+        to see if the modem is back.  failures = 0 means it never opens
+    """
+
+    def __init__(self, name, failures, cooldown):
+        self.name = name
+        self.failures = failures
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        """ Return True if we should poll the modem this time """
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            # Half open, let this one through.  If it fails record() opens the breaker again
+            return True
+        return False
+
+    def record(self, success):
+        """ Record how the poll went """
+        if success:
+            if self.opened_at is not None:
+                logging.info('%s is answering again, closing its circuit breaker', self.name)
+            self.consecutive_failures = 0
+            self.opened_at = None
+            return
+
+        self.consecutive_failures += 1
+        if self.failures and self.consecutive_failures >= self.failures:
+            if self.opened_at is None:
+                logging.error('%s polls of %s in a row failed, not polling it for %ss', self.consecutive_failures, self.name, self.cooldown)
+            self.opened_at = time.monotonic()
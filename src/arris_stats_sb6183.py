@@ -7,25 +7,26 @@
 # pylint: disable=line-too-long
 # pylint: disable=pointless-string-statement
 import logging
-from bs4 import BeautifulSoup
+import arris_stats_html
+from arris_stats_records import DownstreamChannel, UpstreamChannel
 
 
-def parse_html_sb6183(html):
+def parse_html_sb6183(html, backend='beautifulsoup'):
     """ Parse the HTML into the modem stats dict """
     logging.info('Parsing HTML for modem model sb6183')
 
     # Page to parse: http://192.168.100.1/RgConnect.asp
 
-    soup = BeautifulSoup(html, 'html.parser')
+    tables = arris_stats_html.get_tables(html, backend)
     stats = {
         'downstream': [],
         'upstream': []
     }
 
     # downstream table
-    logging.debug("Found %s tables", len(soup.find_all("table")))
-    for table_row in soup.find_all("table")[2].find_all("tr"):
-        if table_row.th:
+    logging.debug("Found %s tables", len(tables))
+    for has_th, cells in tables[2]:
+        if has_th:
             continue
 
         '''
@@ -42,34 +43,34 @@ def parse_html_sb6183(html):
    </tr>
         '''
 
-        channel_id = table_row.find_all('td')[0].text.strip()
+        channel_id = cells[0]
         logging.debug("Processing downstream channel %s", channel_id)
-        # Some firmwares have a header row not already skiped by "if table_row.th", skip it if channel_id isn't an integer
+        # Some firmwares have a header row not already skiped by "if has_th", skip it if channel_id isn't an integer
         if not channel_id.isdigit():
             continue
 
-        frequency = int(table_row.find_all('td')[4].text.replace(" Hz", "").strip())
-        power = float(table_row.find_all('td')[5].text.replace(" dBmV", "").strip())
-        snr = float(table_row.find_all('td')[6].text.replace(" dB", "").strip())
-        corrected = int(table_row.find_all('td')[7].text.strip())
-        uncorrectables = int(table_row.find_all('td')[8].text.strip())
-
-        stats['downstream'].append({
-            'channel_id': channel_id,
-            'frequency': frequency,
-            'power': power,
-            'snr': snr,
-            'corrected': corrected,
-            'uncorrectables': uncorrectables
-        })
+        frequency = int(cells[4].replace(" Hz", "").strip())
+        power = float(cells[5].replace(" dBmV", "").strip())
+        snr = float(cells[6].replace(" dB", "").strip())
+        corrected = int(cells[7])
+        uncorrectables = int(cells[8])
+
+        stats['downstream'].append(DownstreamChannel(
+            channel_id=int(channel_id),
+            frequency=frequency,
+            power=power,
+            snr=snr,
+            corrected=corrected,
+            uncorrectables=uncorrectables
+        ))
 
     logging.debug('downstream stats: %s', stats['downstream'])
     if len(stats['downstream']) == 0:
         logging.error('Failed to get any downstream stats! Probably a parsing issue in parse_html_sb8200()')
 
     # upstream table
-    for table_row in soup.find_all("table")[3].find_all("tr"):
-        if table_row.th:
+    for has_th, cells in tables[3]:
+        if has_th:
             continue
 
         '''
@@ -84,21 +85,21 @@ def parse_html_sb6183(html):
            </tr>
         '''
 
-        # Some firmwares have a header row not already skiped by "if table_row.th", skip it if channel_id isn't an integer
-        channel_id = table_row.find_all('td')[0].text.strip()
+        # Some firmwares have a header row not already skiped by "if has_th", skip it if channel_id isn't an integer
+        channel_id = cells[0]
         if not channel_id.isdigit():
             continue
 
-        symbol_rate = int(table_row.find_all('td')[4].text.replace(" Ksym/sec", "").strip())
-        frequency = int(table_row.find_all('td')[5].text.replace(" Hz", "").strip())
-        power = float(table_row.find_all('td')[6].text.replace(" dBmV", "").strip())
+        symbol_rate = int(cells[4].replace(" Ksym/sec", "").strip())
+        frequency = int(cells[5].replace(" Hz", "").strip())
+        power = float(cells[6].replace(" dBmV", "").strip())
 
-        stats['upstream'].append({
-            'channel_id': channel_id,
-            'symbol_rate': symbol_rate,
-            'frequency': frequency,
-            'power': power,
-        })
+        stats['upstream'].append(UpstreamChannel(
+            channel_id=int(channel_id),
+            symbol_rate=symbol_rate,
+            frequency=frequency,
+            power=power
+        ))
 
     logging.debug('upstream stats: %s', stats['upstream'])
     if len(stats['upstream']) == 0:
@@ -4,10 +4,11 @@
 """
 # pylint: disable=line-too-long
 import logging
-from bs4 import BeautifulSoup
+import arris_stats_html
+from arris_stats_records import DownstreamChannel, UpstreamChannel
 
 
-def parse_html_sb8200(html):
+def parse_html_sb8200(html, backend='beautifulsoup'):
     """ Parse the HTML into the modem stats dict """
     logging.info('Parsing HTML for modem model sb8200')
 
@@ -18,35 +19,35 @@ def parse_html_sb8200(html):
     # After: <tr><th colspan=7><strong>Upstream Bonded Channels</strong></th>
     html = html.replace('Bonded Channels</strong></th></tr>', 'Bonded Channels</strong></th>', 2)
 
-    soup = BeautifulSoup(html, 'html.parser')
+    tables = arris_stats_html.get_tables(html, backend)
     stats = {}
 
     # downstream table
     stats['downstream'] = []
-    for table_row in soup.find_all("table")[1].find_all("tr"):
-        if table_row.th:
+    for has_th, cells in tables[1]:
+        if has_th:
             continue
 
-        channel_id = table_row.find_all('td')[0].text.strip()
+        channel_id = cells[0]
 
-        # Some firmwares have a header row not already skiped by "if table_row.th", skip it if channel_id isn't an integer
+        # Some firmwares have a header row not already skiped by "if has_th", skip it if channel_id isn't an integer
         if not channel_id.isdigit():
             continue
 
-        frequency = table_row.find_all('td')[3].text.replace(" Hz", "").strip()
-        power = table_row.find_all('td')[4].text.replace(" dBmV", "").strip()
-        snr = table_row.find_all('td')[5].text.replace(" dB", "").strip()
-        corrected = table_row.find_all('td')[6].text.strip()
-        uncorrectables = table_row.find_all('td')[7].text.strip()
-
-        stats['downstream'].append({
-            'channel_id': channel_id,
-            'frequency': frequency,
-            'power': power,
-            'snr': snr,
-            'corrected': corrected,
-            'uncorrectables': uncorrectables
-        })
+        frequency = int(cells[3].replace(" Hz", "").strip())
+        power = float(cells[4].replace(" dBmV", "").strip())
+        snr = float(cells[5].replace(" dB", "").strip())
+        corrected = int(cells[6])
+        uncorrectables = int(cells[7])
+
+        stats['downstream'].append(DownstreamChannel(
+            channel_id=int(channel_id),
+            frequency=frequency,
+            power=power,
+            snr=snr,
+            corrected=corrected,
+            uncorrectables=uncorrectables
+        ))
 
     logging.debug('downstream stats: %s', stats['downstream'])
     if not stats['downstream']:
@@ -54,24 +55,24 @@ def parse_html_sb8200(html):
 
     # upstream table
     stats['upstream'] = []
-    for table_row in soup.find_all("table")[2].find_all("tr"):
-        if table_row.th:
+    for has_th, cells in tables[2]:
+        if has_th:
             continue
 
-        channel_id = table_row.find_all('td')[1].text.strip()
+        channel_id = cells[1]
 
-        # Some firmwares have a header row not already skiped by "if table_row.th", skip it if channel_id isn't an integer
+        # Some firmwares have a header row not already skiped by "if has_th", skip it if channel_id isn't an integer
         if not channel_id.isdigit():
             continue
 
-        frequency = table_row.find_all('td')[4].text.replace(" Hz", "").strip()
-        power = table_row.find_all('td')[6].text.replace(" dBmV", "").strip()
+        frequency = int(cells[4].replace(" Hz", "").strip())
+        power = float(cells[6].replace(" dBmV", "").strip())
 
-        stats['upstream'].append({
-            'channel_id': channel_id,
-            'frequency': frequency,
-            'power': power,
-        })
+        stats['upstream'].append(UpstreamChannel(
+            channel_id=int(channel_id),
+            frequency=frequency,
+            power=power
+        ))
 
     logging.debug('upstream stats: %s', stats['upstream'])
     if not stats['upstream']:
@@ -0,0 +1,88 @@
+"""
+    Fixed rate polling scheduler
+
+    https://github.com/andrewfraley/arris_cable_modem_stats
+
+    Polls fire on wall clock ticks, every multiple of sleep_interval since the epoch, so a
+    slow fetch or send doesn't push every later poll back and every modem polled at the
+    same interval gets the same timestamps.  The wait itself is timed on the monotonic
+    clock so clock adjustments during a sleep don't stretch or shorten it.  With
+    adaptive_polling the interval changes between polls, see set_interval().
+"""
+# pylint: disable=line-too-long
+
+import math
+import time
+import random
+import logging
+
+
+class Scheduler:
+    """ Works out when the next poll is due.  The first poll is due straight away """
+
+    def __init__(self, interval, jitter=0):
+        self.interval = interval
+
+        # A fixed random delay after each tick, so a fleet of modems doesn't hit the network all at
+        # once.  It's fixed rather than per tick so the polls stay exactly interval apart.
+        self.offset = random.uniform(0, min(jitter, interval)) if jitter else 0
+
+        # Ticks are counted rather than added up so float error can't build into drift
+        self.next_index = None
+        self.last_tick = None
+        self.missed_ticks = 0
+
+    def set_interval(self, interval):
+        """ Poll every interval seconds from now on, for adaptive_polling.  The next poll is the
+            first tick of the new interval after the last poll, so timestamps stay on the wall clock grid
+        """
+        if interval == self.interval:
+            return
+        # Keep the jitter the same fraction of the interval so it never reaches the next tick
+        self.offset = self.offset * interval / self.interval
+        self.interval = interval
+        if self.last_tick is not None:
+            self.next_index = math.floor(self.last_tick / interval) + 1
+
+    def wait(self):
+        """ Sleep until the next poll is due, return its timestamp in ns """
+        tick, delay = self.advance(time.time())
+        if delay > 0:
+            logging.info('Sleeping for %.3f seconds', delay)
+            deadline = time.monotonic() + delay
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                time.sleep(remaining)
+        return int(tick * 1000000000)
+
+    async def wait_async(self):
+        """ The same as wait() for asyncio, the event loop's clock is monotonic """
+        import asyncio  # pylint: disable=import-outside-toplevel
+        tick, delay = self.advance(time.time())
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return int(tick * 1000000000)
+
+    def advance(self, now):
+        """ Move on to the next tick after now, returns (tick, seconds to wait).
+            tick is the wall clock time of the tick without the jitter offset, used as the
+            poll's timestamp.  Ticks that already passed while the last poll was running are skipped.
+        """
+        if self.next_index is None:
+            self.next_index = math.floor(now / self.interval) + 1
+            self.last_tick = now
+            return now, 0
+
+        index = self.next_index
+        if index * self.interval + self.offset < now:
+            missed = math.floor((now - self.offset) / self.interval) - index + 1
+            self.missed_ticks += missed
+            logging.warning('Polling is behind, skipping %s missed tick(s).  Fetch, parse and send took longer than sleep_interval (%ss)', missed, self.interval)
+            index += missed
+
+        self.next_index = index + 1
+        tick = index * self.interval
+        self.last_tick = tick
+        return tick, tick + self.offset - now
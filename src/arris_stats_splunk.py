@@ -1,4 +1,3 @@
-
 """
     Splunk functions
 
@@ -6,39 +5,110 @@
 """
 # pylint: disable=line-too-long
 
+import time
+import json
+import socket
 import logging
-from splunk_hec_handler import SplunkHecHandler
+import threading
+import requests
+
+# Seconds to wait on the HTTP Event Collector before giving up
+SPLUNK_TIMEOUT = 60
+
+# Sessions live for the whole process so the HEC connection is kept alive between polls.
+# Keyed by connection settings for fleet mode.
+splunk_sessions = {}
+splunk_sessions_lock = threading.Lock()
+
+
+def get_splunk_session(config):
+    """ Return the long lived requests session for this config, creating it on first use """
+    key = (config['splunk_host'], config['splunk_port'], config['splunk_ssl'], config['splunk_verify_ssl'], config['splunk_token'])
+    with splunk_sessions_lock:
+        if key not in splunk_sessions:
+            session = requests.Session()
+            session.verify = config['splunk_verify_ssl']
+            session.headers['Authorization'] = 'Splunk ' + config['splunk_token']
+            splunk_sessions[key] = session
+        return splunk_sessions[key]
+
+
+def close_splunk_sessions():
+    """ Close every session, called from arris_stats.close_destinations() at exit """
+    with splunk_sessions_lock:
+        for session in splunk_sessions.values():
+            session.close()
+        splunk_sessions.clear()
 
 
 def send_to_splunk(stats, config):
-    """ Send the stats to splunk """
+    """ Send the stats to splunk, one event per channel """
+    return send_batch_to_splunk([stats], config)
 
-    # Using this splunk log handler this way is a little odd, but the simplest and most
-    # robust method I've seen for getting some random object data into splunk via the HTTP Event Collector
-    # https://pypi.org/project/splunk-hec-handler/
+
+def send_batch_to_splunk(stats_list, config):
+    """ Send the stats from several polls to splunk, each with its own timestamp.
+        Returns True if every event was accepted
+    """
+    logging.info('Sending stats to Splunk (%s:%s)', config['splunk_host'], config['splunk_port'])
 
     if config['splunk_ssl']:
         protocol = 'https'
     else:
         protocol = 'http'
+    url = '%s://%s:%s/services/collector/event' % (protocol, config['splunk_host'], config['splunk_port'])
+
+    events = []
+    for stats in stats_list:
+        events.extend(get_events(stats, config, (stats.get('timestamp_ns') or time.time_ns()) / 1000000000))
+    if not events:
+        # HEC answers an empty request with 400 No data
+        return True
+
+    # HEC takes any number of events in one request as concatenated JSON objects.  Everything goes
+    # in one request so a failed send has posted nothing, and retrying it can't index anything twice
+    session = get_splunk_session(config)
+    try:
+        resp = session.post(url, data=''.join(json.dumps(event) for event in events), timeout=SPLUNK_TIMEOUT)
+        if resp.status_code != 200:
+            logging.error('Error sending events to Splunk at %s', url)
+            logging.error('Status code: %s', resp.status_code)
+            logging.error('Response: %s', resp.text)
+            return False
+    except requests.exceptions.RequestException as exception:
+        logging.error(exception)
+        logging.error('Failed To Write To Splunk')
+        return False
+
+    logging.info('Successfully wrote %s events to Splunk', len(events))
+    logging.debug('Events sent to Splunk:')
+    logging.debug(events)
+    return True
+
+
+def get_events(stats, config, timestamp):
+    """ Build a HEC event for every downstream and upstream channel, and the channel summaries, collector statistics, modem events and probes if there are any """
+    host = socket.gethostname()
+    records = stats['downstream'] + stats['upstream']
+    records.extend(stats.get('downstream_summary') or [])
+    records.extend(stats.get('upstream_summary') or [])
+    if stats.get('collector'):
+        records.append(stats['collector'])
+    records.extend(stats.get('events') or [])
+    records.extend(stats.get('probes') or [])
 
-    logger = logging.getLogger('SplunkHecHandlerExample')
-    logger.setLevel(logging.DEBUG)
-
-    # If using self-signed certificate, set ssl_verify to False
-    # If using http, set proto to http
-    splunk_handler = SplunkHecHandler(
-        config['splunk_host'],
-        config['splunk_token'],
-        port=config['splunk_port'],
-        proto=protocol,
-        ssl_verify=config['splunk_verify_ssl'],
-        source=config['splunk_source'],
-        sourcetype='_json'
-    )
-
-    logger.addHandler(splunk_handler)
-    logger.info(stats)
-    logging.info('Successfully wrote data to Splunk')
-    logging.debug('Stats sent to Splunk:')
-    logging.debug(stats)
+    events = []
+    for record in records:
+        event = {'measurement': record.measurement}
+        if config['modem_id']:
+            event['modem_id'] = config['modem_id']
+        event.update(record.to_dict())
+        events.append({
+            # Summaries have the timestamp of their window
+            'time': record.timestamp_ns / 1000000000 if getattr(record, 'timestamp_ns', None) else timestamp,
+            'host': host,
+            'source': config['splunk_source'],
+            'sourcetype': '_json',
+            'event': event
+        })
+    return events
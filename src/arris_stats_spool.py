@@ -0,0 +1,274 @@
+"""
+    Write-ahead spool so stats survive destination outages
+
+    https://github.com/andrewfraley/arris_cable_modem_stats
+
+    Every poll's stats are appended to a segment file in spool_dir before they're sent, and
+    acknowledged once the destination has them.  Anything left unacknowledged, because the
+    destination was down or we were killed mid-send, is replayed in bulk from a background
+    thread so the polling loop never waits on it.  Once the spool is bigger than
+    spool_max_bytes the oldest segments are deleted, acknowledged or not.
+"""
+# pylint: disable=line-too-long
+
+import os
+import json
+import time
+import logging
+import threading
+import arris_stats_records
+
+SEGMENT_SUFFIX = '.spool'
+ACK_SUFFIX = '.ack'
+
+# Largest segment file before rolling over to a new one
+MAX_SEGMENT_BYTES = 4194304
+
+# One spool per modem and destination, keyed by (spool_dir, modem_id, destination)
+spools = {}
+spools_lock = threading.Lock()
+replay_thread = None
+
+
+def get_spool(config, send_batch_function):
+    """ Return the spool for this modem and destination, creating it (and the replay thread) on first use.
+        send_batch_function(stats_list, config) must return True once the destination has the stats
+    """
+    global replay_thread  # pylint: disable=global-statement
+
+    key = (config['spool_dir'], config['modem_id'], config['destination'])
+    with spools_lock:
+        if key not in spools:
+            directory = os.path.join(config['spool_dir'], config['modem_id'] or 'default', config['destination'])
+            spools[key] = Spool(directory, config, send_batch_function)
+
+        if not replay_thread:
+            replay_thread = threading.Thread(target=replay_forever, args=(config['spool_replay_interval'],), name='spool-replay', daemon=True)
+            replay_thread.start()
+
+        return spools[key]
+
+
+def close_spools():
+    """ Close every spool's segment file, called from arris_stats.close_destinations() at exit """
+    with spools_lock:
+        for spool in spools.values():
+            spool.close()
+
+
+def replay_forever(interval):
+    """ Replay the backlog of every spool every interval seconds """
+    while True:
+        time.sleep(interval)
+        replay_spools()
+
+
+def replay_spools():
+    """ Replay the backlog of every spool once """
+    with spools_lock:
+        all_spools = list(spools.values())
+    for spool in all_spools:
+        try:
+            spool.replay()
+        except Exception as exception:  # pylint: disable=broad-except
+            logging.error('Error replaying spool %s', spool.directory)
+            logging.error(exception)
+
+
+class Spool:
+    """ An append-only log of segment files, each with a companion file of acknowledged record ids """
+
+    def __init__(self, directory, config, send_batch_function):
+        self.directory = directory
+        self.config = config
+        self.send_batch_function = send_batch_function
+        self.max_bytes = config['spool_max_bytes']
+        self.segment_bytes = max(1, min(MAX_SEGMENT_BYTES, self.max_bytes // 8))
+        self.lock = threading.Lock()
+
+        # Record ids being sent by send() right now, replay leaves these alone
+        self.in_flight = set()
+
+        # Segment path -> {'records': record count, 'acked': set of acked record ids, 'bytes': size}, oldest first
+        self.segments = {}
+        self.segment = None
+        self.segment_file = None
+        # Size of every segment, kept up to date so append() doesn't have to stat them all
+        self.total_bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.next_id = self._recover()
+
+    def send(self, stats):
+        """ Spool the stats, send them, and acknowledge them if that worked """
+        return self.send_all([stats])
+
+    def send_all(self, stats_list):
+        """ Spool every poll's stats before sending any of them, then send them together and acknowledge
+            them if that worked.  A send that fails, or raises, leaves them all for the replay
+        """
+        entries = [self.append(stats) for stats in stats_list]
+        sent = False
+        try:
+            sent = self.send_batch_function(stats_list, self.config)
+        except Exception as exception:  # pylint: disable=broad-except
+            logging.error('Error sending to %s', self.config['destination'])
+            logging.error(exception)
+        finally:
+            with self.lock:
+                self.in_flight.difference_update(record_id for _, record_id in entries)
+
+        if sent:
+            self.ack(entries)
+        else:
+            logging.warning('Spooled stats in %s, they will be replayed once %s is reachable', self.directory, self.config['destination'])
+        return sent
+
+    def append(self, stats):
+        """ Write the stats to the current segment, returns (segment, record id) """
+        stats_dict = arris_stats_records.stats_to_dict(stats)
+        with self.lock:
+            if not self.segment_file or self.segment_file.tell() >= self.segment_bytes:
+                self._roll_segment()
+
+            record_id = self.next_id
+            self.next_id += 1
+            # json.dumps() escapes anything that isn't ascii, so characters are bytes
+            line = json.dumps({'id': record_id, 'stats': stats_dict}) + '\n'
+            self.segment_file.write(line)
+            self.segment_file.flush()
+            self.segments[self.segment]['records'] += 1
+            self.segments[self.segment]['bytes'] += len(line)
+            self.total_bytes += len(line)
+            self.in_flight.add(record_id)
+            entry = (self.segment, record_id)
+
+            self._evict()
+        return entry
+
+    def ack(self, entries):
+        """ Mark (segment, record id) entries as delivered, deleting segments once all their records are """
+        with self.lock:
+            by_segment = {}
+            for segment, record_id in entries:
+                by_segment.setdefault(segment, []).append(record_id)
+
+            for segment, record_ids in by_segment.items():
+                if segment not in self.segments:
+                    continue  # Evicted while we were sending
+                with open(segment + ACK_SUFFIX, 'a') as ack_file:
+                    ack_file.write(''.join('%s\n' % record_id for record_id in record_ids))
+                self.segments[segment]['acked'].update(record_ids)
+
+                if segment != self.segment and len(self.segments[segment]['acked']) >= self.segments[segment]['records']:
+                    self._delete_segment(segment)
+
+    def close(self):
+        """ Close the current segment, the next append() starts a new one """
+        with self.lock:
+            if self.segment_file:
+                self.segment_file.close()
+                self.segment_file = None
+
+    def replay(self):
+        """ Send the unacknowledged backlog to the destination in bulk, oldest first,
+            until it's empty or a send fails
+        """
+        while True:
+            entries, stats_list = self._unacked(self.config['spool_replay_batch'])
+            if not entries:
+                return
+
+            logging.info('Replaying %s spooled polls from %s', len(entries), self.directory)
+            if not self.send_batch_function(stats_list, self.config):
+                logging.warning('Replay of %s failed, will try again later', self.directory)
+                return
+            self.ack(entries)
+
+    def _unacked(self, limit):
+        """ Return up to limit unacknowledged (segment, record id) entries and their stats """
+        with self.lock:
+            segments = [(segment, set(info['acked'])) for segment, info in self.segments.items()]
+            in_flight = set(self.in_flight)
+
+        entries = []
+        stats_list = []
+        for segment, acked in segments:
+            try:
+                records = list(read_segment(segment))
+            except FileNotFoundError:
+                continue  # Evicted since we looked
+            for record in records:
+                if record['id'] in acked or record['id'] in in_flight:
+                    continue
+                entries.append((segment, record['id']))
+                stats_list.append(arris_stats_records.stats_from_dict(record['stats']))
+                if len(entries) >= limit:
+                    return entries, stats_list
+        return entries, stats_list
+
+    def _roll_segment(self):
+        """ Close the current segment and start a new one named after its first record id """
+        if self.segment_file:
+            self.segment_file.close()
+        # close() may have closed it already
+        previous = self.segments.get(self.segment)
+        if previous and len(previous['acked']) >= previous['records']:
+            self._delete_segment(self.segment)
+
+        self.segment = os.path.join(self.directory, '%020d%s' % (self.next_id, SEGMENT_SUFFIX))
+        self.segment_file = open(self.segment, 'a')  # pylint: disable=consider-using-with
+        self.segments[self.segment] = {'records': 0, 'acked': set(), 'bytes': 0}
+
+    def _evict(self):
+        """ Delete the oldest segments until we're back under max_bytes """
+        for segment in list(self.segments):
+            if self.total_bytes <= self.max_bytes or segment == self.segment:
+                break
+            lost = self.segments[segment]['records'] - len(self.segments[segment]['acked'])
+            logging.warning('Spool %s is over spool_max_bytes, dropping %s unsent polls from %s', self.directory, lost, segment)
+            self._delete_segment(segment)
+
+    def _delete_segment(self, segment):
+        """ Remove a segment and its acks """
+        for path in [segment, segment + ACK_SUFFIX]:
+            if os.path.exists(path):
+                os.remove(path)
+        self.total_bytes -= self.segments.pop(segment)['bytes']
+
+    def _recover(self):
+        """ Load the segments left by a previous run, returns the next record id to use """
+        next_id = 0
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            segment = os.path.join(self.directory, name)
+            records = list(read_segment(segment))
+            acked = set()
+            if os.path.exists(segment + ACK_SUFFIX):
+                with open(segment + ACK_SUFFIX) as ack_file:
+                    acked = {int(line) for line in ack_file if line.strip()}
+
+            self.segments[segment] = {'records': len(records), 'acked': acked, 'bytes': os.path.getsize(segment)}
+            self.total_bytes += self.segments[segment]['bytes']
+            if records:
+                next_id = max(next_id, records[-1]['id'] + 1)
+            if len(acked) >= len(records):
+                self._delete_segment(segment)
+
+        if self.segments:
+            logging.info('Found %s spooled polls in %s to replay', sum(info['records'] - len(info['acked']) for info in self.segments.values()), self.directory)
+        return next_id
+
+
+def read_segment(segment):
+    """ Yield every complete record in a segment file """
+    with open(segment) as segment_file:
+        for line in segment_file:
+            # The last line is incomplete if it's being written right now, or if we were killed mid-write
+            if not line.endswith('\n'):
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logging.warning('Skipping damaged record in %s', segment)
@@ -4,12 +4,17 @@
 """
 # pylint: disable=line-too-long
 import logging
-from bs4 import BeautifulSoup
+import arris_stats_html
+import arris_stats_retry
+from arris_stats_records import DownstreamChannel, UpstreamChannel
 
 
 def follow_redirect(session, config):
+    # Only needed to log in, so don't pay for importing bs4 on every start
+    from bs4 import BeautifulSoup  # pylint: disable=import-outside-toplevel
+
     def _follow_redirect(_url):
-        res = session.get(_url, verify=config['modem_verify_ssl'])
+        res = arris_stats_retry.modem_request(config, session, 'GET', _url, verify=config['modem_verify_ssl'])
         res.raise_for_status()
         soup = BeautifulSoup(res.content, 'html.parser')
         result = soup.find("meta", attrs={"http-equiv": "refresh"})
@@ -28,51 +33,54 @@ def get_token_t25(config, session):
     # a few hops to get to the login page :)
     login_url = follow_redirect(session, config)
     logging.info(f'Login page url: {login_url}')
-    login_page = session.post(login_url, verify=config['modem_verify_ssl'],
-                              data={'username': config['modem_username'],
-                                    'password': config['modem_password']})
+    # Never retried, a retry is another login
+    login_page = arris_stats_retry.modem_request(config, session, 'POST', login_url, retries=0, verify=config['modem_verify_ssl'],
+                                                 data={'username': config['modem_username'],
+                                                       'password': config['modem_password']})
     login_page.raise_for_status()
     # Dummy return the token as we don't have a token for url auth (Within session)
     return "token_in_session"
 
 
-def parse_html_t25(html):
+def parse_html_t25(html, backend='beautifulsoup'):
     """ Parse the HTML into the modem stats dict """
     logging.info('Parsing HTML for modem model t25')
 
-    soup = BeautifulSoup(html, 'html.parser')
+    tables = arris_stats_html.get_tables(html, backend)
     stats = {"downstream": [],
              "upstream": []
              }
 
-    for table_row in soup.find_all("table")[0].find_all("tr"):
-        if "power" in str(table_row).lower():
+    for has_th, cells in tables[0]:
+        # Skip the header row
+        if any("power" in cell.lower() for cell in cells):
             continue
 
-        if table_row.th:
+        if has_th:
             continue
 
         # Replace/remove "Downstream" to normalize with other models
-        channel_id = table_row.find_all('td')[0].text.replace("Downstream", "").strip()
+        channel_id = cells[0].replace("Downstream", "").strip()
 
         if not channel_id.isdigit():
             continue
 
         # Other models supply HZ not MHZ * 1000000 to have the same stuctures as the other ones
-        frequency = str(float(table_row.find_all('td')[2].text.replace(" MHz", "").strip()) * 1000000)
-        power = table_row.find_all('td')[3].text.replace(" dBmV", "").strip()
-        snr = table_row.find_all('td')[4].text.replace(" dB", "").strip()
-        corrected = table_row.find_all('td')[7].text.strip()
-        uncorrectables = table_row.find_all('td')[8].text.strip()
-
-        stats['downstream'].append({
-            'channel_id': channel_id,
-            'frequency': frequency,
-            'power': power,
-            'snr': snr,
-            'corrected': corrected,
-            'uncorrectables': uncorrectables
-        })
+        # Kept a float as it always was, InfluxDB rejects a field that changes type
+        frequency = float(cells[2].replace(" MHz", "").strip()) * 1000000
+        power = float(cells[3].replace(" dBmV", "").strip())
+        snr = float(cells[4].replace(" dB", "").strip())
+        corrected = int(cells[7])
+        uncorrectables = int(cells[8])
+
+        stats['downstream'].append(DownstreamChannel(
+            channel_id=int(channel_id),
+            frequency=frequency,
+            power=power,
+            snr=snr,
+            corrected=corrected,
+            uncorrectables=uncorrectables
+        ))
 
     logging.debug('downstream stats: %s', stats['downstream'])
     if not stats['downstream']:
@@ -81,25 +89,26 @@ def parse_html_t25(html):
             __file__)
 
     # upstream table
-    for table_row in soup.find_all("table")[4].find_all("tr"):
-        if table_row.th:
+    for has_th, cells in tables[4]:
+        if has_th:
             continue
 
         # Replace/remove "Upstream" to normalize with other models
-        channel_id = table_row.find_all('td')[0].text.replace("Upstream", "").strip()
+        channel_id = cells[0].replace("Upstream", "").strip()
         if not channel_id.isdigit():
             continue
 
-        symbol_rate = table_row.find_all('td')[5].text.replace(" kSym/s", "").strip()
-        frequency = table_row.find_all('td')[2].text.replace(" MHz", "").strip()
-        power = table_row.find_all('td')[3].text.replace(" dBmV", "").strip()
-
-        stats['upstream'].append({
-            'channel_id': channel_id,
-            'symbol_rate': symbol_rate,
-            'frequency': frequency,
-            'power': power,
-        })
+        symbol_rate = int(cells[5].replace(" kSym/s", "").strip())
+        # Upstream has always been sent in MHz, left that way so existing data stays comparable
+        frequency = float(cells[2].replace(" MHz", "").strip())
+        power = float(cells[3].replace(" dBmV", "").strip())
+
+        stats['upstream'].append(UpstreamChannel(
+            channel_id=int(channel_id),
+            symbol_rate=symbol_rate,
+            frequency=frequency,
+            power=power
+        ))
 
     logging.debug('upstream stats: %s', stats['upstream'])
     if len(stats['upstream']) == 0:
@@ -0,0 +1,164 @@
+"""
+    Parser micro-benchmarks
+
+    Replays every tests/mockups/<model>.html through parse_html_<model> with every
+    parser backend, reports throughput, latency and peak allocations, and compares
+    the results against tests/benchmark_baseline.json.
+
+    Throughput and latency depend on the machine, so the baseline holds them relative to
+    a fixed calibration workload timed in the same run: pages per calibration run and
+    latency in calibration runs.  A baseline recorded on one host then holds on another.
+    Peak allocations don't depend on the machine and are kept as they are.
+
+    Run from the repo root with:
+    bash tests/run_benchmarks.sh
+"""
+# pylint: disable=line-too-long
+
+import sys
+import json
+import time
+import logging
+import argparse
+import tracemalloc
+import arris_stats
+import arris_stats_html
+
+BASELINE_PATH = 'tests/benchmark_baseline.json'
+
+# Results kept relative to the calibration run -> (raw result, scale by calibration seconds / ms)
+RELATIVE_RESULTS = {
+    'pages_per_calibration': ('pages_per_second', 'seconds'),
+    'p50_calibrations': ('p50_ms', 'ms'),
+    'p99_calibrations': ('p99_ms', 'ms')
+}
+
+
+def main():
+    """ MAIN """
+    args = get_args()
+
+    # The parsers log every page at info, we only want to time the parsing
+    logging.disable(logging.CRITICAL)
+
+    results = {}
+    for modem in arris_stats.modems_supported:
+        with open('tests/mockups/%s.html' % modem) as f:
+            html = f.read()
+
+        module = __import__('arris_stats_' + modem)
+        parse_html_function = getattr(module, 'parse_html_' + modem)
+
+        for backend in arris_stats_html.parser_backends_supported:
+            name = '%s/%s' % (modem, backend)
+            # Calibrate around each case so the host speeding up or slowing down mid run cancels out
+            before_ms = calibrate()
+            result = benchmark(parse_html_function, html, backend, args.iterations)
+            calibration_ms = (before_ms + calibrate()) / 2
+            print_result(name, result, calibration_ms)
+            results[name] = get_relative(result, calibration_ms)
+
+    if args.update_baseline:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+            f.write('\n')
+        print('Baseline written to %s' % BASELINE_PATH)
+        return
+
+    with open(BASELINE_PATH) as f:
+        baseline = json.load(f)
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print('REGRESSION: %s' % regression)
+    if regressions:
+        sys.exit(1)
+    print('No regressions against %s (tolerance %s%%)' % (BASELINE_PATH, args.tolerance))
+
+
+def get_args():
+    """ Get argparser args """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', help='Pages to parse per model and backend', type=int, default=2000)
+    parser.add_argument('--tolerance', help='Percent slower / bigger than baseline before failing', type=float, default=25)
+    parser.add_argument('--update-baseline', help='Write the results as the new baseline', action='store_true', default=False)
+    return parser.parse_args()
+
+
+def calibrate():
+    """ Return the milliseconds this machine takes for a fixed mix of pure Python and C work, the median of a few runs """
+    timings = []
+    for _ in range(5):
+        start = time.perf_counter()
+        text = json.dumps([{'channel_id': index, 'power': index / 10, 'snr': str(index)} for index in range(20000)])
+        sum(len(row['snr']) for row in json.loads(text))
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2] * 1000
+
+
+def get_relative(result, calibration_ms):
+    """ Return the result with throughput and latency relative to the calibration run """
+    relative = {'peak_kib': result['peak_kib']}
+    for name, (raw, unit) in RELATIVE_RESULTS.items():
+        if unit == 'seconds':
+            relative[name] = round(result[raw] * calibration_ms / 1000, 3)
+        else:
+            relative[name] = round(result[raw] / calibration_ms, 4)
+    return relative
+
+
+def benchmark(parse_html_function, html, backend, iterations):
+    """ Parse html iterations times, return pages/s, p50/p99 latency in ms and peak allocations in KiB """
+
+    # Warm up so imports and caches don't land in the first sample
+    parse_html_function(html, backend)
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        parse_html_function(html, backend)
+        latencies.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    # tracemalloc slows everything down, so measure allocations on a separate run
+    tracemalloc.start()
+    parse_html_function(html, backend)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'pages_per_second': round(iterations / elapsed, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+        'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 3),
+        'peak_kib': round(peak / 1024, 1)
+    }
+
+
+def compare(results, baseline, tolerance):
+    """ Return a list of human readable regressions against the baseline, both relative to their calibration runs """
+    regressions = []
+    factor = 1 + tolerance / 100
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if result['pages_per_calibration'] * factor < base['pages_per_calibration']:
+            regressions.append('%s throughput %s pages per calibration run, baseline %s' % (name, result['pages_per_calibration'], base['pages_per_calibration']))
+        # p99 is mostly scheduler noise on a shared host, it is reported but only p50 is compared
+        if result['p50_calibrations'] > base['p50_calibrations'] * factor:
+            regressions.append('%s p50 %s calibration runs, baseline %s' % (name, result['p50_calibrations'], base['p50_calibrations']))
+        if result['peak_kib'] > base['peak_kib'] * factor:
+            regressions.append('%s peak allocations %sKiB, baseline %sKiB' % (name, result['peak_kib'], base['peak_kib']))
+    return regressions
+
+
+def print_result(name, result, calibration_ms):
+    """ Print one result line """
+    print('%-22s %10.1f pages/s   p50 %8.3fms   p99 %8.3fms   peak %8.1fKiB   calibration %7.3fms' % (
+        name, result['pages_per_second'], result['p50_ms'], result['p99_ms'], result['peak_kib'], calibration_ms))
+
+
+if __name__ == '__main__':
+    main()
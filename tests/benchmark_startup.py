@@ -0,0 +1,112 @@
+"""
+    Cold start benchmark for --once
+
+    Serves tests/mockups over http, runs arris_stats.py --once against each model a few
+    times with destination = stdout_json, and fails if the median run takes longer than
+    the budget.  Also fails if a run imports modules its model, parser backend and
+    destination don't need, since that's where most of the start up time goes.
+
+    Run from the repo root with:
+    bash tests/run_startup_benchmark.sh
+"""
+# pylint: disable=line-too-long
+
+import os
+import sys
+import time
+import argparse
+import threading
+import subprocess
+import functools
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+# Modules only some destinations or parser backends need, none of them should be imported by a stdout_json run
+HEAVY_MODULES = ['boto3', 'botocore', 'influxdb', 'influxdb_client', 'asyncio', 'concurrent.futures']
+
+# Only the beautifulsoup backend and the T25 login need bs4
+BS4_MODULES = ['bs4']
+
+
+def main():
+    """ MAIN """
+    args = get_args()
+
+    handler = functools.partial(QuietHandler, directory='tests/mockups')
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    failures = []
+    for modem in ['sb8200', 'sb6183', 't25']:
+        env = {
+            'PATH': os.environ.get('PATH', ''),
+            'destination': 'stdout_json',
+            'log_level': 'error',
+            'modem_model': modem,
+            'modem_url': 'http://127.0.0.1:%s/%s.html' % (server.server_port, modem),
+            'parser_backend': 'lxml'
+        }
+
+        times = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            result = subprocess.run([sys.executable, 'src/arris_stats.py', '--once'], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=False)
+            times.append(time.perf_counter() - start)
+            if result.returncode != 0:
+                failures.append('%s --once exited with %s: %s' % (modem, result.returncode, result.stderr.decode().strip()))
+                break
+        times.sort()
+        median_ms = times[len(times) // 2] * 1000
+
+        imported = get_imports(env)
+        unexpected = [module for module in HEAVY_MODULES + BS4_MODULES if module in imported]
+        print('%-8s median %7.1fms   max %7.1fms   heaviest imports: %s' % (
+            modem, median_ms, times[-1] * 1000, ', '.join('%s %.0fms' % (name, ms) for name, ms in imported_by_time(imported)[:3])))
+
+        if median_ms > args.budget_ms:
+            failures.append('%s median start up %.1fms, budget %sms' % (modem, median_ms, args.budget_ms))
+        if unexpected:
+            failures.append('%s imported modules it doesn\'t need: %s' % (modem, ', '.join(unexpected)))
+
+    server.shutdown()
+    for failure in failures:
+        print('FAILED: %s' % failure)
+    if failures:
+        sys.exit(1)
+    print('All models start, poll and exit within %sms' % args.budget_ms)
+
+
+def get_args():
+    """ Get argparser args """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', help='Runs per model, the median is compared to the budget', type=int, default=5)
+    parser.add_argument('--budget-ms', help='Max median milliseconds for one --once run', type=float, default=1000)
+    return parser.parse_args()
+
+
+def get_imports(env):
+    """ Run --once with -X importtime, return {top level module: cumulative ms} """
+    result = subprocess.run([sys.executable, '-X', 'importtime', 'src/arris_stats.py', '--once'], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=False)
+    imported = {}
+    for line in result.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len('import time:'):].split('|')]
+        imported[name] = int(cumulative) / 1000
+    return imported
+
+
+def imported_by_time(imported):
+    """ Return (module, ms) for top level packages, slowest first """
+    packages = [(name, ms) for name, ms in imported.items() if '.' not in name and not name.startswith('_')]
+    return sorted(packages, key=lambda item: item[1], reverse=True)
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """ Serves the mockups without logging every request """
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+if __name__ == '__main__':
+    main()
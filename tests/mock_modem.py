@@ -0,0 +1,321 @@
+"""
+    Stand-in modem web server for load and soak tests
+
+    Serves tests/mockups as any number of virtual modems, each under its own path prefix
+    (http://host:port/modem/<n>/...), so a fleet of thousands of modems can be polled from
+    one server.  Modem n is models[n % len(models)], at the url the real model uses:
+
+        sb8200  /modem/<n>/cmconnectionstatus.html
+        sb6183  /modem/<n>/RgConnect.asp
+        t25     /modem/<n>/
+
+    With --auth the SB8200 wants the ?login_<base64 username:password> / ?ct_<token> login
+    and the T25 sends a meta refresh to index.html, then to login.html, where the username
+    and password are POSTed for a session cookie.  The SB6183 never asks for a login.
+
+    Faults for every modem: --latency-ms (plus up to --jitter-ms) before every answer,
+    --hang-rate of requests that get no answer for --hang-seconds, --error-rate of requests
+    that get a 500, and --login-page-rate of status pages that are the login page instead,
+    like the SB8200 bug.
+
+    Run from the repo root with:
+    bash tests/run_mock_modem.sh --modems 1000 --auth --inventory /tmp/fleet.ini
+    then point fleet_inventory at /tmp/fleet.ini
+"""
+# pylint: disable=line-too-long
+
+import os
+import re
+import sys
+import time
+import base64
+import random
+import argparse
+import threading
+import collections
+import urllib.parse
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MOCKUPS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mockups')
+
+# model -> the status page, relative to the modem's path prefix
+STATUS_PAGES = {
+    'sb8200': 'cmconnectionstatus.html',
+    'sb6183': 'RgConnect.asp',
+    't25': ''
+}
+
+MODEM_PATH = re.compile(r'^/modem/(\d+)(/.*)$')
+
+LOGIN_PAGE = b'<html><head><title>Login</title></head><body><form method="post" action="login.html">Username: <input name="username"> Password: <input type="password" name="password"></form></body></html>'
+
+# The T25 doesn't redirect with a 30x, follow_redirect looks for these
+META_REFRESH_PAGE = '<html><head><meta http-equiv="refresh" content="0;url=%s"></head><body></body></html>'
+
+
+def main():
+    """ MAIN """
+    args = get_args()
+    server = MockModemServer((args.host, args.port), args.models.split(','), args.modems, auth=args.auth,
+                             username=args.username, password=args.password, latency_ms=args.latency_ms,
+                             jitter_ms=args.jitter_ms, hang_rate=args.hang_rate, hang_seconds=args.hang_seconds,
+                             error_rate=args.error_rate, login_page_rate=args.login_page_rate, seed=args.seed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print('Serving %s modems on port %s, modem 0 is %s' % (args.modems, server.server_port, server.get_modem_url(0)))
+
+    if args.inventory:
+        with open(args.inventory, 'w') as inventory_file:
+            inventory_file.write(server.get_inventory())
+        print('Wrote the fleet inventory to %s' % args.inventory)
+
+    # Report what the modems have answered, until ctrl-c
+    try:
+        while True:
+            time.sleep(args.report_interval)
+            print(', '.join('%s %s' % (name, count) for name, count in sorted(server.get_counts().items())))
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    server.shutdown()
+
+
+def get_args():
+    """ Get argparser args """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', help='Address to listen on', default='127.0.0.1')
+    parser.add_argument('--port', help='Port to listen on', type=int, default=8000)
+    parser.add_argument('--modems', help='Number of virtual modems', type=int, default=1)
+    parser.add_argument('--models', help='Comma separated models, the modems take turns', default='sb8200,sb6183,t25')
+    parser.add_argument('--auth', help='SB8200 and T25 modems want a login', action='store_true')
+    parser.add_argument('--username', help='Username the modems accept', default='admin')
+    parser.add_argument('--password', help='Password the modems accept', default='password')
+    parser.add_argument('--latency-ms', help='Milliseconds before every answer', type=float, default=0)
+    parser.add_argument('--jitter-ms', help='Up to this many more milliseconds before every answer', type=float, default=0)
+    parser.add_argument('--hang-rate', help='Fraction of requests that get no answer', type=float, default=0)
+    parser.add_argument('--hang-seconds', help='Seconds a hung request is held before the connection is closed', type=float, default=60)
+    parser.add_argument('--error-rate', help='Fraction of requests that get a 500', type=float, default=0)
+    parser.add_argument('--login-page-rate', help='Fraction of status pages that are the login page instead', type=float, default=0)
+    parser.add_argument('--seed', help='Random seed, for faults that land on the same requests every run', type=int)
+    parser.add_argument('--inventory', help='Write a fleet inventory with every modem to this file')
+    parser.add_argument('--report-interval', help='Seconds between request counts', type=float, default=10)
+    return parser.parse_args()
+
+
+def decode_credentials(auth_hash):
+    """ Return the username:password the SB8200 login sent, or None if it isn't base64 """
+    try:
+        return base64.b64decode(auth_hash).decode()
+    except ValueError:
+        return None
+
+
+class MockModemServer(ThreadingHTTPServer):
+    """ Every virtual modem, one thread per connection """
+    daemon_threads = True
+    # A whole fleet connects at the top of the interval
+    request_queue_size = 1024
+
+    def __init__(self, address, models, modems=1, auth=False, username='admin', password='password', latency_ms=0,  # pylint: disable=too-many-arguments
+                 jitter_ms=0, hang_rate=0, hang_seconds=60, error_rate=0, login_page_rate=0, seed=None):
+        for model in models:
+            if model not in STATUS_PAGES:
+                raise RuntimeError('Model %s not supported!' % model)
+        self.models = models
+        self.modems = modems
+        self.auth = auth
+        self.credentials = '%s:%s' % (username, password)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.error_rate = error_rate
+        self.login_page_rate = login_page_rate
+        self.random = random.Random(seed)
+
+        # Every page is read once, each modem only costs its session token
+        self.pages = {}
+        for model in set(models):
+            with open(os.path.join(MOCKUPS_DIR, model + '.html'), 'rb') as page_file:
+                self.pages[model] = page_file.read()
+
+        # modem -> its current session token, logging in again replaces it like the SB8200 does
+        self.sessions = {}
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+        super().__init__(address, MockModemHandler)
+
+    def get_model(self, modem):
+        return self.models[modem % len(self.models)]
+
+    def get_modem_url(self, modem):
+        """ Return the modem_url to poll a virtual modem at """
+        return 'http://%s:%s/modem/%s/%s' % (self.server_address[0], self.server_port, modem, STATUS_PAGES[self.get_model(modem)])
+
+    def get_inventory(self):
+        """ Return a fleet inventory, see src/fleet.ini.example, with a section for every modem """
+        username, _, password = self.credentials.partition(':')
+        sections = []
+        for modem in range(self.modems):
+            model = self.get_model(modem)
+            section = ['[mock_%s]' % modem, 'modem_model = %s' % model, 'modem_url = %s' % self.get_modem_url(modem)]
+            if self.auth and model != 'sb6183':
+                section += ['modem_auth_required = True', 'modem_username = %s' % username, 'modem_password = %s' % password]
+            sections.append('\n'.join(section) + '\n')
+        return '\n'.join(sections)
+
+    def chance(self, rate):
+        """ True for rate of the calls """
+        return rate > 0 and self.random.random() < rate
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def get_counts(self):
+        """ Return how many of each kind of answer the modems have given """
+        with self.lock:
+            return dict(self.counts)
+
+
+class MockModemHandler(BaseHTTPRequestHandler):
+    """ Answers as whichever virtual modem the path is for """
+    # Keep-alive, like the modems and requests' sessions
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.answer()
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        length = int(self.headers.get('Content-Length') or 0)
+        self.answer(urllib.parse.parse_qs(self.rfile.read(length).decode()))
+
+    def answer(self, form=None):
+        """ Inject the faults, then answer the request as the modem would """
+        self.server.count('requests')
+        if self.server.chance(self.server.hang_rate):
+            self.server.count('hangs')
+            time.sleep(self.server.hang_seconds)
+            self.close_connection = True
+            return
+
+        if self.server.latency_ms or self.server.jitter_ms:
+            time.sleep((self.server.latency_ms + self.server.random.random() * self.server.jitter_ms) / 1000)
+
+        if self.server.chance(self.server.error_rate):
+            self.server.count('errors')
+            self.respond(500, b'Internal Server Error')
+            return
+
+        url = urllib.parse.urlsplit(self.path)
+        match = MODEM_PATH.match(url.path)
+        modem = int(match.group(1)) if match else None
+        if modem is None or modem >= self.server.modems:
+            self.server.count('not_found')
+            self.respond(404, b'Not Found')
+            return
+
+        page = match.group(2)[1:]
+        model = self.server.get_model(modem)
+        if model == 't25':
+            self.answer_t25(modem, page, form)
+        elif page == STATUS_PAGES[model]:
+            self.answer_sb(modem, model, url.query)
+        else:
+            self.server.count('not_found')
+            self.respond(404, b'Not Found')
+
+    def answer_sb(self, modem, model, query):
+        """ The SB8200 logs in with ?login_<base64 username:password> and answers with a token
+            for ?ct_<token>, the SB6183 never asks
+        """
+        if self.server.auth and model == 'sb8200':
+            if query.startswith('login_'):
+                if decode_credentials(query[len('login_'):]) != self.server.credentials:
+                    self.server.count('failed_logins')
+                    self.send_login_page()
+                    return
+                token = '%032x' % self.server.random.getrandbits(128)
+                with self.server.lock:
+                    self.server.sessions[modem] = token
+                self.server.count('logins')
+                self.respond(200, token.encode(), 'text/plain', [('Set-Cookie', 'credential=%s; Path=/' % token)])
+                return
+
+            with self.server.lock:
+                token = self.server.sessions.get(modem)
+            if not token or query != 'ct_' + token:
+                self.send_login_page()
+                return
+
+        self.send_status_page(model)
+
+    def answer_t25(self, modem, page, form):
+        """ Without a session cookie the T25 refreshes to index.html, which refreshes to login.html,
+            where the login form is POSTed
+        """
+        if not self.server.auth:
+            if page == STATUS_PAGES['t25']:
+                self.send_status_page('t25')
+            else:
+                self.server.count('not_found')
+                self.respond(404, b'Not Found')
+            return
+
+        if page == 'login.html' and form is not None:
+            if '%s:%s' % (form.get('username', [''])[0], form.get('password', [''])[0]) != self.server.credentials:
+                self.server.count('failed_logins')
+                self.send_login_page()
+                return
+            token = '%032x' % self.server.random.getrandbits(128)
+            with self.server.lock:
+                self.server.sessions[modem] = token
+            self.server.count('logins')
+            self.respond(200, (META_REFRESH_PAGE % 'index.html').encode(), headers=[('Set-Cookie', 'sessionid=%s; Path=/' % token)])
+            return
+
+        if page == 'login.html':
+            self.send_login_page()
+            return
+        if page == 'index.html':
+            self.respond(200, (META_REFRESH_PAGE % 'login.html').encode())
+            return
+        if page != STATUS_PAGES['t25']:
+            self.server.count('not_found')
+            self.respond(404, b'Not Found')
+            return
+
+        cookie = SimpleCookie(self.headers.get('Cookie', ''))
+        with self.server.lock:
+            token = self.server.sessions.get(modem)
+        if not token or 'sessionid' not in cookie or cookie['sessionid'].value != token:
+            self.respond(200, (META_REFRESH_PAGE % 'index.html').encode())
+            return
+        self.send_status_page('t25')
+
+    def send_status_page(self, model):
+        if self.server.chance(self.server.login_page_rate):
+            self.send_login_page()
+            return
+        self.server.count('status_pages')
+        self.respond(200, self.server.pages[model])
+
+    def send_login_page(self):
+        self.server.count('login_pages')
+        self.respond(200, LOGIN_PAGE)
+
+    def respond(self, status, body, content_type='text/html', headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+if __name__ == '__main__':
+    main()
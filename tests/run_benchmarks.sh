@@ -0,0 +1,5 @@
+#!/bin/bash
+# run from parent dir
+# pass --update-baseline to record new baseline numbers after an intentional change
+export PYTHONPATH=./src
+python3 tests/benchmark_parsers.py "$@"
@@ -0,0 +1,4 @@
+#!/bin/bash
+# run from parent dir
+# pass --help for the modems, login and fault options
+python3 tests/mock_modem.py "$@"
@@ -0,0 +1,4 @@
+#!/bin/bash
+# run from parent dir
+# pass --budget-ms to change the start up budget
+python3 tests/benchmark_startup.py "$@"
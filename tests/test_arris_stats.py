@@ -154,9 +154,1120 @@ class TestArrisStats(unittest.TestCase):
             # Verify the values
             root_indexes = ['downstream', 'upstream']
             for root_index in root_indexes:
+                rows = [channel.to_dict() for channel in stats[root_index]]
                 for row in control_values[root_index]:
-                    self.assertIn(row, stats[root_index])
+                    self.assertIn(row, rows)
 
+    def test_parser_backends(self):
+        """ Every parser backend must produce exactly the same stats as the mockups """
+        import arris_stats_html  # pylint: disable=import-outside-toplevel
+        import arris_stats_records  # pylint: disable=import-outside-toplevel
+
+        for modem in arris_stats.modems_supported:
+            with open('tests/mockups/%s.json' % modem) as f:
+                control_values_string = f.read()
+            with open('tests/mockups/%s.html' % modem) as f:
+                html = f.read()
+
+            module = __import__('arris_stats_' + modem)
+            parse_html_function = getattr(module, 'parse_html_' + modem)
+
+            for backend in arris_stats_html.parser_backends_supported:
+                stats = parse_html_function(html, backend)
+                self.assertEqual(json.dumps(arris_stats_records.stats_to_dict(stats)), json.dumps(json.loads(control_values_string)), '%s %s' % (modem, backend))
+
+    def test_get_inventory(self):
+        """ Test arris_stats_fleet.get_inventory() builds a config per modem """
+        import arris_stats_fleet  # pylint: disable=import-outside-toplevel
+
+        config = arris_stats.get_config()
+        modems = arris_stats_fleet.get_inventory('src/fleet.ini.example', config)
+        self.assertEqual([modem['modem_id'] for modem in modems], ['living_room', 'office', 'garage'])
+
+        # Settings from the section override the main config, everything else is inherited
+        self.assertEqual(modems[1]['modem_model'], 'sb6183')
+        self.assertEqual(modems[1]['sleep_interval'], 60)
+        self.assertEqual(modems[1]['destination'], config['destination'])
+        self.assertTrue(modems[0]['modem_auth_required'])
+        self.assertIsNone(modems[0]['modem_password'])
+        self.assertEqual(modems[1]['parse_html_function'].__name__, 'parse_html_sb6183')
+        self.assertEqual(modems[2]['get_token_function'].__name__, 'get_token_t25')
+
+    def test_timestream_records(self):
+        """ Test arris_stats_aws_timestream against a stand-in client """
+        import arris_stats_aws_timestream  # pylint: disable=import-outside-toplevel
+        import arris_stats_sb8200  # pylint: disable=import-outside-toplevel
+
+        class StandInTimestreamClient:
+            """ Records the calls a boto3 timestream-write client would get """
+            exceptions = type('exceptions', (), {'RejectedRecordsException': type('RejectedRecordsException', (Exception,), {})})
+
+            def __init__(self):
+                self.describes = 0
+                self.writes = []
+
+            def describe_database(self, **kwargs):  # pylint: disable=unused-argument
+                self.describes += 1
+
+            def describe_table(self, **kwargs):  # pylint: disable=unused-argument
+                self.describes += 1
+
+            def write_records(self, **kwargs):
+                self.writes.append(kwargs)
+
+        config = arris_stats.get_config()
+        with open('tests/mockups/sb8200.html') as f:
+            stats = arris_stats_sb8200.parse_html_sb8200(f.read())
+
+        # Bump the channel count past one write_records call
+        stats['downstream'] = stats['downstream'] * 4
+        channels = len(stats['downstream']) + len(stats['upstream'])
+
+        ts_client = StandInTimestreamClient()
+        arris_stats_aws_timestream.validated_tables.clear()
+        arris_stats_aws_timestream.send_to_aws_time_stream(stats, config, ts_client)
+        arris_stats_aws_timestream.send_to_aws_time_stream(stats, config, ts_client)
+
+        # Database and table are only described once per process
+        self.assertEqual(ts_client.describes, 2)
+
+        # One multi-measure record per channel, in full batches of 100
+        self.assertEqual([len(write['Records']) for write in ts_client.writes], [100, channels - 100] * 2)
+        record = ts_client.writes[0]['Records'][0]
+        self.assertEqual(record['MeasureValueType'], 'MULTI')
+        self.assertEqual(record['MeasureName'], 'downstream_statistics')
+        self.assertIn({'Name': 'measurement', 'Value': 'downstream_statistics'}, record['Dimensions'])
+        self.assertIn({'Name': 'power', 'Value': '12.3', 'Type': 'DOUBLE'}, record['MeasureValues'])
+        self.assertIn({'Name': 'corrected', 'Value': '104', 'Type': 'BIGINT'}, record['MeasureValues'])
+
+    def test_influx_writers(self):
+        """ Test the Influx 1.x and 2.x writers reuse one client across polls, flush on close and keep buffered lines after a failed write """
+        from unittest import mock  # pylint: disable=import-outside-toplevel
+        from influxdb.exceptions import InfluxDBServerError  # pylint: disable=import-outside-toplevel
+        from influxdb_client.client.exceptions import InfluxDBError  # pylint: disable=import-outside-toplevel
+        import arris_stats_influx1  # pylint: disable=import-outside-toplevel
+        import arris_stats_influx2  # pylint: disable=import-outside-toplevel
+        import arris_stats_sb6183  # pylint: disable=import-outside-toplevel
+
+        class StandInClient:
+            """ Records the writes an InfluxDBClient (1.x) or its write_api (2.x) would get, failing while down """
+            instances = []
+
+            def __init__(self, *args, **kwargs):  # pylint: disable=unused-argument
+                self.writes = []
+                self.down = False
+                self.closed = False
+                self.write_options = None
+                StandInClient.instances.append(self)
+
+            def write_points(self, lines, protocol):  # pylint: disable=unused-argument
+                if self.down:
+                    raise InfluxDBServerError('down')
+                self.writes.append(list(lines))
+
+            def write_api(self, write_options=None, **kwargs):  # pylint: disable=unused-argument
+                self.write_options = write_options
+                return self
+
+            def write(self, record, bucket):  # pylint: disable=unused-argument
+                if self.down:
+                    raise InfluxDBError(message='down')
+                self.writes.append(record.split('\n'))
+
+            def close(self):
+                self.closed = True
+
+        with open('tests/mockups/sb6183.html') as f:
+            stats = arris_stats_sb6183.parse_html_sb6183(f.read())
+        channels = len(stats['downstream']) + len(stats['upstream'])
+
+        for module, settings in [(arris_stats_influx1, {}), (arris_stats_influx2, {'influx_major_version': 2}), (arris_stats_influx2, {'influx_major_version': 2, 'influx_write_mode': 'batching'})]:
+            StandInClient.instances = []
+            config = dict(arris_stats.get_config(), **settings)
+            with mock.patch.object(module, 'InfluxDBClient', StandInClient):
+                # One client for every poll
+                for timestamp_ns in range(3):
+                    self.assertTrue(module.send_to_influx(dict(stats, timestamp_ns=timestamp_ns), config))
+                self.assertEqual(len(StandInClient.instances), 1)
+                client = StandInClient.instances[0]
+                self.assertEqual([len(lines) for lines in client.writes], [channels] * 3)
+                if settings.get('influx_write_mode') == 'batching':
+                    self.assertEqual(client.write_options.write_type.name, 'batching')
+
+                # A failed write with nothing buffered is the caller's to retry
+                client.down = True
+                self.assertFalse(module.send_to_influx(stats, config))
+                client.down = False
+                module.close_influx_writers()
+                self.assertTrue(client.closed)
+
+                # Buffered polls survive a failed write and go out with the next one, or at close
+                config['influx_batch_cycles'] = 2
+                self.assertTrue(module.send_to_influx(stats, config))
+                client = StandInClient.instances[-1]
+                client.down = True
+                self.assertFalse(module.send_to_influx(stats, config))
+                client.down = False
+                self.assertTrue(module.send_to_influx(stats, config))
+                self.assertEqual(client.writes, [])
+                module.close_influx_writers()
+                self.assertEqual([len(lines) for lines in client.writes], [channels * 3])
+                self.assertEqual(module.influx_writers, {})
+
+        # The real clients against a port nothing listens on, the connection error is a failed write and the
+        # buffered lines are kept, and close gives up on them without raising
+        for module, settings in [(arris_stats_influx1, {'influx_port': 1}), (arris_stats_influx2, {'influx_major_version': 2, 'influx_url': 'http://127.0.0.1:1', 'influx_org': 'org', 'influx_token': 'token'})]:
+            config = dict(arris_stats.get_config(), influx_host='127.0.0.1', influx_batch_cycles=2, **settings)
+            self.assertTrue(module.send_to_influx(stats, config))
+            self.assertFalse(module.send_to_influx(stats, config))
+            writer = module.get_influx_writer(config)
+            self.assertEqual(len(writer['buffer'].lines), channels * 2)
+            module.close_influx_writers()
+            self.assertEqual(module.influx_writers, {})
+
+    def test_splunk(self):
+        """ Test arris_stats_splunk posts every event from a send in one request, so a failed send has posted nothing """
+        from unittest import mock  # pylint: disable=import-outside-toplevel
+        import requests  # pylint: disable=import-outside-toplevel
+        import arris_stats_splunk  # pylint: disable=import-outside-toplevel
+        import arris_stats_sb8200  # pylint: disable=import-outside-toplevel
+
+        class StandInSession:
+            """ Records the posts a requests session would get, answering with status_code """
+            def __init__(self):
+                self.posts = []
+                self.status_code = 200
+
+            def post(self, url, data, timeout):  # pylint: disable=unused-argument
+                self.posts.append(data)
+                response = requests.models.Response()
+                response.status_code = self.status_code
+                return response
+
+        with open('tests/mockups/sb8200.html') as f:
+            stats = arris_stats_sb8200.parse_html_sb8200(f.read())
+        channels = len(stats['downstream']) + len(stats['upstream'])
+
+        config = dict(arris_stats.get_config(), splunk_token='token', modem_id='splunk_test')
+        session = StandInSession()
+        with mock.patch.object(arris_stats_splunk, 'get_splunk_session', return_value=session):
+            stats_list = [dict(stats, timestamp_ns=timestamp_ns * 1000000000) for timestamp_ns in range(5)]
+            self.assertTrue(arris_stats_splunk.send_batch_to_splunk(stats_list, config))
+            self.assertEqual(len(session.posts), 1)
+            # HEC takes concatenated JSON objects
+            events = []
+            data = session.posts[0]
+            while data:
+                event, end = json.JSONDecoder().raw_decode(data)
+                events.append(event)
+                data = data[end:]
+            self.assertEqual(len(events), channels * 5)
+            self.assertEqual((events[-1]['time'], events[-1]['event']['modem_id']), (4, 'splunk_test'))
+
+            session.status_code = 503
+            self.assertFalse(arris_stats_splunk.send_batch_to_splunk(stats_list, config))
+            self.assertEqual(len(session.posts), 2)
+
+            # Nothing to send isn't a request, HEC would answer 400 No data
+            self.assertTrue(arris_stats_splunk.send_batch_to_splunk([{'downstream': [], 'upstream': [], 'timestamp_ns': 1}], config))
+            self.assertEqual(len(session.posts), 2)
+
+    def test_line_protocol(self):
+        """ Test arris_stats_line_protocol encoding and buffering """
+        import arris_stats_line_protocol  # pylint: disable=import-outside-toplevel
+        import arris_stats_sb6183  # pylint: disable=import-outside-toplevel
+
+        with open('tests/mockups/sb6183.html') as f:
+            stats = arris_stats_sb6183.parse_html_sb6183(f.read())
+
+        lines = arris_stats_line_protocol.encode_stats(stats, 1600000000000000000, {'modem_id': 'living room,1'})
+        self.assertEqual(len(lines), len(stats['downstream']) + len(stats['upstream']))
+        self.assertEqual(lines[0], r'downstream_statistics,channel_id=1,modem_id=living\ room\,1 frequency=603000000i,power=-7.6,snr=37.0,corrected=219i,uncorrectables=0i 1600000000000000000')
+        self.assertEqual(lines[-1], r'upstream_statistics,channel_id=4,modem_id=living\ room\,1 symbol_rate=5120i,frequency=29200000i,power=47.2 1600000000000000000')
+
+        # Nothing comes back out until max_cycles polls have been added
+        line_buffer = arris_stats_line_protocol.LineBuffer(3)
+        self.assertIsNone(line_buffer.add(lines))
+        self.assertIsNone(line_buffer.add(lines))
+        self.assertEqual(line_buffer.add(lines), lines * 3)
+        self.assertIsNone(line_buffer.add(lines))
+        self.assertEqual(line_buffer.drain(), lines)
+        self.assertEqual(line_buffer.drain(), [])
+
+        # Lines from a failed write go out with the next one
+        line_buffer.restore(lines[:1])
+        line_buffer.add(lines[1:2])
+        line_buffer.add([])
+        self.assertEqual(line_buffer.add([]), lines[:2])
+
+        # NaN and inf never reach Influx, a channel with nothing else has no line
+        stats['downstream'][0].snr = float('nan')
+        stats['downstream'][1].power = stats['downstream'][1].snr = float('inf')
+        stats['downstream'][1].frequency = stats['downstream'][1].corrected = stats['downstream'][1].uncorrectables = None
+        lines = arris_stats_line_protocol.encode_stats({'downstream': stats['downstream'][:2], 'upstream': []}, 1)
+        self.assertEqual(lines, ['downstream_statistics,channel_id=1 frequency=603000000i,power=-7.6,corrected=219i,uncorrectables=0i 1'])
+
+        # The T25 frequency keeps the float type, and MHz upstream, that existing shards have
+        import arris_stats_t25  # pylint: disable=import-outside-toplevel
+        with open('tests/mockups/t25.html') as f:
+            stats = arris_stats_t25.parse_html_t25(f.read())
+        lines = arris_stats_line_protocol.encode_stats(stats, 1)
+        self.assertEqual(lines[0], 'downstream_statistics,channel_id=1 frequency=489000000.0,power=-3.5,snr=40.37,corrected=8i,uncorrectables=0i 1')
+        self.assertEqual(lines[-1], 'upstream_statistics,channel_id=4 symbol_rate=5120i,frequency=30.1,power=40.0 1')
+
+    def test_spool(self):
+        """ Test arris_stats_spool holds on to stats until the destination takes them """
+        from unittest import mock  # pylint: disable=import-outside-toplevel
+        import arris_stats_spool  # pylint: disable=import-outside-toplevel
+        import arris_stats_sb8200  # pylint: disable=import-outside-toplevel
+
+        with open('tests/mockups/sb8200.html') as f:
+            stats = arris_stats_sb8200.parse_html_sb8200(f.read())
+
+        sent = []
+        destination = {'up': False}
+
+        def send_batch(stats_list, config):  # pylint: disable=unused-argument
+            if destination['up']:
+                sent.append(stats_list)
+            return destination['up']
+
+        config = arris_stats.get_config()
+        config['spool_dir'] = tempfile.mkdtemp()
+        config['spool_replay_batch'] = 2
+
+        # Destination is down, everything stays in the spool
+        spool = arris_stats_spool.Spool(config['spool_dir'], config, send_batch)
+        for timestamp_ns in range(5):
+            stats['timestamp_ns'] = timestamp_ns
+            self.assertFalse(spool.send(stats))
+        spool.replay()
+        self.assertEqual(sent, [])
+        spool.close()
+
+        # A new process finds the backlog and replays it in bulk, oldest first with the original timestamps
+        destination['up'] = True
+        spool = arris_stats_spool.Spool(config['spool_dir'], config, send_batch)
+        spool.replay()
+        self.assertEqual([[stats['timestamp_ns'] for stats in batch] for batch in sent], [[0, 1], [2, 3], [4]])
+        self.assertEqual(sent[0][0]['downstream'], stats['downstream'])
+
+        # Live sends are acknowledged straight away and never replayed
+        del sent[:]
+        self.assertTrue(spool.send(stats))
+        spool.replay()
+        self.assertEqual(len(sent), 1)
+        spool.close()
+
+        # Going over spool_max_bytes drops the oldest segments
+        destination['up'] = False
+        config['spool_max_bytes'] = 40000
+        spool = arris_stats_spool.Spool(tempfile.mkdtemp(), config, send_batch)
+        for _ in range(50):
+            spool.send(stats)
+        self.assertLessEqual(sum(os.path.getsize(segment) for segment in spool.segments), 40000 + spool.segment_bytes)
+        self.assertEqual(spool.total_bytes, sum(os.path.getsize(segment) for segment in spool.segments))
+        self.assertLess(len(spool._unacked(100)[0]), 50)  # pylint: disable=protected-access
+        spool.close()
+
+        # A destination that raises partway through a batch leaves every poll in it spooled
+        def send_stats_batch(stats_list, config):  # pylint: disable=unused-argument
+            if not destination['up']:
+                sent.append(stats_list[:1])
+                raise ConnectionError('down')
+            sent.append(stats_list)
+            return True
+
+        del sent[:]
+        config = arris_stats.get_config()
+        config.update({'spool_dir': tempfile.mkdtemp(), 'modem_id': 'spool_test', 'destination': 'influxdb'})
+        batch = [dict(stats, timestamp_ns=timestamp_ns) for timestamp_ns in range(3)]
+        with mock.patch.object(arris_stats, 'send_stats_batch', send_stats_batch):
+            self.assertFalse(arris_stats.send_to_destination(batch, config))
+            spool = arris_stats_spool.get_spool(config, send_stats_batch)
+            self.assertEqual(len(spool._unacked(100)[0]), 3)  # pylint: disable=protected-access
+            destination['up'] = True
+            spool.replay()
+        self.assertEqual([[stats['timestamp_ns'] for stats in batch] for batch in sent], [[0], [0, 1, 2]])
+        self.assertEqual(spool._unacked(100)[0], [])  # pylint: disable=protected-access
+        arris_stats_spool.close_spools()
+
+        # Lines that are only buffered aren't delivered, so the spool won't take buffering Influx modes
+        config = arris_stats.get_config()
+        config.update({'spool_dir': tempfile.mkdtemp(), 'influx_batch_cycles': '5'})
+        with self.assertRaises(RuntimeError):
+            arris_stats.normalize_config(config)
+
+    def test_scheduler(self):
+        """ Test arris_stats_scheduler ticks stay aligned and skip missed ticks """
+        import arris_stats_scheduler  # pylint: disable=import-outside-toplevel
+
+        scheduler = arris_stats_scheduler.Scheduler(0.5)
+
+        # First poll is straight away, after that we're on multiples of the interval
+        self.assertEqual(scheduler.advance(1000.2), (1000.2, 0))
+        tick, delay = scheduler.advance(1000.3)
+        self.assertEqual(tick, 1000.5)
+        self.assertAlmostEqual(delay, 0.2)
+
+        # A slow poll doesn't push the next one back
+        tick, delay = scheduler.advance(1000.9)
+        self.assertEqual(tick, 1001.0)
+        self.assertAlmostEqual(delay, 0.1)
+
+        # Overrunning several ticks skips them rather than firing them all at once
+        tick, delay = scheduler.advance(1002.2)
+        self.assertEqual(tick, 1002.5)
+        self.assertEqual(scheduler.missed_ticks, 2)
+
+        # Jitter delays every poll by the same amount, timestamps stay on the tick
+        scheduler = arris_stats_scheduler.Scheduler(10, jitter=5)
+        self.assertTrue(0 <= scheduler.offset <= 5)
+        scheduler.advance(1001)
+        for expected in [1010, 1020, 1030]:
+            tick, delay = scheduler.advance(expected - 9)
+            self.assertEqual(tick, expected)
+            self.assertAlmostEqual(delay, 9 + scheduler.offset)
+
+    def test_counter_deltas(self):
+        """ Test arris_stats_counters deltas and rates, across resets, re-locks and restarts """
+        import arris_stats_counters  # pylint: disable=import-outside-toplevel
+        from arris_stats_records import DownstreamChannel  # pylint: disable=import-outside-toplevel
+
+        config = arris_stats.get_config()
+        config['modem_id'] = 'test_counter_deltas'
+        config['counter_state_dir'] = tempfile.mkdtemp()
+
+        def poll(seconds, frequency, corrected, uncorrectables):
+            stats = {'downstream': [DownstreamChannel(1, frequency, 1.0, 40.0, corrected, uncorrectables)], 'upstream': [], 'timestamp_ns': seconds * 1000000000}
+            arris_stats_counters.add_deltas(stats, config)
+            channel = stats['downstream'][0]
+            return channel.corrected_delta, channel.uncorrectables_delta, channel.corrected_rate, channel.uncorrectables_rate
+
+        # Nothing to compare the first poll with
+        self.assertEqual(poll(0, 507000000, 100, 10), (None, None, None, None))
+        self.assertEqual(poll(300, 507000000, 400, 13), (300, 3, 1.0, 0.01))
+
+        # Counters going backwards means the modem rebooted, everything since is new
+        self.assertEqual(poll(600, 507000000, 30, 0), (30, 0, 0.1, 0.0))
+
+        # A different frequency is a different channel
+        self.assertEqual(poll(900, 513000000, 60, 0), (None, None, None, None))
+
+        # A restart picks up where the last run left off
+        arris_stats_counters.previous_samples.clear()
+        self.assertEqual(poll(1200, 513000000, 90, 0), (30, 0, 0.1, 0.0))
+
+    def test_fanout(self):
+        """ Test arris_stats_fanout queues stats per destination without blocking the caller """
+        import time  # pylint: disable=import-outside-toplevel
+        import threading  # pylint: disable=import-outside-toplevel
+        import arris_stats_fanout  # pylint: disable=import-outside-toplevel
+
+        config = arris_stats.get_config()
+        config['destination'] = 'stdout_json, splunk'
+        config['destination_queue_policy'] = 'drop_oldest,splunk:drop_newest'
+        arris_stats.normalize_config(config)
+        self.assertEqual(config['destinations'], ['stdout_json', 'splunk'])
+        self.assertEqual(config['destination_queue_policies'], {'stdout_json': 'drop_oldest', 'splunk': 'drop_newest'})
+
+        config['destination_queue_policy'] = 'splunk:sometimes'
+        with self.assertRaises(RuntimeError):
+            arris_stats.normalize_config(config)
+
+        # The first send holds up the destination, everything queued meanwhile is sent together afterwards
+        release = threading.Event()
+        sent = []
+
+        def send(stats_list, send_config):
+            release.wait()
+            sent.append((send_config['destination'], stats_list))
+
+        for policy, expected in [('drop_oldest', [[0], [3, 4]]), ('drop_newest', [[0], [1, 2]])]:
+            release.clear()
+            del sent[:]
+            worker = arris_stats_fanout.SinkWorker('test', send, 2, policy)
+            worker.put(0, config)
+            while not worker.queue.empty():
+                time.sleep(0.01)  # Wait for the worker to pick it up
+            results = [worker.put(stats, config) for stats in range(1, 5)]
+            self.assertEqual(results, [True, True, False, False])
+            release.set()
+            worker.close(5)
+            self.assertEqual([stats_list for _, stats_list in sent], expected)
+            self.assertEqual(sent[0][0], 'test')
+
+    def test_prometheus(self):
+        """ Test arris_stats_prometheus serves the latest stats of every modem on /metrics """
+        import time  # pylint: disable=import-outside-toplevel
+        import urllib.request  # pylint: disable=import-outside-toplevel
+        import arris_stats_prometheus  # pylint: disable=import-outside-toplevel
+        from arris_stats_records import DownstreamChannel, UpstreamChannel  # pylint: disable=import-outside-toplevel
+
+        exporter = arris_stats_prometheus.Exporter('127.0.0.1', 0, 900)
+        url = 'http://127.0.0.1:%s/metrics' % exporter.server.server_port
+        try:
+            now_ns = time.time_ns()
+            exporter.update('a', {'downstream': [DownstreamChannel(1, 507000000, 1.5, 40.0, 10, 2)], 'upstream': [], 'timestamp_ns': now_ns})
+            exporter.update('b', {'downstream': [], 'upstream': [UpstreamChannel(2, 29200000, 47.2, 5120)], 'timestamp_ns': now_ns})
+            with urllib.request.urlopen(url) as resp:
+                text = resp.read().decode()
+            self.assertIn('# TYPE arris_channel_corrected_total counter\narris_channel_corrected_total{direction="downstream",channel_id="1",modem_id="a"} 10\n', text)
+            self.assertIn('arris_channel_power_dbmv{direction="downstream",channel_id="1",modem_id="a"} 1.5\narris_channel_power_dbmv{direction="upstream",channel_id="2",modem_id="b"} 47.2\n', text)
+            self.assertEqual(text.count('# TYPE arris_channel_power_dbmv'), 1)
+
+            # Scrapes reuse the rendered text until there's a new poll
+            self.assertIs(exporter.render(), exporter.render())
+
+            # Stats older than max_age aren't served
+            exporter.update('a', {'downstream': [DownstreamChannel(1, 507000000, 1.5, 40.0, 10, 2)], 'upstream': [], 'timestamp_ns': now_ns - 1000 * 1000000000})
+            self.assertNotIn(b'modem_id="a"', exporter.render())
+        finally:
+            exporter.close()
+
+    def test_collector_statistics(self):
+        """ Test arris_stats_metrics times stages, counts errors and renders them for Prometheus """
+        import arris_stats_metrics  # pylint: disable=import-outside-toplevel
+        import arris_stats_line_protocol  # pylint: disable=import-outside-toplevel
+
+        config = arris_stats.get_config()
+        config['modem_id'] = 'test_collector_statistics'
+        arris_stats_metrics.observe('fetch', 0.3, config)
+        arris_stats_metrics.observe('send', 0.02, config, 'splunk')
+        arris_stats_metrics.observe('send', 7.5, config, 'influxdb')
+        arris_stats_metrics.increment('login_pages', config)
+        arris_stats_metrics.increment('sink_errors', config, 'splunk')
+        arris_stats_metrics.increment('sink_errors', config, 'influxdb')
+
+        # The slowest destination is the send time, counters are totals over every destination
+        collector = arris_stats_metrics.get_collector_statistics(config)
+        self.assertEqual(collector.to_dict(), {'fetch_seconds': 0.3, 'send_seconds': 7.5, 'failed_logins': 0, 'login_pages': 1, 'sink_errors': 2})
+        self.assertIsNone(arris_stats_metrics.get_collector_statistics(config).send_seconds)
+
+        stats = {'downstream': [], 'upstream': [], 'collector': collector}
+        self.assertEqual(arris_stats_line_protocol.encode_stats(stats, 5, {'modem_id': 'm'}), ['collector_statistics,modem_id=m fetch_seconds=0.3,send_seconds=7.5,failed_logins=0i,login_pages=1i,sink_errors=2i 5'])
+
+        text = arris_stats_metrics.render()
+        self.assertIn('arris_collector_stage_seconds_bucket{stage="fetch",modem_id="test_collector_statistics",le="0.25"} 0\n', text)
+        self.assertIn('arris_collector_stage_seconds_bucket{stage="fetch",modem_id="test_collector_statistics",le="0.5"} 1\n', text)
+        self.assertIn('arris_collector_stage_seconds_count{stage="send",modem_id="test_collector_statistics",destination="influxdb"} 1\n', text)
+        self.assertIn('arris_collector_sink_errors_total{modem_id="test_collector_statistics",destination="splunk"} 1\n', text)
+
+    def test_auth_session(self):
+        """ Test arris_stats_auth saves login sessions and rate limits logins across restarts """
+        import stat  # pylint: disable=import-outside-toplevel
+        import arris_stats_auth  # pylint: disable=import-outside-toplevel
+
+        logins = []
+
+        def get_token_function(config, session):  # pylint: disable=unused-argument
+            logins.append(session)
+            session.cookies.set('sessionId', 'abc123', domain='192.168.100.1', path='/')
+            return 'token%s' % len(logins)
+
+        config = arris_stats.get_config()
+        config['modem_id'] = 'test_auth_session'
+        config['auth_state_dir'] = tempfile.mkdtemp()
+        config['get_token_function'] = get_token_function
+
+        state = arris_stats_auth.load_session(config)
+        self.assertEqual(arris_stats_auth.get_login_delay(config, state), 0)
+        self.assertEqual(arris_stats.login(config, state), 'token1')
+        self.assertEqual(stat.S_IMODE(os.stat(arris_stats_auth.get_state_path(config)).st_mode), 0o600)
+
+        # A restart picks up the session, and isn't allowed to log in again straight away
+        state = arris_stats_auth.load_session(config)
+        self.assertEqual(state['token'], 'token1')
+        self.assertEqual(state['session'].cookies.get('sessionId', domain='192.168.100.1'), 'abc123')
+        self.assertGreater(arris_stats_auth.get_login_delay(config, state), 50)
+
+        # Clearing the session forgets it, but not when we last logged in
+        arris_stats_auth.clear_session(config, state)
+        state = arris_stats_auth.load_session(config)
+        self.assertIsNone(state['token'])
+        self.assertEqual(len(state['session'].cookies), 0)
+        self.assertGreater(arris_stats_auth.get_login_delay(config, state), 50)
+        self.assertEqual(len(logins), 1)
+
+    def test_login_failures(self):
+        """ Test a failed or put off login neither exits with exit_on_auth_error = False nor trips the circuit breaker, and logins are never retried """
+        import threading  # pylint: disable=import-outside-toplevel
+        import mock_modem  # pylint: disable=import-outside-toplevel
+        import arris_stats_auth  # pylint: disable=import-outside-toplevel
+        import arris_stats_retry  # pylint: disable=import-outside-toplevel
+
+        server = mock_modem.MockModemServer(('127.0.0.1', 0), ['sb8200'], auth=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        config = arris_stats.get_config()
+        config.update({'modem_id': 'test_login_failures', 'modem_model': 'sb8200', 'modem_url': server.get_modem_url(0), 'modem_auth_required': 'True',
+                       'modem_password': 'wrong', 'exit_on_auth_error': 'False', 'sleep_before_exit': 'False', 'circuit_breaker_failures': '1', 'modem_retry_backoff': '0.01'})
+        config = arris_stats.normalize_config(config)
+        state = arris_stats_auth.load_session(config)
+
+        # Wrong password, then min_login_interval holds the next login off, neither exits
+        for _ in range(2):
+            self.assertFalse(arris_stats.poll_stats(config, state, 1000))
+        self.assertEqual(arris_stats_retry.get_circuit_breaker(config).consecutive_failures, 0)
+        self.assertEqual(server.get_counts()['failed_logins'], 1)
+
+        # A login that gets a 500 isn't retried, it would be another login
+        server.error_rate = 1
+        state['last_login'] = 0
+        self.assertFalse(arris_stats.poll_stats(config, state, 1000))
+        self.assertEqual(server.get_counts()['requests'], 2)
+
+    def test_modem_request(self):
+        """ Test arris_stats_retry retries with backoff, keeps to the deadline and trips the circuit breaker """
+        import io  # pylint: disable=import-outside-toplevel
+        import time  # pylint: disable=import-outside-toplevel
+        import requests  # pylint: disable=import-outside-toplevel
+        import arris_stats_retry  # pylint: disable=import-outside-toplevel
+
+        class StandInSession:
+            """ Answers with the queued responses, raising any that are exceptions """
+            def __init__(self, responses):
+                self.responses = responses
+                self.timeouts = []
+
+            def request(self, method, url, timeout, **kwargs):  # pylint: disable=unused-argument
+                self.timeouts.append(timeout)
+                response = self.responses.pop(0)
+                if isinstance(response, Exception):
+                    raise response
+                return response
+
+        ok = requests.models.Response()
+        ok.status_code = 200
+        busy = requests.models.Response()
+        busy.status_code = 503
+        busy.raw = io.BytesIO()
+
+        config = arris_stats.get_config()
+        config['modem_retry_backoff'] = 0.01
+
+        # Two failures then success, each request gets the configured timeouts
+        session = StandInSession([requests.exceptions.ConnectTimeout('wedged'), busy, ok])
+        self.assertIs(arris_stats_retry.modem_request(config, session, 'GET', 'http://modem/'), ok)
+        self.assertEqual(session.timeouts, [(5, 30)] * 3)
+
+        # Out of retries, the last error is raised
+        session = StandInSession([requests.exceptions.ConnectionError('down')] * 3)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            arris_stats_retry.modem_request(config, session, 'GET', 'http://modem/')
+
+        # The read timeout is cut down to what's left of the deadline, and there's no retry once it's gone
+        config['modem_retry_backoff'] = 10
+        session = StandInSession([requests.exceptions.ReadTimeout('slow'), ok])
+        with arris_stats_retry.deadline(2):
+            with self.assertRaises(arris_stats_retry.DeadlineExceeded):
+                arris_stats_retry.modem_request(config, session, 'GET', 'http://modem/')
+        self.assertLessEqual(max(session.timeouts[0]), 2)
+
+        # The breaker opens after enough failures, lets one poll through after the cooldown, and closes when it works
+        breaker = arris_stats_retry.CircuitBreaker('test', 2, 0.05)
+        breaker.record(False)
+        self.assertTrue(breaker.allow())
+        breaker.record(False)
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.record(True)
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.consecutive_failures, 0)
+
+    def test_archive(self):
+        """ Test arris_stats_archive dedups pages, rolls and evicts segments, and reads back what it wrote """
+        import os  # pylint: disable=import-outside-toplevel
+        import tempfile  # pylint: disable=import-outside-toplevel
+        import sys  # pylint: disable=import-outside-toplevel
+        from unittest import mock  # pylint: disable=import-outside-toplevel
+        import arris_stats_archive  # pylint: disable=import-outside-toplevel
+
+        compressions = ['gzip']
+        try:
+            import zstandard  # pylint: disable=import-outside-toplevel,unused-import
+            compressions.append('zstd')
+        except ImportError:
+            pass
+
+        with open('tests/mockups/sb8200.html') as html_file:
+            page = html_file.read()
+
+        for compression in compressions:
+            with tempfile.TemporaryDirectory() as archive_dir:
+                # Repeated pages are stored once per segment
+                archive = arris_stats_archive.Archive(archive_dir, 1073741824, compression)
+                archive.add(page, 1, 'modem1', 'sb8200')
+                archive.add(page, 2, 'modem2', 'sb8200')
+                archive.add('<html>login</html>', 3, 'modem1', 'sb8200')
+                archive.close()
+                records = list(arris_stats_archive.read_segment(arris_stats_archive.list_segments(archive_dir)[0]))
+                self.assertEqual(['html' in record for record in records], [True, False, True])
+
+                pages = list(arris_stats_archive.read_archive(archive_dir))
+                self.assertEqual([(record['timestamp_ns'], record['modem_id'], record['html']) for record in pages],
+                                 [(1, 'modem1', page), (2, 'modem2', page), (3, 'modem1', '<html>login</html>')])
+
+            with tempfile.TemporaryDirectory() as archive_dir:
+                # Pages that don't compress away roll over into new segments, and the oldest are deleted to stay in budget
+                archive = arris_stats_archive.Archive(archive_dir, 16384, compression)
+                unique_pages = [os.urandom(600).hex() for _ in range(40)]
+                for timestamp_ns, unique_page in enumerate(unique_pages):
+                    archive.add(unique_page, timestamp_ns, None, 'sb8200')
+
+                # A segment still being written reads back up to its last page
+                self.assertEqual([record['html'] for record in arris_stats_archive.read_archive(archive_dir)][-1], unique_pages[-1])
+                archive.close()
+
+                segments = arris_stats_archive.list_segments(archive_dir)
+                self.assertGreater(len(segments), 1)
+                self.assertLessEqual(sum(os.path.getsize(segment) for segment in segments), 16384)
+                kept = [record['html'] for record in arris_stats_archive.read_archive(archive_dir)]
+                self.assertLess(len(kept), len(unique_pages))
+                self.assertEqual(kept, unique_pages[-len(kept):])
+
+        # An unknown compression, or zstd without zstandard, is caught before the first poll
+        config = arris_stats.get_config()
+        config.update({'archive_dir': tempfile.mkdtemp(), 'archive_compression': 'brotli'})
+        with self.assertRaises(RuntimeError):
+            arris_stats.normalize_config(dict(config))
+        with mock.patch.dict(sys.modules, {'zstandard': None}):
+            with self.assertRaises(RuntimeError):
+                arris_stats.normalize_config(dict(config, archive_compression='zstd'))
+
+    def test_backfill(self):
+        """ Test arris_stats_backfill parses saved pages in worker processes and sends them oldest first """
+        import io  # pylint: disable=import-outside-toplevel
+        import shutil  # pylint: disable=import-outside-toplevel
+        import contextlib  # pylint: disable=import-outside-toplevel
+        import arris_stats_backfill  # pylint: disable=import-outside-toplevel
+
+        config = arris_stats.get_config()
+        config['destinations'] = ['stdout_json']
+
+        with tempfile.TemporaryDirectory() as pages_dir:
+            # Named after their model like the mockups, saved newest model first
+            for age, model in enumerate(['sb8200', 'sb6183', 't25']):
+                shutil.copy('tests/mockups/%s.html' % model, pages_dir)
+                os.utime(os.path.join(pages_dir, model + '.html'), ns=(3000000000 - age * 1000000000,) * 2)
+            with open(os.path.join(pages_dir, 'login.html'), 'w') as page_file:
+                page_file.write('<html><body>Login</body></html>')
+            os.utime(os.path.join(pages_dir, 'login.html'), ns=(500000000,) * 2)
+
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                sent, failed = arris_stats_backfill.backfill(arris_stats_backfill.get_pages(pages_dir, 'sb8200', 'modem1'), config, 2, 2)
+
+        self.assertEqual((sent, failed), (3, 1))
+        polls = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([poll['timestamp_ns'] for poll in polls], [1000000000, 2000000000, 3000000000])
+        self.assertEqual({poll['modem_id'] for poll in polls}, {'modem1'})
+        with open('tests/mockups/t25.json') as expected_file:
+            self.assertEqual(polls[0]['downstream'], json.load(expected_file)['downstream'])
+
+    def test_detect_model(self):
+        """ Test arris_stats_detect fingerprints every mockup, and modem_model = auto picks up the right functions """
+        import arris_stats_html  # pylint: disable=import-outside-toplevel
+        import arris_stats_detect  # pylint: disable=import-outside-toplevel
+
+        for model in arris_stats.modems_supported:
+            with open('tests/mockups/%s.html' % model) as html_file:
+                html = html_file.read()
+            for backend in arris_stats_html.parser_backends_supported:
+                self.assertEqual(arris_stats_detect.fingerprint(html, backend), model)
+                # Without the model number in it, the table layout gives it away
+                self.assertEqual(arris_stats_detect.fingerprint(re.sub('(?i)sb8200|sb6183', '', html), backend), model)
+
+        # The T25 sends us off to its login page with a meta refresh
+        self.assertEqual(arris_stats_detect.fingerprint('<html><head><meta http-equiv="refresh" content="0; url=login.html"></head></html>'), 't25')
+        self.assertIsNone(arris_stats_detect.fingerprint('<html><body>Not a modem</body></html>'))
+
+        class StandInResponse:
+            """ Just enough of requests.Response """
+            status_code = 200
+            text = '<html><body><form>Username: Password:</form></body></html>'
+
+            def close(self):
+                pass
+
+        class StandInSession:
+            """ Counts the requests made """
+            requests_made = 0
+
+            def request(self, method, url, **kwargs):  # pylint: disable=unused-argument
+                self.requests_made += 1
+                return StandInResponse()
+
+        config = arris_stats.get_config()
+        config['modem_model'] = 'auto'
+        config['modem_url'] = 'http://detect.test/'
+        config = arris_stats.normalize_config(config)
+        self.assertIsNone(config['parse_html_function'])
+
+        # A login page means an SB8200, and the next modem at the same url doesn't need fetching
+        session = StandInSession()
+        self.assertTrue(arris_stats.detect_modem_model(config, {'session': session}))
+        self.assertEqual(config['modem_model'], 'sb8200')
+        self.assertEqual(config['parse_html_function'].__name__, 'parse_html_sb8200')
+        other_config = arris_stats.normalize_config(dict(config, modem_model='auto'))
+        self.assertTrue(arris_stats.detect_modem_model(other_config, {'session': session}))
+        self.assertEqual(session.requests_made, 1)
+
+        # No stats from the detected parser means it's worked out again
+        arris_stats.forget_modem_model(config)
+        self.assertEqual(config['modem_model'], 'auto')
+        self.assertNotIn('http://detect.test/', arris_stats_detect.detected_models)
+
+    def test_adaptive_polling(self):
+        """ Test arris_stats_adaptive speeds up on trouble and backs off, and the scheduler follows it """
+        import arris_stats_adaptive  # pylint: disable=import-outside-toplevel
+        import arris_stats_scheduler  # pylint: disable=import-outside-toplevel
+        from arris_stats_records import DownstreamChannel, UpstreamChannel  # pylint: disable=import-outside-toplevel
+
+        def get_stats(uncorrectables=0, snr=40.0, power=45.0, frequency=507000000):
+            return {
+                'downstream': [DownstreamChannel(1, frequency, 1.0, snr, 0, uncorrectables)],
+                'upstream': [UpstreamChannel(2, 35600000, power, None)]
+            }
+
+        config = arris_stats.get_config()
+        config['modem_id'] = 'adaptive_test'
+        config['adaptive_polling'] = True
+
+        arris_stats_adaptive.observe(get_stats(), config)
+        self.assertEqual(arris_stats_adaptive.get_interval(config), 300)
+
+        # Each threshold on its own drops the interval to the floor, then it backs off to the baseline
+        for stats in [get_stats(uncorrectables=1), get_stats(snr=36.5), get_stats(power=41.5)]:
+            arris_stats_adaptive.observe(stats, config)
+            self.assertEqual(arris_stats_adaptive.get_interval(config), 10)
+            intervals = []
+            for _ in range(6):
+                arris_stats_adaptive.observe(stats, config)
+                intervals.append(arris_stats_adaptive.get_interval(config))
+            self.assertEqual(intervals, [20, 40, 80, 160, 300, 300])
+
+        # Small changes and a channel moving to a new frequency aren't trouble
+        arris_stats_adaptive.observe(get_stats(snr=38.5, power=43.0), config)
+        arris_stats_adaptive.observe(get_stats(uncorrectables=500, snr=20.0, frequency=603000000), config)
+        self.assertEqual(arris_stats_adaptive.get_interval(config), 300)
+
+        # The scheduler moves onto the new interval's ticks after the last poll
+        scheduler = arris_stats_scheduler.Scheduler(300)
+        scheduler.advance(1000.0)
+        self.assertEqual(scheduler.advance(1001.0), (1200, 199.0))
+        scheduler.set_interval(10)
+        self.assertEqual(scheduler.advance(1205.0), (1210, 5.0))
+        scheduler.set_interval(300)
+        self.assertEqual(scheduler.advance(1211.0), (1500, 289.0))
+
+    def test_event_log(self):
+        """ Test arris_stats_events only turns entries past the high-water mark into events, across restarts, and they reach the destinations """
+        import arris_stats_events  # pylint: disable=import-outside-toplevel
+        import arris_stats_records  # pylint: disable=import-outside-toplevel
+        import arris_stats_line_protocol  # pylint: disable=import-outside-toplevel
+
+        def get_page(entries):
+            rows = ''.join('<tr><td>%s</td><td>%s</td><td>%s</td><td>%s</td></tr>' % entry for entry in entries)
+            return ('<html><body><table><tr><td>Status</td></tr></table><table><tr><th colspan=4>Event Log</th></tr>'
+                    '<tr><td>Date Time</td><td>Event ID</td><td>Event Level</td><td>Description</td></tr>%s</table></body></html>' % rows)
+
+        entries = [
+            ('Time Not Established', '68010100', '6', 'Honoring MDD; IP provisioning mode = IPv6'),
+            ('06/28/2021 23:53', '82000400', '3', 'Received Response to Broadcast Maintenance Request, But no Unicast Maintenance opportunities received - T4 time out;CM-MAC=00:00:00:00:00:00;'),
+            ('06/29/2021 00:12', '82000200', '3', 'No Ranging Response received - T3 time-out;CM-MAC=00:00:00:00:00:00;')
+        ]
+
+        with tempfile.TemporaryDirectory() as state_dir:
+            config = arris_stats.get_config()
+            config['modem_id'] = 'events_test'
+            config['event_log_state_dir'] = state_dir
+            self.assertEqual(arris_stats_events.get_event_log_url(dict(config, modem_url='http://192.168.100.1/RgConnect.asp', modem_model='sb6183')), 'http://192.168.100.1/RgEventLog.asp')
+
+            events = arris_stats_events.get_new_events(get_page(entries[:2]), config)
+            self.assertEqual([event.to_dict() for event in events], [
+                {'date_time': 'Time Not Established', 'event_id': 68010100, 'level': '6', 'description': entries[0][3]},
+                {'date_time': '06/28/2021 23:53', 'event_id': 82000400, 'level': '3', 'description': entries[1][3]}
+            ])
+
+            # The same page again, then a new entry, including after a restart
+            self.assertEqual(arris_stats_events.get_new_events(get_page(entries[:2]), config), [])
+            arris_stats_events.high_water_marks.clear()
+            events = arris_stats_events.get_new_events(get_page(entries), config)
+            self.assertEqual([event.event_id for event in events], [82000200])
+
+            # The modem logging the newest entry again, twice
+            events = arris_stats_events.get_new_events(get_page(entries + entries[2:]), config)
+            self.assertEqual([event.event_id for event in events], [82000200])
+            arris_stats_events.high_water_marks.clear()
+            events = arris_stats_events.get_new_events(get_page(entries + entries[2:] * 2 + entries[1:2]), config)
+            self.assertEqual([event.event_id for event in events], [82000200, 82000400])
+
+            # A cleared log after a reboot is all new
+            events = arris_stats_events.get_new_events(get_page(entries[:1]), config)
+            self.assertEqual([event.event_id for event in events], [68010100])
+
+            # The newest entry logged again after something else is new, it isn't the one already sent
+            events = arris_stats_events.get_new_events(get_page(entries[:2] + entries[:1]), config)
+            self.assertEqual([event.event_id for event in events], [82000400, 68010100])
+            events = arris_stats_events.get_new_events(get_page(entries[:2] + entries[:1] * 2), config)
+            self.assertEqual([event.event_id for event in events], [68010100])
+
+        # Events go out a nanosecond apart, and survive the spool's round trip
+        stats = {'downstream': [], 'upstream': [], 'events': events + [arris_stats_records.ModemEvent('Time Not Established', None, '3', 'Said "hi"')]}
+        lines = arris_stats_line_protocol.encode_stats(stats, 1000, {'modem_id': 'events_test'})
+        self.assertEqual(lines[1], 'modem_events,modem_id=events_test date_time="Time Not Established",level="3",description="Said \\"hi\\"" 1001')
+        self.assertEqual(arris_stats_records.stats_from_dict(json.loads(json.dumps(arris_stats_records.stats_to_dict(stats)))), stats)
+
+    def test_event_log_pages(self):
+        """ Every model's event log mockup turns into the same events as its json, and only new rows are parsed """
+        from unittest import mock  # pylint: disable=import-outside-toplevel
+        import arris_stats_events  # pylint: disable=import-outside-toplevel
+
+        for model in arris_stats.modems_supported:
+            with open('tests/mockups/%s_eventlog.json' % model) as f:
+                control_values = json.load(f)
+            with open('tests/mockups/%s_eventlog.html' % model) as f:
+                html = f.read()
+
+            config = arris_stats.get_config()
+            config['modem_id'] = 'events_%s' % model
+            events = arris_stats_events.get_new_events(html, config)
+            self.assertEqual([event.to_dict() for event in events], control_values, model)
+            # Repeated entries in the log don't hide the same page's newest entry next time
+            arris_stats_events.high_water_marks[config['modem_id']].pop('page')
+            self.assertEqual(arris_stats_events.get_new_events(html, config), [], model)
+
+        # A long log with two new entries at the bottom, only those, the mark and the row before it are parsed
+        rows = ''.join('<tr><td>10/%02d/2026 12:00</td><td>%s</td><td>5</td><td>Lost MDD Timeout</td></tr>' % (day % 28 + 1, day) for day in range(200))
+        page = ('<table><tr><td>Date Time</td><td>Event ID</td><td>Event Level</td><td>Description</td></tr>%s</table>')
+        config = dict(arris_stats.get_config(), modem_id='events_lazy')
+        self.assertEqual(len(arris_stats_events.get_new_events(page % rows, config)), 200)
+        new_rows = '<tr><td>10/20/2026 12:00</td><td>1</td><td>3</td><td>T3 &amp; T4</td></tr>' * 2
+        with mock.patch.object(arris_stats_events, 'get_cells', wraps=arris_stats_events.get_cells) as get_cells:
+            events = arris_stats_events.get_new_events(page % (rows + new_rows), config)
+        self.assertEqual([event.description for event in events], ['T3 & T4'] * 2)
+        self.assertEqual(get_cells.call_count, 4)
+
+    def test_probes(self):
+        """ Test arris_stats_probe times tcp, dns and http probes at once, and the results reach the destinations """
+        import socket  # pylint: disable=import-outside-toplevel
+        import threading  # pylint: disable=import-outside-toplevel
+        import arris_stats_probe  # pylint: disable=import-outside-toplevel
+        import arris_stats_records  # pylint: disable=import-outside-toplevel
+        import arris_stats_prometheus  # pylint: disable=import-outside-toplevel
+        import arris_stats_line_protocol  # pylint: disable=import-outside-toplevel
+        from http.server import BaseHTTPRequestHandler, HTTPServer  # pylint: disable=import-outside-toplevel
+
+        class Handler(BaseHTTPRequestHandler):
+            """ Answers every HEAD with a 204 """
+            def do_HEAD(self):  # pylint: disable=invalid-name
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        # Nothing listens on a port we've just closed
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        closed_port = closed.getsockname()[1]
+        closed.close()
+
+        with self.assertRaises(RuntimeError):
+            arris_stats_probe.get_targets('ping:1.1.1.1')
+
+        config = arris_stats.get_config()
+        config['probe_targets'] = 'tcp:127.0.0.1:%s, dns:localhost, http://127.0.0.1:%s/health?full=1, tcp:127.0.0.1:%s' % (server.server_port, server.server_port, closed_port)
+        config = arris_stats.normalize_config(config)
+        self.assertEqual([kind for kind, _ in config['probe_target_list']], ['tcp', 'dns', 'http', 'tcp'])
+
+        probes = arris_stats.start_probes(config).wait()
+        server.shutdown()
+        self.assertEqual([(probe.kind, probe.success, probe.status_code) for probe in probes], [('tcp', 1, None), ('dns', 1, None), ('http', 1, 204), ('tcp', 0, None)])
+        self.assertTrue(all(0 < probe.latency_ms < 2000 for probe in probes[:3]))
+        self.assertIsNone(probes[3].latency_ms)
+
+        stats = {'downstream': [], 'upstream': [], 'timestamp_ns': 1000, 'probes': probes}
+        lines = arris_stats_line_protocol.encode_stats(stats, 1000)
+        self.assertEqual(lines[3], 'probe_statistics,kind=tcp,target=127.0.0.1:%s success=0i 1000' % closed_port)
+        self.assertEqual(arris_stats_records.stats_from_dict(json.loads(json.dumps(arris_stats_records.stats_to_dict(stats)))), stats)
+        samples = arris_stats_prometheus.get_samples(stats, None, 1)
+        self.assertEqual(samples['arris_probe_success'][3], 'arris_probe_success{kind="tcp",target="127.0.0.1:%s"} 0' % closed_port)
+
+    def test_aggregate(self):
+        """ Test arris_stats_aggregate summarises each window per channel, counts anomalies, grows with the channels and flushes the open window """
+        import numpy  # pylint: disable=import-outside-toplevel
+        from unittest import mock  # pylint: disable=import-outside-toplevel
+        import arris_stats_aggregate  # pylint: disable=import-outside-toplevel
+        import arris_stats_records  # pylint: disable=import-outside-toplevel
+        import arris_stats_line_protocol  # pylint: disable=import-outside-toplevel
+        from arris_stats_records import DownstreamChannel, UpstreamChannel  # pylint: disable=import-outside-toplevel
+
+        config = arris_stats.get_config()
+        config.update({'aggregate_window': '60', 'aggregate_raw': 'False', 'modem_id': 'aggregate_test'})
+        config = arris_stats.normalize_config(config)
+
+        # A poll every 5 seconds, the SNR is steady until the last poll of the window,
+        # and channel 2 only shows up on the fifth poll
+        for index in range(12):
+            downstream = [DownstreamChannel(1, 555000000, float(index + 1), 40.0 if index < 11 else 30.0, index * 10, 3)]
+            if index >= 4:
+                downstream.append(DownstreamChannel(2, 561000000, 2.0, 38.0, 0, 0))
+            stats = {'downstream': downstream, 'upstream': [UpstreamChannel(1, 35600000, 45.0)]}
+            arris_stats.add_timestamp(stats, index * 5000000000, config)
+            arris_stats.aggregate_stats(stats, config)
+            self.assertEqual(stats['downstream'], [])
+            self.assertNotIn('downstream_summary', stats)
+
+        # The first poll of the next window sends the last one's summaries
+        stats = {'downstream': [DownstreamChannel(1, 555000000, 1.0, 40.0, 0, 0)], 'upstream': []}
+        arris_stats.add_timestamp(stats, 61000000000, config)
+        arris_stats.aggregate_stats(stats, config)
+        first, second = stats['downstream_summary']
+        self.assertEqual((first.channel_id, first.timestamp_ns, first.samples), (1, 0, 12))
+        self.assertEqual((first.power_min, first.power_max, first.power_mean), (1.0, 12.0, 6.5))
+        self.assertAlmostEqual(first.power_p95, numpy.percentile(range(1, 13), 95))
+        self.assertEqual((first.snr_min, first.snr_anomalies, first.corrected, first.uncorrectables), (30.0, 1, 110, 3))
+        self.assertEqual((second.channel_id, second.samples, second.snr_mean, second.snr_anomalies), (2, 8, 38.0, 0))
+        self.assertEqual([(summary.samples, summary.power_mean) for summary in stats['upstream_summary']], [(12, 45.0)])
+
+        lines = arris_stats_line_protocol.encode_stats(stats, stats['timestamp_ns'], {'modem_id': 'aggregate_test'})
+        self.assertIn('upstream_summary,channel_id=1,modem_id=aggregate_test samples=12i,power_min=45.0,power_max=45.0,power_mean=45.0,power_p95=45.0,power_anomalies=0i 0', lines)
+        self.assertEqual(arris_stats_records.stats_from_dict(json.loads(json.dumps(arris_stats_records.stats_to_dict(stats)))), stats)
+
+        # The window the last poll opened is sent at exit, once
+        flushed = [(stats, config) for stats, config in arris_stats_aggregate.flush_aggregators() if config['modem_id'] == 'aggregate_test']
+        self.assertEqual(len(flushed), 1)
+        stats = flushed[0][0]
+        self.assertEqual((stats['timestamp_ns'], stats['downstream']), (61000000000, []))
+        self.assertNotIn('upstream_summary', stats)
+        self.assertEqual([(summary.channel_id, summary.timestamp_ns, summary.samples, summary.power_mean) for summary in stats['downstream_summary']], [(1, 60000000000, 1, 1.0)])
+        self.assertEqual([config for _, config in arris_stats_aggregate.flush_aggregators() if config['modem_id'] == 'aggregate_test'], [])
+
+        # With aggregate_raw = False, polls that don't close a window aren't sent at all
+        with open('tests/mockups/sb6183.html') as html_file:
+            html = html_file.read()
+        config = arris_stats.get_config()
+        config.update({'aggregate_window': '60', 'aggregate_raw': 'False', 'modem_id': 'aggregate_send_test', 'modem_model': 'sb6183'})
+        config = arris_stats.normalize_config(config)
+        sent = []
+        with mock.patch.object(arris_stats, 'fetch_html', return_value=(html, False)), \
+                mock.patch.object(arris_stats, 'send_stats', lambda stats, config: sent.append(stats)):
+            for timestamp_ns in [0, 30000000000, 61000000000]:
+                self.assertTrue(arris_stats.poll_stats(config, {}, timestamp_ns))
+        self.assertEqual([(stats['timestamp_ns'], len(stats['downstream_summary'])) for stats in sent], [(61000000000, 16)])
+        arris_stats_aggregate.flush_aggregators()
+
+        # A channel that hasn't moved at all has no variance, a tenth of a dB isn't an anomaly but a real drop is
+        aggregator = arris_stats_aggregate.Aggregator(arris_stats_records.DownstreamSummary, 60000000000, 60, 3)
+        for index, snr in enumerate([40.0] * 12 + [40.1, 30.0]):
+            aggregator.add([DownstreamChannel(1, 555000000, 1.0, snr, 0, 0)], index)
+        self.assertEqual(aggregator.flush()[0].snr_anomalies, 1)
+
+    def test_mock_modem(self):
+        """ Test the collector logs in to and parses every model served by tests/mock_modem.py, and survives its faults """
+        import tempfile  # pylint: disable=import-outside-toplevel
+        import threading  # pylint: disable=import-outside-toplevel
+        import mock_modem  # pylint: disable=import-outside-toplevel
+        import time  # pylint: disable=import-outside-toplevel
+        import arris_stats_auth  # pylint: disable=import-outside-toplevel
+        import arris_stats_fleet  # pylint: disable=import-outside-toplevel
+        import arris_stats_retry  # pylint: disable=import-outside-toplevel
+
+        def start(**options):
+            server = mock_modem.MockModemServer(('127.0.0.1', 0), ['sb8200', 'sb6183', 't25'], 6, auth=True, **options)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.addCleanup(server.server_close)
+            self.addCleanup(server.shutdown)
+            return server
+
+        def get_modems(server, **settings):
+            config = arris_stats.get_config()
+            config.update({'modem_retries': '0', 'modem_read_timeout': '1', 'exit_on_auth_error': 'False', 'circuit_breaker_failures': '0'})
+            config.update(settings)
+            with tempfile.NamedTemporaryFile('w', suffix='.ini', delete=False) as inventory:
+                inventory.write(server.get_inventory())
+            self.addCleanup(os.remove, inventory.name)
+            return arris_stats_fleet.get_inventory(inventory.name, config)
+
+        # Every model logs in its own way, then serves the page its parser expects
+        server = start()
+        for modem_config in get_modems(server):
+            state = arris_stats_auth.load_session(modem_config)
+            for _ in range(2):
+                html = arris_stats_fleet.fetch_html(modem_config, state, arris_stats_retry.get_deadline(modem_config))
+                self.assertTrue(modem_config['parse_html_function'](html)['downstream'], modem_config['modem_id'])
+        self.assertEqual(server.get_counts()['logins'], 4)
+        self.assertEqual(server.get_counts()['status_pages'], 12)
+
+        # auto works the model out from the login page and the meta refresh
+        for modem_config in get_modems(server, modem_model='auto')[:3]:
+            modem_config = arris_stats.normalize_config(dict(modem_config, modem_model='auto'))
+            self.assertIsNotNone(arris_stats_fleet.fetch_html(modem_config, arris_stats_auth.load_session(modem_config), arris_stats_retry.get_deadline(modem_config)))
+
+        # A wrong password, a login page instead of the stats, a 500 and a hang all come back as no html
+        modem_config = dict(get_modems(server)[0], modem_password='wrong')
+        self.assertIsNone(arris_stats_fleet.fetch_html(modem_config, arris_stats_auth.load_session(modem_config), arris_stats_retry.get_deadline(modem_config)))
+        self.assertEqual(server.get_counts()['failed_logins'], 1)
+        for options in [{'login_page_rate': 1}, {'error_rate': 1}, {'hang_rate': 1, 'hang_seconds': 2}]:
+            server = start(**options)
+            modem_config = get_modems(server)[1]
+            self.assertIsNone(arris_stats_fleet.fetch_html(modem_config, arris_stats_auth.load_session(modem_config), arris_stats_retry.get_deadline(modem_config)), options)
+
+        # The event log gets what's left of the poll's deadline, not one of its own, and connecting counts against it too
+        server = start(hang_rate=1, hang_seconds=2)
+        modem_config = dict(get_modems(server)[1], event_log=True)
+        state = arris_stats_auth.load_session(modem_config)
+        started = time.monotonic()
+        until = started + 0.3
+        self.assertIsNone(arris_stats_fleet.fetch_html(modem_config, state, until))
+        self.assertIsNone(arris_stats_fleet.fetch_events(modem_config, state, until))
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertEqual(server.get_counts()['hangs'], 1)
+
+    def test_once(self):
+        """ Test --once exits 0 after a poll the destination took, and non-zero when the modem or the destination fails """
+        import sys  # pylint: disable=import-outside-toplevel
+        import subprocess  # pylint: disable=import-outside-toplevel
+        import threading  # pylint: disable=import-outside-toplevel
+        import mock_modem  # pylint: disable=import-outside-toplevel
+
+        def run_once(settings=None, **options):
+            server = mock_modem.MockModemServer(('127.0.0.1', 0), ['sb6183'], 1, **options)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.addCleanup(server.server_close)
+            self.addCleanup(server.shutdown)
+            env = {
+                'PATH': os.environ.get('PATH', ''),
+                'destination': 'stdout_json',
+                'log_level': 'error',
+                'modem_model': 'sb6183',
+                'modem_url': server.get_modem_url(0),
+                'modem_retries': '0'
+            }
+            env.update(settings or {})
+            return subprocess.run([sys.executable, 'src/arris_stats.py', '--once'], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60, check=False)
+
+        result = run_once()
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertTrue(json.loads(result.stdout)['downstream'])
+
+        # The modem answers every request with a 500
+        result = run_once(error_rate=1)
+        self.assertNotEqual(result.returncode, 0)
+        self.assertEqual(result.stdout, b'')
+
+        # The stats are fetched but InfluxDB isn't listening
+        result = run_once({'destination': 'influxdb', 'influx_host': '127.0.0.1', 'influx_port': '1'})
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn(b'Failed To Write To InfluxDB', result.stderr)
 
 if __name__ == '__main__':
     unittest.main()